@@ -0,0 +1,219 @@
+"""
+Agenda local de la placa: las programaciones de las próximas horas se
+compilan a una tabla binaria y se mandan por MQTT. La placa la guarda en
+flash y la ejecuta con su RTC (sincronizado por NTP), así un corte de WiFi
+o del broker en medio de un experimento no deja los relés colgados.
+
+Tabla: entradas struct ">IBB" = (epoch UTC, máscara a encender, máscara a
+apagar), ordenadas por epoch. Bit i-1 = relé l<i> (como ProtocoloBinario).
+
+Envío (topico_cmd + "/agenda"), en trozos de hasta ENTRADAS_POR_TROZO:
+    [version uint32][indice uint16][total uint16] + entradas
+Agenda vacía = un único trozo sin entradas (versión 0).
+
+La placa arma la tabla en un archivo temporal, la reemplaza al recibir el
+último trozo y publica (retenido) en topico_estado + "/agenda":
+    {"version": v, "entradas": n, "rtc": 1|0}
+version = crc32 de las entradas. Solo se reenvía si la placa reporta otra
+versión o si cambió la parte futura de la tabla.
+"""
+import json
+import time
+import zlib
+import struct
+import threading
+from datetime import datetime
+
+import Logs
+
+log = Logs.obtener_logger("agenda")
+
+SUFIJO = "/agenda"
+ENTRADA = struct.Struct(">IBB")
+CABECERA = struct.Struct(">IHH")
+ENTRADAS_POR_TROZO = 32
+HORIZONTE_S = 24 * 3600
+
+_BIT = {"l{}".format(i): 1 << (i - 1) for i in range(1, 9)}
+
+
+def _epoch(s: str) -> int:
+    s = (s or "").strip()
+    if len(s) == 16:  # YYYY-MM-DD HH:MM
+        s += ":00"
+    # hora local del PC -> epoch UTC (la placa corre en UTC por NTP)
+    return int(datetime.strptime(s, "%Y-%m-%d %H:%M:%S").timestamp())
+
+
+def _mascara(targets) -> int:
+    m = 0
+    for k in targets or []:
+        m |= _BIT.get(k, 0)
+    return m
+
+
+def compilar(programaciones, ahora=None, horizonte_s=HORIZONTE_S):
+    """
+    programaciones (de una sola placa) -> [(epoch, encender, apagar)].
+
+    Misma regla que el PC: en cada borde (inicio, fin + 1 s) lo activo gana,
+    la de inicio más reciente pisa a las anteriores, y fin_accion solo se
+    aplica a relés que ninguna otra activa controla. La primera entrada es
+    el borde más reciente ya pasado (estado vigente), para que la placa se
+    ponga al día si se reinicia en medio de una programación.
+    """
+    ahora = int(ahora if ahora is not None else time.time())
+    progs = []
+    for p in programaciones:
+        if not p.get("activo", True):
+            continue
+        try:
+            inicio, fin = _epoch(p.get("inicio")), _epoch(p.get("fin"))
+        except Exception:
+            continue
+        mascara = _mascara(p.get("targets"))
+        if mascara and fin >= inicio:
+            progs.append((inicio, fin, mascara, p.get("accion", "on"), p.get("fin_accion", "off")))
+    if not progs:
+        return []
+    progs.sort(key=lambda x: x[0])
+
+    bordes = sorted({b for inicio, fin, *_ in progs for b in (inicio, fin + 1)})
+    pasados = [b for b in bordes if b <= ahora]
+    limite = ahora + horizonte_s
+    bordes = pasados[-1:] + [b for b in bordes if ahora < b <= limite]
+
+    entradas = []
+    for t in bordes:
+        encender = apagar = 0
+        for inicio, fin, mascara, accion, _ in progs:
+            if inicio <= t <= fin:
+                if accion == "on":
+                    encender, apagar = encender | mascara, apagar & ~mascara
+                else:
+                    encender, apagar = encender & ~mascara, apagar | mascara
+        controlados = encender | apagar
+        for inicio, fin, mascara, _, fin_accion in progs:
+            if fin + 1 == t:
+                libres = mascara & ~controlados
+                if fin_accion == "on":
+                    encender |= libres
+                else:
+                    apagar |= libres
+        if encender or apagar:
+            entradas.append((t, encender, apagar))
+    return entradas
+
+
+def version(entradas) -> int:
+    return zlib.crc32(b"".join(ENTRADA.pack(*e) for e in entradas)) & 0xFFFFFFFF
+
+
+def trozos(entradas):
+    """Paquetes a publicar, en orden."""
+    v = version(entradas)
+    total = max(1, -(-len(entradas) // ENTRADAS_POR_TROZO))
+    for i in range(total):
+        parte = entradas[i * ENTRADAS_POR_TROZO:(i + 1) * ENTRADAS_POR_TROZO]
+        yield CABECERA.pack(v, i, total) + b"".join(ENTRADA.pack(*e) for e in parte)
+
+
+class SincronizadorAgenda:
+    """
+    Mantiene la agenda de cada placa al día con las programaciones.
+
+    sincronizar() se llama en cada tick (se limita solo a periodo_s); la
+    placa confirma publicando su versión, que llega por _on_agenda desde el
+    hilo de MQTT. Las placas que nunca reportaron agenda (firmware viejo)
+    se ignoran: para ellas sigue mandando comandos el PC.
+    """
+
+    def __init__(self, servidor_mqtt, periodo_s=5.0, reintento_s=30.0):
+        self.mqtt = servidor_mqtt
+        self.periodo_s = periodo_s
+        self.reintento_s = reintento_s
+        self._reportadas = {}  # placa -> {"version", "entradas", "rtc"}
+        self._enviadas = {}    # placa -> (version, entradas, monotonic)
+        self._proxima = 0.0
+        self._lock = threading.Lock()
+        self.envios = 0
+
+    def suscribir(self, filtro_estado):
+        self.mqtt.suscribir(filtro_estado + SUFIJO, self._on_agenda)
+
+    def _on_agenda(self, topic, payload):
+        try:
+            data = json.loads(payload.decode("utf-8", errors="ignore"))
+        except Exception as e:
+            log.warning("Agenda: estado inválido de %s: %s", topic, e)
+            return
+        if not isinstance(data, dict):
+            return
+        disp = self.mqtt.id_dispositivo(topic[:-len(SUFIJO)]) if self.mqtt.modo_flota else None
+        with self._lock:
+            self._reportadas[disp] = data
+
+    def estado(self, dispositivo=None):
+        """None si la placa no soporta agenda; si no {"version", "entradas", "rtc", "sincronizada"}."""
+        with self._lock:
+            rep = self._reportadas.get(dispositivo)
+            env = self._enviadas.get(dispositivo)
+        if rep is None:
+            return None
+        est = dict(rep)
+        est["sincronizada"] = env is not None and rep.get("version") == env[0]
+        return est
+
+    def _al_dia(self, dispositivo, entradas, ahora) -> bool:
+        with self._lock:
+            rep = self._reportadas.get(dispositivo)
+            env = self._enviadas.get(dispositivo)
+        if rep is None or env is None or rep.get("version") != env[0]:
+            return False
+        # lo enviado sigue valiendo si lo que queda por delante no cambió
+        desde = entradas[0][0] if entradas else ahora + 1
+        return [e for e in env[1] if e[0] >= desde] == entradas
+
+    def sincronizar(self, programaciones, dispositivo_de=lambda p: None, forzar=False):
+        """
+        programaciones: todas las del gestor (pasar [] para vaciar las agendas,
+        ej. con la placa en pausa). dispositivo_de(prog) -> id de la placa.
+        """
+        ahora_m = time.monotonic()
+        if not forzar and ahora_m < self._proxima:
+            return 0
+        self._proxima = ahora_m + self.periodo_s
+        if not getattr(self.mqtt, "conectado", False):
+            return 0
+
+        with self._lock:
+            placas = list(self._reportadas)
+        por_placa = {d: [] for d in placas}
+        for p in programaciones:
+            d = dispositivo_de(p)
+            if d in por_placa:
+                por_placa[d].append(p)
+
+        ahora = int(time.time())
+        enviadas = 0
+        for d, progs in por_placa.items():
+            entradas = compilar(progs, ahora)
+            if self._al_dia(d, entradas, ahora):
+                continue
+            v = version(entradas)
+            with self._lock:
+                if self._reportadas[d].get("version") == v:
+                    # ya la tiene (ej. la app se reinició): solo anotarla
+                    self._enviadas[d] = (v, entradas, ahora_m)
+                    continue
+                env = self._enviadas.get(d)
+            if env is not None and env[0] == v and ahora_m - env[2] < self.reintento_s:
+                continue  # ya mandada, esperando que la placa la confirme
+            topico = self.mqtt.topico_cmd_dispositivo(d) + SUFIJO
+            if all(self.mqtt.publicar(topico, t, qos=1) for t in trozos(entradas)):
+                with self._lock:
+                    self._enviadas[d] = (v, entradas, ahora_m)
+                self.envios += 1
+                enviadas += 1
+                log.info("Agenda: %s entradas (v%08x) a %s", len(entradas), v, d or "la placa")
+        return enviadas
@@ -1,80 +1,742 @@
+import os
+import re
+import json
 import time
+import asyncio
+import random
+import atexit
+import threading
+from collections import deque, OrderedDict
 import paho.mqtt.client as mqtt
 import Settings as ST
+import Metricas
+import ProtocoloBinario as PB
+import Logs
 
+log = Logs.obtener_logger("mqtt")
+
+_RE_RELE = re.compile(r"^l\d+$")
+
+
+def _temporizado(comando: dict) -> bool:
+    """Pulso/patrón: repetirlo reinicia el tiempo en la placa (no es idempotente)."""
+    return "for_ms" in comando or "patron" in comando
+
+
+class ArbolTopicos:
+    """
+    Trie de filtros MQTT -> handlers, con comodines + y #.
+
+    Cada nivel del filtro es un nodo; despachar un tópico cuesta
+    O(profundidad del tópico) sin importar cuántos filtros haya.
+    Un mismo filtro puede tener varios handlers.
+
+    Reglas (MQTT 3.1.1):
+      - '+' coincide con exactamente un nivel (puede ser vacío)
+      - '#' coincide con el nivel padre y todos los de abajo ("a/#" ~ "a")
+      - los tópicos que empiezan con '$' no coinciden con un comodín inicial
+    """
+
+    class _Nodo:
+        __slots__ = ("hijos", "handlers")
+
+        def __init__(self):
+            self.hijos = {}
+            self.handlers = []
 
-class ServidorMQTT:
     def __init__(self):
+        self._raiz = self._Nodo()
+        self._filtros = {}  # filtro -> nodo (para listar/re-suscribir)
+
+    def agregar(self, filtro, handler):
+        nodo = self._raiz
+        for nivel in filtro.split("/"):
+            hijo = nodo.hijos.get(nivel)
+            if hijo is None:
+                hijo = self._Nodo()
+                nodo.hijos[nivel] = hijo
+            nodo = hijo
+        if handler not in nodo.handlers:
+            nodo.handlers.append(handler)
+        self._filtros[filtro] = nodo
+
+    def quitar(self, filtro, handler=None):
+        """Quita un handler (o todos si handler=None). Devuelve True si quitó algo."""
+        niveles = filtro.split("/")
+        camino = [self._raiz]
+        for nivel in niveles:
+            hijo = camino[-1].hijos.get(nivel)
+            if hijo is None:
+                return False
+            camino.append(hijo)
+
+        nodo = camino[-1]
+        if handler is None:
+            quitado = bool(nodo.handlers)
+            nodo.handlers = []
+        elif handler in nodo.handlers:
+            nodo.handlers.remove(handler)
+            quitado = True
+        else:
+            quitado = False
+
+        if not nodo.handlers:
+            self._filtros.pop(filtro, None)
+            # podar nodos vacíos de abajo hacia arriba
+            for i in range(len(niveles), 0, -1):
+                n = camino[i]
+                if n.handlers or n.hijos:
+                    break
+                del camino[i - 1].hijos[niveles[i - 1]]
+        return quitado
+
+    def filtros(self):
+        return list(self._filtros.keys())
+
+    def __contains__(self, filtro):
+        return filtro in self._filtros
+
+    def __len__(self):
+        return len(self._filtros)
+
+    def coincidencias(self, topic):
+        """Handlers de todos los filtros que coinciden con el tópico."""
+        niveles = topic.split("/")
+        n = len(niveles)
+        encontrados = []
+        pendientes = [(self._raiz, 0)]
+
+        while pendientes:
+            nodo, i = pendientes.pop()
+
+            comodin_ok = not (i == 0 and topic.startswith("$"))
+
+            # '#' coincide con este nivel y todo lo que sigue
+            if comodin_ok:
+                multi = nodo.hijos.get("#")
+                if multi is not None:
+                    encontrados.extend(multi.handlers)
+
+            if i == n:
+                encontrados.extend(nodo.handlers)
+                continue
+
+            exacto = nodo.hijos.get(niveles[i])
+            if exacto is not None:
+                pendientes.append((exacto, i + 1))
+            if comodin_ok:
+                uno = nodo.hijos.get("+")
+                if uno is not None:
+                    pendientes.append((uno, i + 1))
+
+        return encontrados
+
+
+class ColaSalida:
+    """
+    Comandos que no se pudieron publicar (broker caído), para reenviar al reconectar.
+
+    - Acotada a max_items: si se llena se descarta el más viejo.
+    - Colapsa comandos superados: por (tópico, relé) solo queda el último
+      ({"l3":"on"} y después {"l3":"off"} -> queda solo "off").
+    - Orden de reenvío = orden del último cambio de cada entrada.
+    - ruta: si se indica, la cola se guarda en disco (JSON) y sobrevive
+      a un reinicio de la app. agregar() y compañía solo la marcan sucia;
+      un hilo la escribe (a lo sumo cada intervalo_guardado_s), así encolar
+      desde la UI nunca toca el disco.
+    - Vencimiento: un comando más viejo que max_edad_s no se reenvía (no
+      aplicar a los relés algo pedido hace horas). Los pulsos/patrones
+      vencen a los max_edad_temporizados_s y no se guardan en disco.
+    """
+
+    def __init__(self, max_items=256, ruta=None, max_edad_s=600.0, max_edad_temporizados_s=30.0):
+        self.max_items = max_items
+        self.ruta = ruta
+        self.max_edad_s = max_edad_s
+        self.max_edad_temporizados_s = max_edad_temporizados_s
+        self._items = OrderedDict()  # (topic, clave) -> (ts, topic, comando: dict)
+        self._lock = threading.Lock()
+        self.descartados = 0
+        self.vencidos = 0
+        self.intervalo_guardado_s = 0.5
+        self._sucia = threading.Event()
+        self._lock_archivo = threading.Lock()
+        self._cargar()
+        if self.ruta:
+            threading.Thread(target=self._hilo_guardado, name="ColaSalida", daemon=True).start()
+            atexit.register(self.vaciar)
+
+    def _vigente(self, ts, comando, ahora) -> bool:
+        edad = self.max_edad_temporizados_s if _temporizado(comando) else self.max_edad_s
+        return edad is None or ahora - ts <= edad
+
+    @staticmethod
+    def _partir(topic, comando: dict):
+        """Un comando por relé; el resto de las claves viajan juntas."""
+        if _temporizado(comando):
+            # pulso/patrón: relés y tiempos son una sola orden, no se separan
+            return [((topic, "|".join(sorted(comando))), dict(comando))]
+        partes = []
+        otros = {}
+        for k, v in comando.items():
+            if _RE_RELE.match(k):
+                partes.append(((topic, k), {k: v}))
+            else:
+                otros[k] = v
+        if otros:
+            partes.append(((topic, "|".join(sorted(otros))), otros))
+        return partes
+
+    def agregar(self, topic, comando: dict, ts=None):
+        ts = ts or time.time()
+        with self._lock:
+            for clave, parte in self._partir(topic, comando):
+                self._items.pop(clave, None)  # el nuevo reemplaza y va al final
+                self._items[clave] = (ts, topic, parte)
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+                    self.descartados += 1
+            self._guardar()
+
+    def tomar_todo(self):
+        """Vacía la cola y devuelve [(clave, (ts, topic, comando))] vigentes, en orden de envío."""
+        ahora = time.time()
+        with self._lock:
+            items = [(k, v) for k, v in self._items.items() if self._vigente(v[0], v[2], ahora)]
+            vencidos = len(self._items) - len(items)
+            self._items.clear()
+            self._guardar()
+        if vencidos:
+            self.vencidos += vencidos
+            log.warning("Cola MQTT: %s comandos vencidos descartados (no se reenvían)", vencidos)
+        return items
+
+    def devolver(self, items):
+        """Re-encola lo que no se pudo reenviar, delante, sin pisar comandos más nuevos."""
+        with self._lock:
+            for clave, valor in reversed(items):
+                if clave in self._items:
+                    continue
+                self._items[clave] = valor
+                self._items.move_to_end(clave, last=False)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.descartados += 1
+            self._guardar()
+
+    def profundidad(self) -> int:
+        return len(self._items)
+
+    def antiguedad_s(self) -> float:
+        """Segundos desde el comando más viejo en cola (0 si está vacía)."""
+        with self._lock:
+            if not self._items:
+                return 0.0
+            ts_min = min(ts for ts, _, _ in self._items.values())
+        return max(0.0, time.time() - ts_min)
+
+    # -------------------------
+    # Persistencia (opcional)
+    def _guardar(self):
+        """Se llama con _lock tomado: solo avisa al hilo de guardado."""
+        if self.ruta:
+            self._sucia.set()
+
+    def _hilo_guardado(self):
+        while True:
+            self._sucia.wait()
+            time.sleep(self.intervalo_guardado_s)  # junta varios cambios en una escritura
+            self._escribir()
+
+    def vaciar(self):
+        """Escribe ya lo pendiente (al salir)."""
+        if self.ruta and self._sucia.is_set():
+            self._escribir()
+
+    def _escribir(self):
+        with self._lock_archivo:
+            with self._lock:
+                self._sucia.clear()
+                # pulsos/patrones no: tras un reinicio ya no tiene sentido dispararlos
+                data = [
+                    [topic, clave, ts, comando]
+                    for (topic, clave), (ts, _, comando) in self._items.items()
+                    if not _temporizado(comando)
+                ]
+            try:
+                tmp = self.ruta + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.ruta)
+            except Exception as e:
+                log.error("Cola MQTT: error al guardar %s: %s", self.ruta, e)
+
+    def _cargar(self):
+        if not self.ruta or not os.path.exists(self.ruta):
+            return
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            ahora = time.time()
+            for topic, clave, ts, comando in data[-self.max_items:]:
+                if not self._vigente(ts, comando, ahora):
+                    self.vencidos += 1
+                    continue
+                self._items[(topic, clave)] = (ts, topic, comando)
+            if self.vencidos:
+                log.warning("Cola MQTT: %s comandos guardados estaban vencidos y se descartaron", self.vencidos)
+        except Exception as e:
+            log.error("Cola MQTT: error al leer %s: %s", self.ruta, e)
+
+
+class SeguimientoAcks:
+    """
+    Comandos publicados que esperan confirmación de la placa.
+
+    publicar_comando agrega "seq" al JSON ({"l2":"on","seq":17}) y la placa
+    lo devuelve como "ack" en el estado que publica al aplicarlo. Al llegar
+    el ack se registra la latencia publicación -> ack en el histograma.
+    Un comando nuevo para el mismo (tópico, relé) reemplaza al pendiente,
+    así un reintento nunca reaplica un valor viejo.
+    Los pulsos/patrones (for_ms, patron) tienen un solo intento: si se
+    pierde solo el ack, reenviarlos volvería a disparar el pulso.
+    """
+
+    def __init__(self, timeout_s=3.0, max_intentos=3, max_pendientes=256):
+        self.timeout_s = timeout_s
+        self.max_intentos = max_intentos
+        self.max_pendientes = max_pendientes
+        # inicio al azar: la app y el demonio comparten placa y tópico de estado
+        self._seq = random.randrange(1 << 16)
+        self._pendientes = OrderedDict()  # seq -> [topic, comando, t_envio, intentos, claves]
+        self._por_clave = {}  # (topic, clave) -> seq
+        self._lock = threading.Lock()
+
+        self.latencias = Metricas.HistogramaLatencia()
+        self.confirmados = 0
+        self.reintentos = 0
+        self.sin_ack = 0
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    def _soltar(self, seq):
+        p = self._pendientes.pop(seq, None)
+        if p is not None:
+            for clave in p[4]:
+                if self._por_clave.get(clave) == seq:
+                    del self._por_clave[clave]
+        return p
+
+    def _reemplazar(self, topic, comando):
+        """Saca de los pendientes las claves que `comando` vuelve a mandar."""
+        claves = [clave for clave, _ in ColaSalida._partir(topic, comando)]
+        for clave in claves:
+            viejo = self._por_clave.pop(clave, None)
+            p = self._pendientes.get(viejo)
+            if p is None:
+                continue
+            for k in clave[1].split("|"):
+                p[1].pop(k, None)
+            p[4].remove(clave)
+            if not p[4]:
+                del self._pendientes[viejo]
+        return claves
+
+    def olvidar(self, topic, comando: dict):
+        with self._lock:
+            self._reemplazar(topic, comando)
+
+    def registrar(self, topic, comando: dict, intentos=0) -> int:
+        """Anota un comando a punto de publicarse. Devuelve su seq."""
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xFFFF
+            seq = self._seq
+            claves = self._reemplazar(topic, comando)
+            self._soltar(seq)  # vuelta completa del contador
+            for clave in claves:
+                self._por_clave[clave] = seq
+            self._pendientes[seq] = [topic, dict(comando), time.monotonic(), intentos, claves]
+            while len(self._pendientes) > self.max_pendientes:
+                self._soltar(next(iter(self._pendientes)))
+                self.sin_ack += 1
+        return seq
+
+    def cancelar(self, seq):
+        with self._lock:
+            self._soltar(seq)
+
+    def confirmar(self, ack) -> bool:
+        try:
+            ack = int(ack)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            p = self._soltar(ack)
+        if p is None:
+            return False
+        self.latencias.registrar_ms((time.monotonic() - p[2]) * 1000.0)
+        self.confirmados += 1
+        return True
+
+    def vencidos(self, ahora=None):
+        """Saca los que superaron timeout_s. Devuelve [(topic, comando, intentos)] a reintentar."""
+        ahora = ahora if ahora is not None else time.monotonic()
+        reintentar = []
+        with self._lock:
+            while self._pendientes:
+                seq, p = next(iter(self._pendientes.items()))
+                if ahora - p[2] < self.timeout_s:
+                    break  # están en orden de envío
+                self._soltar(seq)
+                if p[3] + 1 < self.max_intentos and not _temporizado(p[1]):
+                    reintentar.append((p[0], p[1], p[3] + 1))
+                    self.reintentos += 1
+                else:
+                    self.sin_ack += 1
+                    log.warning("Comando sin confirmar tras %s intentos: %s %s", p[3] + 1, p[0], p[1])
+        return reintentar
+
+
+class ClienteAsyncio:
+    """
+    Atiende el socket de paho desde un event loop de asyncio (el de la UI)
+    en lugar del hilo de loop_start().
+
+    Usa los callbacks de socket de paho: add_reader -> loop_read,
+    add_writer -> loop_write (solo mientras haya algo para mandar) y una
+    tarea que llama a loop_misc (keepalive) y reconecta con backoff.
+    Los mensajes llegan en el hilo del loop: sin cola ni polling de por medio.
+    """
+
+    def __init__(self, servidor, loop):
+        self.servidor = servidor
+        self.cliente = servidor.cliente
+        self.loop = loop
+        self._sock = None
+        self._futuro = None
+
+        self.cliente.on_socket_open = self._on_socket_open
+        self.cliente.on_socket_close = self._on_socket_close
+        self.cliente.on_socket_register_write = self._on_socket_register_write
+        self.cliente.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # paho puede llamar a estos desde otro hilo (connect en el executor,
+    # publish desde un handler de la UI): ahí se pasa por call_soon_threadsafe.
+    def _en_loop(self, fn, *args):
+        if self.loop.is_closed():
+            return  # cerrando la app
+        try:
+            en_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _quitar_fd(self, fd):
+        # si el socket ya se cerró el selector puede quejarse: da igual
+        for quitar in (self.loop.remove_writer, self.loop.remove_reader):
+            try:
+                quitar(fd)
+            except (OSError, ValueError):
+                pass
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._sock = sock
+        self._en_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        if self._sock is sock:
+            self._sock = None
+        # por fd: fuera del loop, cuando corra esto paho ya cerró el socket
+        self._en_loop(self._quitar_fd, sock.fileno())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._en_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._en_loop(self._quitar_escritura, sock.fileno())
+
+    def _quitar_escritura(self, fd):
+        try:
+            self.loop.remove_writer(fd)
+        except (OSError, ValueError):
+            pass
+
+    @property
+    def activo(self):
+        return self._futuro is not None and not self._futuro.done()
+
+    def iniciar(self):
+        """Arranca la tarea de conexión en el loop (se puede llamar desde cualquier hilo)."""
+        if not self.activo:
+            self._futuro = asyncio.run_coroutine_threadsafe(self._mantener(), self.loop)
+
+    def detener(self):
+        if self._futuro is not None:
+            self._futuro.cancel()
+            self._futuro = None
+
+    def _abrir(self):
+        s = self.servidor
+        self.cliente.connect(s.host, s.port, keepalive=60)
+
+    async def _mantener(self):
+        s = self.servidor
+        demora = 1
+        while True:
+            if self._sock is None:
+                s._cambiar_estado("conectando")
+                try:
+                    # DNS + TCP bloquean: fuera del loop
+                    await self.loop.run_in_executor(None, self._abrir)
+                    log.info("Conectando (asyncio) al servidor MQTT en %s:%s", s.host, s.port)
+                except Exception as e:
+                    s.conectado = False
+                    s.ultimo_error = str(e)
+                    s._cambiar_estado("conectando", s.ultimo_error)
+                    await asyncio.sleep(demora)
+                    demora = min(demora * 2, 60)
+                    continue
+            elif s.conectado:
+                demora = 1
+
+            self.cliente.loop_misc()
+            await asyncio.sleep(1)
+
+
+class ServidorMQTT:
+    def __init__(self, ruta_cola=None, cliente=None):
+        """
+        ruta_cola: archivo para persistir los comandos pendientes (None = solo memoria).
+        cliente: cliente con la interfaz de paho (None = mqtt.Client real);
+                 PruebaCarga.py pasa uno en memoria.
+        """
         self.configuracion = ST.configuracion()
         self.host, self.port = self.configuracion.obtener_parametros_servidor_mqtt()
         self.topico_cmd, self.topico_estado = self.configuracion.obtener_topicos_mqtt()
+        self.modo_flota, self.topico_estado_flota, self.topico_cmd_flota = self.configuracion.obtener_config_flota()
+        self.modo = self.configuracion.obtener_modo_mqtt()
+        # Tópicos cmd de placas que anunciaron el protocolo binario ("bin": 1)
+        self.usar_binario = self.configuracion.obtener_protocolo_binario()
+        self._cmd_binario = set()
+        self._cliente_async = None  # ClienteAsyncio en modo "asyncio"
 
         # Cliente MQTT
-        self.cliente = mqtt.Client(client_id="Andrea_software")
+        self.cliente = cliente or mqtt.Client(client_id="Andrea_software")
         self.conectado = False
+        # "desconectado" | "conectando" | "conectado" | "error"
+        self.estado_conexion = "desconectado"
+        self.ultimo_error = None
+
+        # Hooks al conectar/reconectar: fn() -> None (corren en el hilo de paho)
+        self._al_conectar = []
+
+        # Reconexión: la hace el hilo de paho (loop_start) con backoff exponencial
+        # 1s, 2s, 4s... hasta 60s. Nadie que llame a esta clase espera.
+        self.cliente.reconnect_delay_set(min_delay=1, max_delay=60)
+        self._loop_activo = False
+        self._conecto_alguna_vez = False
+        self.reconexiones = 0
+
+        # Eventos de conexión: (time.time(), estado, detalle)
+        # oyente(estado: str, detalle: str | None) -> None (hilo de paho)
+        self.eventos_conexion = deque(maxlen=100)
+        self._oyentes_conexion = []
+
+        # Comandos pendientes mientras no hay broker (ver publicar_comando)
+        max_edad_s, max_edad_pulsos_s = self.configuracion.obtener_edad_maxima_cola()
+        self.cola_salida = ColaSalida(
+            ruta=ruta_cola, max_edad_s=max_edad_s, max_edad_temporizados_s=max_edad_pulsos_s
+        )
 
-        # Callbacks por tópico
+        # Confirmación de comandos (seq -> ack) y latencias
+        self.acks = SeguimientoAcks()
+
+        # Callbacks por filtro de tópico (admite + y #)
         # callback(topic: str, payload: bytes) -> None
-        self._callbacks = {}
+        self._suscripciones = ArbolTopicos()
+
+        # Cambios en Setting.ini sin reiniciar (broker nuevo -> reconectar)
+        ST.servicio().al_cambiar(self._on_config)
 
         # Configurar callbacks principales
         self.cliente.on_connect = self._on_connect
         self.cliente.on_disconnect = self._on_disconnect
         self.cliente.on_message = self._on_message
 
+    # -------------------------
+    # Estado de conexión
+    def _cambiar_estado(self, estado, detalle=None):
+        self.estado_conexion = estado
+        self.eventos_conexion.append((time.time(), estado, detalle))
+        for fn in list(self._oyentes_conexion):
+            try:
+                fn(estado, detalle)
+            except Exception as e:
+                log.exception("Error en oyente de conexión: %s", e)
+
+    def _on_config(self, cambios):
+        if "MQTT_HOST" not in cambios and "MQTT_PORT" not in cambios:
+            if {"TOPICO_CMD", "TOPICO_ESTADO", "MODO_FLOTA"} & set(cambios):
+                log.warning("Cambiaron los tópicos MQTT: se aplican al reiniciar la app")
+            return
+        host, port = ST.configuracion().obtener_parametros_servidor_mqtt()
+        if (host, port) == (self.host, self.port):
+            return
+        log.info("Broker MQTT nuevo: %s:%s -> %s:%s", self.host, self.port, host, port)
+        self.host, self.port = host, port
+        self.cambiar_broker()
+
+    def cambiar_broker(self):
+        """Cierra la conexión actual y reconecta a self.host/self.port."""
+        if self._cliente_async is not None:
+            # la tarea de ClienteAsyncio reconecta sola leyendo host/port
+            self.cliente.disconnect()
+            return
+        if not self._loop_activo:
+            return
+        try:
+            self.cliente.disconnect()
+            self.cliente.loop_stop()
+        except Exception as e:
+            log.error("Error al cerrar la conexión MQTT anterior: %s", e)
+        self._loop_activo = False
+        self.conectado = False
+        self.conectar_async()
+
     # -------------------------
     # Callbacks internos Paho
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             self.conectado = True
-            print("Conectado al servidor MQTT en {}:{}".format(self.host, self.port))
+            self.ultimo_error = None
+            if self._conecto_alguna_vez:
+                self.reconexiones += 1
+            self._conecto_alguna_vez = True
+            self._cambiar_estado("conectado")
+            log.info("Conectado al servidor MQTT en %s:%s", self.host, self.port)
 
             # Re-suscribir a tópicos registrados (por si reconectó)
-            for topic in self._callbacks.keys():
+            for topic in self._suscripciones.filtros():
                 try:
                     self.cliente.subscribe(topic)
                 except Exception as e:
-                    print("Error re-suscribiendo {}: {}".format(topic, e))
+                    log.error("Error re-suscribiendo %s: %s", topic, e)
+
+            # Reenviar lo que quedó pendiente mientras estuvimos desconectados
+            self._reenviar_cola()
+
+            for fn in list(self._al_conectar):
+                try:
+                    fn()
+                except Exception as e:
+                    log.exception("Error en hook al conectar: %s", e)
         else:
             self.conectado = False
-            print("Error al conectar al servidor MQTT. Código: {}".format(rc))
+            self.ultimo_error = "rc={}".format(rc)
+            self._cambiar_estado("error", self.ultimo_error)
+            log.error("Error al conectar al servidor MQTT. Código: %s", rc)
 
     def _on_disconnect(self, client, userdata, rc):
         self.conectado = False
-        print("Desconectado del servidor MQTT (rc={})".format(rc))
+        # rc != 0: caída inesperada, el hilo de paho reintenta solo con backoff
+        if rc != 0:
+            self._cambiar_estado("conectando", "rc={}".format(rc))
+        else:
+            self._cambiar_estado("desconectado")
+        log.info("Desconectado del servidor MQTT (rc=%s)", rc)
 
     def _on_message(self, client, userdata, msg):
-        try:
-            cb = self._callbacks.get(msg.topic)
-            if cb:
+        handlers = self._suscripciones.coincidencias(msg.topic)
+        if not handlers:
+            log.debug("Mensaje sin handler en %s: %r", msg.topic, msg.payload)
+            return
+
+        for cb in handlers:
+            try:
                 cb(msg.topic, msg.payload)
-            else:
-                print("Mensaje recibido en {}: {}".format(msg.topic, msg.payload.decode(errors="ignore")))
-        except Exception as e:
-            print("Error procesando mensaje MQTT:", e)
+            except Exception as e:
+                log.exception("Error procesando mensaje MQTT en %s: %s", msg.topic, e)
 
     # -------------------------
     # API pública
+    def al_conectar(self, fn):
+        """Registra fn() para correr en cada conexión exitosa (incluye reconexiones)."""
+        if fn not in self._al_conectar:
+            self._al_conectar.append(fn)
+
+    def al_cambiar_conexion(self, fn):
+        """Registra fn(estado, detalle) para cada cambio de estado_conexion."""
+        if fn not in self._oyentes_conexion:
+            self._oyentes_conexion.append(fn)
+
+    def _iniciar_loop(self):
+        if not self._loop_activo:
+            self.cliente.loop_start()
+            self._loop_activo = True
+
     def conectar(self):
+        """
+        Primer intento bloqueante. Si falla, sigue en segundo plano
+        (conectar_async) para que paho reintente solo.
+        """
         try:
+            self._cambiar_estado("conectando")
             self.cliente.connect(self.host, self.port, keepalive=60)
-            self.cliente.loop_start()  # loop en segundo plano
-            print("Conectando al servidor MQTT en {}:{}".format(self.host, self.port))
+            self._iniciar_loop()  # loop en segundo plano
+            log.info("Conectando al servidor MQTT en %s:%s", self.host, self.port)
+            return True
+        except Exception as e:
+            self.conectado = False
+            self.ultimo_error = str(e)
+            log.error("Error al conectar al servidor MQTT: %s", e)
+            self.conectar_async()
+            return False
+
+    def conectar_async(self, loop=None):
+        """
+        Igual que conectar() pero no bloquea: DNS + TCP se hacen en el hilo
+        de paho. Si el broker no responde, paho sigue reintentando solo.
+        Seguir el progreso con estado_conexion / al_conectar().
+
+        loop: event loop de asyncio. Con MQTT_MODO=asyncio el cliente corre
+        en ese loop (callbacks en su hilo) en vez de en un hilo propio.
+        """
+        if self.modo == "asyncio" and loop is not None:
+            if self._cliente_async is None:
+                self._cliente_async = ClienteAsyncio(self, loop)
+            self._cliente_async.iniciar()
+            return True
+
+        try:
+            self._cambiar_estado("conectando")
+            self.cliente.connect_async(self.host, self.port, keepalive=60)
+            self._iniciar_loop()
+            log.info("Conectando (async) al servidor MQTT en %s:%s", self.host, self.port)
             return True
         except Exception as e:
             self.conectado = False
-            print("Error al conectar al servidor MQTT:", e)
+            self.ultimo_error = str(e)
+            self._cambiar_estado("error", self.ultimo_error)
+            log.error("Error al conectar al servidor MQTT: %s", e)
             return False
 
     def desconectar(self):
         try:
-            self.cliente.loop_stop()
+            if self._cliente_async is not None:
+                self._cliente_async.detener()
             self.cliente.disconnect()
+            self.cliente.loop_stop()
+            self._loop_activo = False
             self.conectado = False
-            print("Desconectando del servidor MQTT")
+            self._cambiar_estado("desconectado")
+            log.info("Desconectando del servidor MQTT")
             return True
         except Exception as e:
-            print("Error al desconectar del servidor MQTT:", e)
+            log.error("Error al desconectar del servidor MQTT: %s", e)
             return False
 
     def publicar(self, topic, mensaje, retain=False, qos=0):
@@ -85,55 +747,195 @@ class ServidorMQTT:
             result = self.cliente.publish(topic, mensaje, qos=qos, retain=retain)
 
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print("Publicado en {} (retain={}): {}".format(topic, retain, mensaje))
+                log.debug("Publicado en %s (retain=%s): %r", topic, retain, mensaje)
                 return True
             else:
-                print("Error al publicar. Código: {}".format(result.rc))
+                log.warning("Error al publicar en %s. Código: %s", topic, result.rc)
                 return False
 
         except Exception as e:
-            print("Error al publicar en {}: {}".format(topic, e))
+            log.error("Error al publicar en %s: %s", topic, e)
             return False
 
+    def publicar_comando(self, topic, comando: dict, qos=0):
+        """
+        Publica un comando JSON; si no hay conexión (o falla) lo deja en
+        cola_salida para reenviarlo al reconectar.
+        Devuelve "enviado" | "encolado".
+        """
+        if self.conectado and self._publicar_con_seq(topic, comando, qos=qos):
+            return "enviado"
+        self.acks.olvidar(topic, comando)
+        self.cola_salida.agregar(topic, comando)
+        log.info("MQTT sin conexión: comando encolado (%s en cola)", self.cola_salida.profundidad())
+        return "encolado"
+
+    def _publicar_con_seq(self, topic, comando: dict, intentos=0, qos=0) -> bool:
+        seq = self.acks.registrar(topic, comando, intentos)
+        paquete = PB.codificar_comando(comando, seq) if topic in self._cmd_binario else None
+        if paquete is not None:
+            ok = self.publicar(topic + PB.SUFIJO, paquete, qos=qos)
+        else:
+            ok = self.publicar(topic, json.dumps(dict(comando, seq=seq)), qos=qos)
+        if ok:
+            return True
+        self.acks.cancelar(seq)
+        return False
+
+    def procesar_ack(self, data) -> bool:
+        """Llamar con cada estado recibido, antes de fusionarlo (el buzón pisa "ack")."""
+        if isinstance(data, dict) and "ack" in data:
+            return self.acks.confirmar(data["ack"])
+        return False
+
+    def revisar_acks(self):
+        """Reintenta los comandos sin confirmar. Llamar periódicamente (tick)."""
+        for topic, comando, intentos in self.acks.vencidos():
+            if not comando:
+                continue
+            if self.conectado and self._publicar_con_seq(topic, comando, intentos):
+                continue
+            self.cola_salida.agregar(topic, comando)
+
+    def _reenviar_cola(self):
+        items = self.cola_salida.tomar_todo()
+        for i, (clave, (ts, topic, comando)) in enumerate(items):
+            if not self._publicar_con_seq(topic, comando):
+                self.cola_salida.devolver(items[i:])
+                break
+        else:
+            if items:
+                log.info("Reenviados %s comandos pendientes", len(items))
+
     def suscribir(self, topic, callback=None, qos=0):
         """
+        topic puede tener comodines (respirometro/+/estado, respirometro/#).
         callback(topic: str, payload: bytes) -> None
+        Varios callbacks sobre el mismo filtro se llaman todos.
         """
         try:
             if callback:
-                self._callbacks[topic] = callback
+                self._suscripciones.agregar(topic, callback)
 
             self.cliente.subscribe(topic, qos=qos)
-            print("Suscrito al tópico {}".format(topic))
+            log.info("Suscrito al tópico %s", topic)
             return True
         except Exception as e:
-            print("Error al suscribir al tópico {}: {}".format(topic, e))
+            log.error("Error al suscribir al tópico %s: %s", topic, e)
             return False
 
-    def desuscribir(self, topic):
+    def suscribir_estado(self, filtro, callback):
+        """
+        Suscribe al estado de la(s) placa(s) en JSON y en binario (filtro + "/b").
+        callback(topic, data: dict) -> None, con el estado ya decodificado y
+        el topic sin sufijo. Los acks se procesan acá, antes que nada.
+        """
+        def _json(topic, payload):
+            try:
+                data = json.loads(payload.decode("utf-8", errors="ignore"))
+            except Exception as e:
+                log.warning("Error decodificando estado de %s: %s", topic, e)
+                return
+            if not isinstance(data, dict):
+                return
+            self._negociar(topic, bool(data.get("bin")))
+            self.procesar_ack(data)
+            callback(topic, data)
+
+        def _binario(topic, payload):
+            data = PB.decodificar_estado(payload)
+            if data is None:
+                return
+            topic = topic[:-len(PB.SUFIJO)]
+            self._negociar(topic, True)
+            self.procesar_ack(data)
+            callback(topic, data)
+
+        ok = self.suscribir(filtro, _json)
+        if self.usar_binario:
+            ok = self.suscribir(filtro + PB.SUFIJO, _binario) and ok
+        return ok
+
+    def _negociar(self, topico_estado, soporta_binario):
+        if not self.usar_binario:
+            return
+        if self.modo_flota:
+            topico_cmd = self.topico_cmd_dispositivo(self.id_dispositivo(topico_estado))
+        else:
+            topico_cmd = self.topico_cmd
+        if soporta_binario:
+            self._cmd_binario.add(topico_cmd)
+        else:
+            self._cmd_binario.discard(topico_cmd)
+
+    def desuscribir(self, topic, callback=None):
+        """Sin callback quita todos; con callback solo ese (y desuscribe si no queda ninguno)."""
         try:
-            if topic in self._callbacks:
-                del self._callbacks[topic]
+            self._suscripciones.quitar(topic, callback)
+            if topic in self._suscripciones:
+                return True
             self.cliente.unsubscribe(topic)
-            print("Desuscrito del tópico {}".format(topic))
+            log.info("Desuscrito del tópico %s", topic)
             return True
         except Exception as e:
-            print("Error al desuscribir {}: {}".format(topic, e))
+            log.error("Error al desuscribir %s: %s", topic, e)
             return False
 
-    def reconectar(self, espera_s=2):
+    # -------------------------
+    # Modo flota
+    def id_dispositivo(self, topic, filtro=None):
         """
-        Fuerza reconexión. El on_connect re-suscribe a todo lo registrado.
+        Id de la placa según la posición del '+' en el filtro.
+        respirometro/+/estado + respirometro/andrea/estado -> "andrea"
         """
-        try:
-            try:
-                self.desconectar()
-            except Exception:
-                pass
+        filtro = filtro or self.topico_estado_flota
+        partes_f = filtro.split("/")
+        partes_t = topic.split("/")
+        if "+" not in partes_f or len(partes_t) < len(partes_f):
+            return None
+        return partes_t[partes_f.index("+")]
 
-            time.sleep(espera_s)
-            return self.conectar()
+    def topico_cmd_dispositivo(self, id_dispositivo):
+        if not self.modo_flota or id_dispositivo is None:
+            return self.topico_cmd
+        return self.topico_cmd_flota.format(id=id_dispositivo)
 
-        except Exception as e:
-            print("Error al reconectar al servidor MQTT:", e)
+    def configurar_placa(self, cambios: dict, id_dispositivo=None):
+        """
+        Cambia config.ini de la placa por MQTT (topico_cmd/config), sin reflashear.
+        La placa responde en topico_estado/config con las claves aplicadas
+        y reinicia sola si alguna lo necesita (WiFi, tópicos, pines).
+        Pines que no son GPIO de salida se rechazan; WiFi/broker nuevos quedan
+        a prueba y la placa vuelve a los anteriores si no logra conectar.
+        cambios={} pide la configuración actual.
+        """
+        payload = dict(cambios) if cambios else {"get": "config"}
+        return self.publicar(self.topico_cmd_dispositivo(id_dispositivo) + "/config", json.dumps(payload))
+
+    def pulso_rele(self, rele: int, ms: int, encender=True, id_dispositivo=None):
+        """Relé 1..8 a on (u off) durante ms y vuelta al estado contrario; lo temporiza la placa."""
+        comando = {"l{}".format(rele): "on" if encender else "off", "for_ms": int(ms)}
+        return self.publicar_comando(self.topico_cmd_dispositivo(id_dispositivo), comando)
+
+    def patron_rele(self, rele: int, on_ms: int, off_ms: int, ciclos=0, id_dispositivo=None):
+        """Relé 1..8 alterna on_ms/off_ms en la placa; ciclos=0 sin fin. Un comando fijo lo cancela."""
+        comando = {"patron": {"l{}".format(rele): [int(on_ms), int(off_ms), int(ciclos)]}}
+        return self.publicar_comando(self.topico_cmd_dispositivo(id_dispositivo), comando)
+
+    def reconectar(self):
+        """
+        Pide una reconexión sin bloquear nunca.
+        Con el loop de paho corriendo, la reconexión ya está en curso (backoff
+        de reconnect_delay_set) y esto no hace nada. Si el loop no corre
+        (nunca se conectó o se llamó a desconectar), lo arranca en modo async.
+        El on_connect re-suscribe a todo lo registrado.
+        """
+        if self.conectado:
+            return True
+        if self._loop_activo:
+            return False
+        if self._cliente_async is not None:
+            # la tarea de ClienteAsyncio ya reintenta con backoff
+            self._cliente_async.iniciar()
             return False
+        return self.conectar_async()
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+import Logs
+
+log = Logs.obtener_logger("reles")
+
+
+class BuzonEstado:
+    """
+    Buzón "último gana" para los estados que llegan por topico_estado.
+
+    El hilo de MQTT fusiona cada mensaje en una sola foto pendiente
+    ({"online": ..., "l1": ..., ...}); la UI la toma una vez por tick.
+    Una ráfaga de heartbeats tras reconectar queda en un único update.
+    El tamaño está acotado a max_claves (claves nuevas de más se descartan).
+    """
+
+    def __init__(self, max_claves=32):
+        self._lock = threading.Lock()
+        self._pendiente = {}
+        self.max_claves = max_claves
+
+        # Contadores (diagnóstico)
+        self.recibidos = 0
+        self.fusionados = 0
+        self.descartados = 0
+
+    def poner(self, data: dict) -> bool:
+        """Fusiona data en la foto pendiente. Thread-safe."""
+        if not isinstance(data, dict):
+            return False
+
+        with self._lock:
+            self.recibidos += 1
+            if self._pendiente:
+                self.fusionados += 1
+
+            for k, v in data.items():
+                if k not in self._pendiente and len(self._pendiente) >= self.max_claves:
+                    self.descartados += 1
+                    continue
+                self._pendiente[k] = v
+        return True
+
+    def tomar(self):
+        """Devuelve la foto fusionada y vacía el buzón (None si no llegó nada)."""
+        with self._lock:
+            if not self._pendiente:
+                return None
+            data, self._pendiente = self._pendiente, {}
+            return data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pendiente)
+
+
+class EstadoRele:
+    """
+    Estado de un relé:
+      - reportado: lo último que informó la placa (topico_estado)
+      - deseado: lo último que pidió la app/scheduler
+      - pendiente: comando enviado y todavía no confirmado (None si no hay)
+    Los ts_* son time.time() (None si nunca pasó).
+    """
+
+    __slots__ = (
+        "key", "indice", "nombre",
+        "reportado", "deseado", "pendiente",
+        "ts_reportado", "ts_deseado", "ts_comando",
+    )
+
+    def __init__(self, key, indice, nombre):
+        self.key = key
+        self.indice = indice
+        self.nombre = nombre
+        self.reportado = False
+        self.deseado = None
+        self.pendiente = None
+        self.ts_reportado = None
+        self.ts_deseado = None
+        self.ts_comando = None
+
+    def __repr__(self):
+        return "EstadoRele({}, reportado={}, deseado={}, pendiente={})".format(
+            self.key, self.reportado, self.deseado, self.pendiente
+        )
+
+
+class AlmacenReles:
+    """
+    Tabla fija de relés l1..lN con acceso O(1) por clave.
+
+    Es la única fuente de verdad del estado de los relés: la UI, el
+    scheduler y el demonio leen de acá en vez de recorrer listas de dicts.
+    suscribir(cb) -> cb(rele: EstadoRele) cada vez que cambia un relé.
+
+    obsoleto=True mientras no llegue un estado real de la placa (al arrancar,
+    o si lo cargado viene de una instantánea en disco).
+    """
+
+    def __init__(self, cantidad=8):
+        self._reles = tuple(
+            EstadoRele("l{}".format(i), i - 1, "Relé {}".format(i))
+            for i in range(1, cantidad + 1)
+        )
+        self._por_key = {r.key: r for r in self._reles}
+        self._oyentes = []
+        self._lock = threading.RLock()
+
+        # Estado de la placa
+        self.online = None
+        self.ts_online = None
+        self.obsoleto = True
+        self.ts_instantanea = None
+
+    def __iter__(self):
+        return iter(self._reles)
+
+    def __len__(self):
+        return len(self._reles)
+
+    def __contains__(self, key):
+        return key in self._por_key
+
+    def get(self, key):
+        return self._por_key.get(key)
+
+    # -------------------------
+    # Suscripciones
+    def suscribir(self, callback):
+        """callback(rele: EstadoRele) -> None"""
+        if callback not in self._oyentes:
+            self._oyentes.append(callback)
+
+    def desuscribir(self, callback):
+        if callback in self._oyentes:
+            self._oyentes.remove(callback)
+
+    def _notificar(self, rele):
+        for cb in list(self._oyentes):
+            try:
+                cb(rele)
+            except Exception as e:
+                log.exception("Error en oyente de relés: %s", e)
+
+    # -------------------------
+    # Actualizaciones
+    def reportar(self, key, encendido: bool, ts=None) -> bool:
+        """La placa informó el estado. Devuelve True si cambió algo."""
+        rele = self._por_key.get(key)
+        if rele is None:
+            return False
+
+        encendido = bool(encendido)
+        with self._lock:
+            cambio = rele.reportado != encendido
+            rele.reportado = encendido
+            rele.ts_reportado = ts or time.time()
+            if rele.pendiente is not None and rele.pendiente == encendido:
+                rele.pendiente = None
+                cambio = True
+
+        if cambio:
+            self._notificar(rele)
+        return cambio
+
+    def comandar(self, key, encendido: bool, ts=None) -> bool:
+        """Se envió un comando a la placa: queda deseado y pendiente."""
+        rele = self._por_key.get(key)
+        if rele is None:
+            return False
+
+        ahora = ts or time.time()
+        encendido = bool(encendido)
+        with self._lock:
+            if rele.deseado != encendido:
+                rele.ts_deseado = ahora
+            rele.deseado = encendido
+            rele.pendiente = None if rele.reportado == encendido else encendido
+            rele.ts_comando = ahora
+
+        self._notificar(rele)
+        return True
+
+    def aplicar_estado(self, data: dict, ts=None) -> bool:
+        """
+        Aplica un mensaje de topico_estado ({"online":"on","l1":"off",...}).
+        Si trae relés, el estado deja de ser obsoleto.
+        """
+        ahora = ts or time.time()
+        if "online" in data:
+            self.online = (data["online"] == "on")
+            self.ts_online = ahora
+
+        hubo_reles = False
+        for rele in self._reles:
+            if rele.key in data:
+                hubo_reles = True
+                self.reportar(rele.key, data[rele.key] == "on", ts=ahora)
+
+        if hubo_reles and self.obsoleto:
+            self.obsoleto = False
+            # repintar todo: lo que se veía era la foto vieja
+            for rele in self._reles:
+                self._notificar(rele)
+        return hubo_reles
+
+    def requiere_comando(self, key, encendido: bool, reenvio_s=5.0) -> bool:
+        """
+        True si hay que mandar un comando para llevar el relé a `encendido`:
+        el estado reportado difiere y no hay un comando igual pendiente
+        más nuevo que reenvio_s segundos.
+        """
+        rele = self._por_key.get(key)
+        if rele is None:
+            return False
+
+        encendido = bool(encendido)
+        with self._lock:
+            if rele.reportado == encendido:
+                return False
+            if rele.pendiente == encendido and rele.ts_comando is not None:
+                return (time.time() - rele.ts_comando) >= reenvio_s
+            return True
+
+    # -------------------------
+    # Instantánea (último estado conocido, para pintar al arrancar)
+    def instantanea(self) -> dict:
+        with self._lock:
+            return {
+                "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "online": self.online,
+                "reles": {r.key: r.reportado for r in self._reles},
+            }
+
+    def cargar_instantanea(self, data: dict) -> bool:
+        """Carga una instantánea. Queda marcada como obsoleta hasta que hable la placa."""
+        if not isinstance(data, dict) or not isinstance(data.get("reles"), dict):
+            return False
+
+        try:
+            ts = datetime.strptime(data.get("ts", ""), "%Y-%m-%d %H:%M:%S").timestamp()
+        except Exception:
+            ts = None
+
+        with self._lock:
+            for key, encendido in data["reles"].items():
+                rele = self._por_key.get(key)
+                if rele is not None:
+                    rele.reportado = bool(encendido)
+                    rele.ts_reportado = ts
+            if data.get("online") is not None:
+                self.online = bool(data["online"])
+                self.ts_online = ts
+            self.obsoleto = True
+            self.ts_instantanea = ts
+
+        for rele in self._reles:
+            self._notificar(rele)
+        return True
+
+
+def leer_instantanea(ruta: str):
+    try:
+        if os.path.exists(ruta):
+            with open(ruta, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except Exception as e:
+        log.error("Instantánea: error al leer %s: %s", ruta, e)
+    return None
+
+
+def guardar_instantanea(ruta: str, data: dict) -> bool:
+    """Escritura atómica (tmp + replace) para no dejar un JSON a medias."""
+    try:
+        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, ruta)
+        return True
+    except Exception as e:
+        log.error("Instantánea: error al guardar %s: %s", ruta, e)
+        return False
@@ -0,0 +1,95 @@
+import time
+import threading
+
+import EstadoReles as ER
+
+
+class Dispositivo:
+    """Una placa de la flota: su tabla de relés + cuándo se la vio por última vez."""
+
+    __slots__ = ("id", "reles", "ts_visto", "actualizaciones")
+
+    def __init__(self, id_dispositivo, cantidad_reles=8):
+        self.id = id_dispositivo
+        self.reles = ER.AlmacenReles(cantidad_reles)
+        self.ts_visto = None  # time.monotonic()
+        self.actualizaciones = 0
+
+    def online(self, timeout_s, ahora=None) -> bool:
+        if self.ts_visto is None:
+            return False
+        if self.reles.online is False:
+            return False
+        ahora = ahora if ahora is not None else time.monotonic()
+        return (ahora - self.ts_visto) <= timeout_s
+
+
+class Flota:
+    """
+    Placas descubiertas por la suscripción con comodín (respirometro/+/estado).
+
+    poner() corre en el hilo de MQTT: fusiona el mensaje en el buzón de esa
+    placa (último gana). aplicar_pendientes() corre en la UI una vez por tick
+    y solo toca las placas que recibieron algo, así 50+ placas con heartbeat
+    cada pocos segundos cuestan O(placas que cambiaron) por tick.
+    """
+
+    def __init__(self, cantidad_reles=8, max_dispositivos=256):
+        self.cantidad_reles = cantidad_reles
+        self.max_dispositivos = max_dispositivos
+        self._dispositivos = {}
+        self._buzones = {}
+        self._sucios = set()
+        self._lock = threading.Lock()
+        self.descartados = 0
+
+    def __len__(self):
+        return len(self._dispositivos)
+
+    def __iter__(self):
+        return iter(list(self._dispositivos.values()))
+
+    def ids(self):
+        return sorted(self._dispositivos.keys())
+
+    def obtener(self, id_dispositivo, crear=True):
+        disp = self._dispositivos.get(id_dispositivo)
+        if disp is None and crear:
+            with self._lock:
+                disp = self._dispositivos.get(id_dispositivo)
+                if disp is None:
+                    disp = Dispositivo(id_dispositivo, self.cantidad_reles)
+                    self._dispositivos[id_dispositivo] = disp
+        return disp
+
+    def poner(self, id_dispositivo, data: dict) -> bool:
+        """Encola (fusionando) un estado recibido. Thread-safe."""
+        if not id_dispositivo or not isinstance(data, dict):
+            return False
+
+        with self._lock:
+            buzon = self._buzones.get(id_dispositivo)
+            if buzon is None:
+                if len(self._buzones) >= self.max_dispositivos:
+                    self.descartados += 1
+                    return False
+                buzon = ER.BuzonEstado()
+                self._buzones[id_dispositivo] = buzon
+            self._sucios.add(id_dispositivo)
+        return buzon.poner(data)
+
+    def aplicar_pendientes(self) -> set:
+        """Aplica lo recibido desde el último tick. Devuelve los ids que cambiaron."""
+        with self._lock:
+            sucios, self._sucios = self._sucios, set()
+
+        ahora = time.monotonic()
+        for id_dispositivo in sucios:
+            data = self._buzones[id_dispositivo].tomar()
+            if data is None:
+                continue
+            disp = self.obtener(id_dispositivo)
+            disp.ts_visto = ahora
+            disp.actualizaciones += 1
+            disp.reles.aplicar_estado(data)
+        return sucios
@@ -1,26 +1,301 @@
 import os
 import sys
+import gzip
+import time
+import shutil
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
 import datetime
 import Settings as ST
 
 class LogsGenerator:
-    def __init__(self):
+    """
+    Escritor de logs en directorio_salida_logs/<AAAA_MM_DD>/log_<HH_MM_SS>.txt.
+
+    escribir_log() solo encola (nunca toca el disco): un hilo mantiene el
+    archivo abierto y escribe por lotes (un write + flush cada
+    intervalo_flush_s o cada max_lote líneas). Rota al cambiar el día (carpeta
+    nueva) y al pasar max_bytes; con comprimir=True los segmentos cerrados
+    quedan como .txt.gz. Ajustes: LOGS_MAX_MB y LOGS_COMPRIMIR en Setting.ini.
+    """
+
+    def __init__(self, max_bytes=None, comprimir=None, intervalo_flush_s=1.0, max_lote=512, max_cola=10000):
         self.configuracion = ST.ConfiguracionSoftware()
-        self.ruta_logs = self.configuracion.diccionario_valores.get("directorio_salida_logs", "")
+        valores = self.configuracion.diccionario_valores
+        self.ruta_logs = valores.get("directorio_salida_logs", "")
         if not os.path.exists(self.ruta_logs):
             os.makedirs(self.ruta_logs)
-        self.fecha_actual = datetime.datetime.now().strftime("%Y_%m_%d")
-        self.fecha_hora_actual = datetime.datetime.now().strftime("%H:%M:%S")
-        self.carpeta_fecha = os.path.join(self.ruta_logs, self.fecha_actual)
-        if not os.path.exists(self.carpeta_fecha):
-            os.makedirs(self.carpeta_fecha)
-        self.archivo_los = os.path.join(self.carpeta_fecha, f"log_{self.fecha_hora_actual}.txt")
+
+        if max_bytes is None:
+            try:
+                max_bytes = int(float(valores.get("LOGS_MAX_MB", "5")) * 1024 * 1024)
+            except ValueError:
+                max_bytes = 5 * 1024 * 1024
+        if comprimir is None:
+            comprimir = valores.get("LOGS_COMPRIMIR", "0").strip().lower() in ("1", "true", "si", "on")
+        self.max_bytes = max_bytes
+        self.comprimir = comprimir
+        self.intervalo_flush_s = intervalo_flush_s
+        self.max_lote = max_lote
+
+        self.fecha_actual = None
+        self.carpeta_fecha = None
+        self.archivo_los = None
+        self._archivo = None
+        self._bytes = 0
+
+        # directorio_salida_logs nuevo -> el próximo lote ya va ahí
+        ST.servicio().al_cambiar(self._on_config)
+
+        self._cola = queue.Queue(max_cola)
+        self.descartados = 0
+        self._hilo = threading.Thread(target=self._loop, name="LogsGenerator", daemon=True)
+        self._hilo.start()
+
+    def _on_config(self, cambios):
+        if "directorio_salida_logs" in cambios:
+            self.ruta_logs = ST.servicio().obtener("directorio_salida_logs", self.ruta_logs)
+            self.fecha_actual = None  # fuerza la rotación en el próximo lote
 
     def escribir_log(self, mensaje):
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         try:
-            with open(self.archivo_los, "a") as archivo:
-                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                archivo.write(f"[{timestamp}] {mensaje}\n")
+            self._cola.put_nowait(f"[{timestamp}] {mensaje}\n")
+        except queue.Full:
+            self.descartados += 1
+
+    def cerrar(self, timeout=5.0):
+        """Escribe lo pendiente y cierra el archivo."""
+        if self._hilo.is_alive():
+            self._cola.put(None)
+            self._hilo.join(timeout)
+
+    # -------------------------
+    # Hilo escritor
+    def _loop(self):
+        while True:
+            try:
+                lote = [self._cola.get(timeout=self.intervalo_flush_s)]
+            except queue.Empty:
+                continue
+            fin = lote[0] is None
+            # junta líneas hasta intervalo_flush_s desde la primera o max_lote
+            limite = time.monotonic() + self.intervalo_flush_s
+            while not fin and len(lote) < self.max_lote:
+                resto = limite - time.monotonic()
+                if resto <= 0:
+                    break
+                try:
+                    linea = self._cola.get(timeout=resto)
+                except queue.Empty:
+                    break
+                if linea is None:
+                    fin = True
+                else:
+                    lote.append(linea)
+
+            lineas = [l for l in lote if l is not None]
+            if lineas:
+                self._escribir("".join(lineas))
+            if fin:
+                self._cerrar_archivo()
+                return
+
+    def _escribir(self, texto):
+        try:
+            hoy = datetime.datetime.now().strftime("%Y_%m_%d")
+            if self._archivo is None or hoy != self.fecha_actual or self._bytes >= self.max_bytes:
+                self._rotar(hoy)
+            self._archivo.write(texto)
+            self._archivo.flush()
+            self._bytes += len(texto.encode("utf-8", errors="replace"))
         except Exception as e:
             print("Error al escribir en el log:", e)
-        
\ No newline at end of file
+            self._cerrar_archivo()
+
+    def _rotar(self, hoy):
+        anterior = self.archivo_los if self._archivo is not None else None
+        self._cerrar_archivo()
+
+        self.fecha_actual = hoy
+        self.carpeta_fecha = os.path.join(self.ruta_logs, hoy)
+        os.makedirs(self.carpeta_fecha, exist_ok=True)
+        base = "log_" + datetime.datetime.now().strftime("%H_%M_%S")
+        nombre, n = base, 1
+        while any(os.path.exists(os.path.join(self.carpeta_fecha, nombre + ext)) for ext in (".txt", ".txt.gz")):
+            n += 1
+            nombre = "{}_{}".format(base, n)
+        self.archivo_los = os.path.join(self.carpeta_fecha, nombre + ".txt")
+        self._archivo = open(self.archivo_los, "a", encoding="utf-8", errors="replace")
+        self._bytes = 0
+
+        if anterior and self.comprimir:
+            self._comprimir(anterior)
+
+    def _cerrar_archivo(self):
+        if self._archivo is not None:
+            try:
+                self._archivo.close()
+            except Exception:
+                pass
+            self._archivo = None
+
+    @staticmethod
+    def _comprimir(ruta):
+        try:
+            with open(ruta, "rb") as origen, gzip.open(ruta + ".gz", "wb") as destino:
+                shutil.copyfileobj(origen, destino)
+            os.remove(ruta)
+        except Exception as e:
+            print("Error al comprimir log {}: {}".format(ruta, e))
+
+
+# -------------------------
+# Logging con niveles (encima de LogsGenerator)
+#
+#   import Logs
+#   log = Logs.obtener_logger("mqtt")
+#   log.debug("Publicado en %s", topic)   # formatear con %s: si el nivel no
+#                                        # está activo no cuesta nada
+#
+# Cada ejecutable llama a Logs.configurar() al arrancar. Los módulos solo
+# encolan (QueueHandler); un QueueListener en otro hilo escribe a consola y
+# al archivo de LogsGenerator. Nivel: NIVEL_LOG en Setting.ini.
+
+RAIZ = "respirometro"
+FORMATO = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+class ManejadorLogsGenerator(logging.Handler):
+    """Handler que escribe con LogsGenerator (corre en el hilo del listener)."""
+
+    def __init__(self, generador=None):
+        super().__init__()
+        self.generador = generador or LogsGenerator()
+
+    def emit(self, record):
+        try:
+            self.generador.escribir_log(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.generador.cerrar()
+        super().close()
+
+
+class FiltroRepeticiones(logging.Filter):
+    """
+    Limita mensajes repetitivos: por (logger, nivel, texto ya formateado)
+    deja pasar max_por_ventana cada ventana_s segundos (el mismo formato con
+    otros argumentos, ej. otro relé, cuenta aparte). Al abrirse la ventana siguiente
+    el primer mensaje avisa cuántos se suprimieron.
+    """
+
+    def __init__(self, ventana_s=10.0, max_por_ventana=5):
+        super().__init__()
+        self.ventana_s = ventana_s
+        self.max_por_ventana = max_por_ventana
+        self._cuentas = {}  # clave -> [inicio_ventana, cuenta, suprimidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        try:
+            texto = record.getMessage()
+        except Exception:
+            texto = str(record.msg)
+        clave = (record.name, record.levelno, texto)
+        ahora = time.monotonic()
+        with self._lock:
+            c = self._cuentas.get(clave)
+            if c is None:
+                if len(self._cuentas) > 1000:
+                    self._cuentas.clear()
+                self._cuentas[clave] = [ahora, 1, 0]
+                return True
+            if ahora - c[0] >= self.ventana_s:
+                suprimidos = c[2]
+                c[0], c[1], c[2] = ahora, 1, 0
+                if suprimidos:
+                    record.msg = "{} [+{} similares suprimidos]".format(record.msg, suprimidos)
+                return True
+            c[1] += 1
+            if c[1] > self.max_por_ventana:
+                c[2] += 1
+                return False
+            return True
+
+
+_listener = None
+_lock_config = threading.Lock()
+
+
+def nivel_configurado():
+    try:
+        nombre = ST.configuracion().obtener_nivel_log()
+    except Exception:
+        nombre = "INFO"
+    return getattr(logging, nombre, logging.INFO)
+
+
+def configurar(nivel=None, archivo=True):
+    """Arma el logger raíz de la app (una sola vez). Devuelve el logger raíz."""
+    global _listener
+    raiz = logging.getLogger(RAIZ)
+    with _lock_config:
+        if _listener is not None:
+            if nivel is not None:
+                raiz.setLevel(nivel)
+            return raiz
+
+        formato = logging.Formatter(FORMATO)
+        manejadores = []
+
+        consola = logging.StreamHandler(sys.stdout)
+        consola.setFormatter(formato)
+        manejadores.append(consola)
+
+        if archivo:
+            try:
+                manejador = ManejadorLogsGenerator()
+                manejador.setFormatter(logging.Formatter("%(levelname)-7s %(name)s: %(message)s"))
+                manejadores.append(manejador)
+            except Exception as e:
+                print("Logs: sin archivo de log ({})".format(e))
+
+        cola = queue.Queue(-1)
+        encolador = logging.handlers.QueueHandler(cola)
+        encolador.addFilter(FiltroRepeticiones())
+        raiz.addHandler(encolador)
+        raiz.setLevel(nivel if nivel is not None else nivel_configurado())
+        raiz.propagate = False
+        ST.servicio().al_cambiar(_on_config)
+
+        _listener = logging.handlers.QueueListener(cola, *manejadores, respect_handler_level=True)
+        _listener.start()
+        atexit.register(detener)
+    return raiz
+
+
+def _on_config(cambios):
+    if "NIVEL_LOG" in cambios:
+        logging.getLogger(RAIZ).setLevel(nivel_configurado())
+
+
+def detener():
+    """Vacía la cola y frena el hilo del listener (se llama solo al salir)."""
+    global _listener
+    with _lock_config:
+        if _listener is not None:
+            _listener.stop()
+            for manejador in _listener.handlers:
+                manejador.close()
+            _listener = None
+
+
+def obtener_logger(nombre):
+    """Logger por módulo: respirometro.<nombre> (sin configurar() solo salen los WARNING+)."""
+    return logging.getLogger("{}.{}".format(RAIZ, nombre))
@@ -0,0 +1,132 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+import Logs
+
+log = Logs.obtener_logger("metricas")
+
+
+class HistogramaLatencia:
+    """
+    Histograma de latencias estilo HDR (log-lineal), en microsegundos.
+
+    Cada potencia de 2 se divide en `sub` cubetas lineales, así el error
+    relativo queda acotado (~1% con digitos=2) en todo el rango y registrar
+    es O(1) sin guardar las muestras. Thread-safe: se registra desde el
+    hilo de MQTT y se lee desde la UI.
+    """
+
+    def __init__(self, max_ms=60000, digitos=2):
+        self.max_us = int(max_ms * 1000)
+        # sub-cubetas: la potencia de 2 que alcanza 2 * 10^digitos
+        self._bits = (2 * 10 ** digitos - 1).bit_length()
+        self._sub = 1 << self._bits
+        self._mitad = self._sub >> 1
+        self._cuentas = [0] * (self._indice(self.max_us) + 1)
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self._cuentas = [0] * len(self._cuentas)
+            self.n = 0
+            self.fuera_de_rango = 0
+            self.suma_us = 0
+            self.min_us = None
+            self.max_obs_us = None
+
+    # -------------------------
+    # Cubetas
+    def _indice(self, v: int) -> int:
+        if v < self._sub:
+            return v
+        corrimiento = v.bit_length() - self._bits
+        return self._sub + (corrimiento - 1) * self._mitad + ((v >> corrimiento) - self._mitad)
+
+    def _valor(self, indice: int) -> int:
+        """Límite superior (us) de la cubeta."""
+        if indice < self._sub:
+            return indice
+        corrimiento = (indice - self._sub) // self._mitad + 1
+        base = (indice - self._sub) % self._mitad + self._mitad
+        return ((base + 1) << corrimiento) - 1
+
+    # -------------------------
+    def registrar_ms(self, ms: float):
+        us = int(ms * 1000)
+        if us < 0:
+            return
+        with self._lock:
+            if us > self.max_us:
+                self.fuera_de_rango += 1
+                us = self.max_us
+            self._cuentas[self._indice(us)] += 1
+            self.n += 1
+            self.suma_us += us
+            self.min_us = us if self.min_us is None else min(self.min_us, us)
+            self.max_obs_us = us if self.max_obs_us is None else max(self.max_obs_us, us)
+
+    def percentil(self, p: float) -> float:
+        """Latencia (ms) bajo la cual cae el p% de las muestras (0 si no hay)."""
+        with self._lock:
+            if not self.n:
+                return 0.0
+            objetivo = max(1, int(round(self.n * p / 100.0)))
+            acumulado = 0
+            for i, c in enumerate(self._cuentas):
+                acumulado += c
+                if acumulado >= objetivo:
+                    return min(self._valor(i), self.max_obs_us) / 1000.0
+            return self.max_obs_us / 1000.0
+
+    def resumen(self) -> dict:
+        if not self.n:
+            return {"n": 0}
+        return {
+            "n": self.n,
+            "min_ms": round(self.min_us / 1000.0, 2),
+            "media_ms": round(self.suma_us / self.n / 1000.0, 2),
+            "p50_ms": round(self.percentil(50), 2),
+            "p90_ms": round(self.percentil(90), 2),
+            "p99_ms": round(self.percentil(99), 2),
+            "p999_ms": round(self.percentil(99.9), 2),
+            "max_ms": round(self.max_obs_us / 1000.0, 2),
+            "fuera_de_rango": self.fuera_de_rango,
+        }
+
+    def filas(self):
+        """[(hasta_ms, cuenta, percentil_acumulado)] de las cubetas no vacías."""
+        with self._lock:
+            n = self.n
+            cuentas = list(self._cuentas)
+        filas = []
+        acumulado = 0
+        for i, c in enumerate(cuentas):
+            if not c:
+                continue
+            acumulado += c
+            filas.append((self._valor(i) / 1000.0, c, 100.0 * acumulado / n))
+        return filas
+
+    def exportar(self, ruta: str) -> bool:
+        """Exporta a CSV (si la ruta termina en .csv) o JSON."""
+        try:
+            os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+            if ruta.lower().endswith(".csv"):
+                with open(ruta, "w", encoding="utf-8") as f:
+                    f.write("hasta_ms;cuenta;percentil\n")
+                    for hasta, c, pct in self.filas():
+                        f.write("{:.3f};{};{:.3f}\n".format(hasta, c, pct))
+            else:
+                with open(ruta, "w", encoding="utf-8") as f:
+                    json.dump({
+                        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "resumen": self.resumen(),
+                        "cubetas": self.filas(),
+                    }, f, ensure_ascii=False, indent=2)
+            return True
+        except Exception as e:
+            log.error("Métricas: error al exportar %s: %s", ruta, e)
+            return False
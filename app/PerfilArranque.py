@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+from datetime import datetime
+
+import Logs
+
+log = Logs.obtener_logger("arranque")
+
+
+class PerfilArranque:
+    """
+    Mide cuánto tarda cada etapa del arranque de la app.
+
+    Uso:
+        perfil = PerfilArranque(t0)      # t0 = perf_counter() lo antes posible
+        perfil.marcar("imports")
+        ...
+        perfil.marcar("primer_frame")
+        print(perfil.reporte())
+
+    Cada marca guarda el tiempo desde la marca anterior (ms) y el acumulado.
+    guardar() agrega la corrida a PerfilArranque.json (últimas N corridas)
+    para poder comparar entre versiones.
+    """
+
+    def __init__(self, t0=None, max_corridas=50):
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self._t_ultima = self.t0
+        self.etapas = []  # [(nombre, ms_etapa, ms_acumulado)]
+        self.max_corridas = max_corridas
+
+    def marcar(self, nombre: str):
+        ahora = time.perf_counter()
+        self.etapas.append((
+            nombre,
+            (ahora - self._t_ultima) * 1000.0,
+            (ahora - self.t0) * 1000.0,
+        ))
+        self._t_ultima = ahora
+
+    def total_ms(self) -> float:
+        return self.etapas[-1][2] if self.etapas else 0.0
+
+    def reporte(self) -> str:
+        lineas = ["Perfil de arranque:"]
+        for nombre, ms, acumulado in self.etapas:
+            lineas.append("  {:<14} {:8.1f} ms   (t={:8.1f} ms)".format(nombre, ms, acumulado))
+        return "\n".join(lineas)
+
+    def a_dict(self, version=None) -> dict:
+        return {
+            "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "version": version,
+            "etapas_ms": {nombre: round(ms, 1) for nombre, ms, _ in self.etapas},
+            "total_ms": round(self.total_ms(), 1),
+        }
+
+    @staticmethod
+    def ruta_por_defecto() -> str:
+        return os.path.join(os.path.dirname(sys.argv[0]), "PerfilArranque.json")
+
+    def guardar(self, ruta=None, version=None) -> bool:
+        ruta = ruta or self.ruta_por_defecto()
+        try:
+            corridas = []
+            if os.path.exists(ruta):
+                with open(ruta, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, list):
+                    corridas = data
+
+            corridas.append(self.a_dict(version))
+            corridas = corridas[-self.max_corridas:]
+
+            with open(ruta, "w", encoding="utf-8") as f:
+                json.dump(corridas, f, ensure_ascii=False, indent=2)
+            return True
+        except Exception as e:
+            log.error("Perfil de arranque: error al guardar %s: %s", ruta, e)
+            return False
@@ -1,26 +1,69 @@
 import json
 import os
+import time
+import shutil
 from datetime import datetime
 import Settings as ST
+import Logs
+
+log = Logs.obtener_logger("programaciones")
+
+
+# Marca de pausa: la UI la crea al pausar y la borra al reanudar/apagar. El
+# demonio la lee para no volver a empujar la agenda a la placa en pausa.
+# Mientras dura la pausa la UI la renueva cada PAUSA_RENOVAR_S; si la UI se
+# cerró sin borrarla, a los PAUSA_VIGENCIA_S se la da por vencida.
+ARCHIVO_PAUSA = "pausa.json"
+PAUSA_RENOVAR_S = 30
+PAUSA_VIGENCIA_S = 120
 
 
 class Programaciones:
-    def __init__(self, archivo='programaciones.json'):
+    def __init__(self, archivo='programaciones.json', cargar=True):
+        """
+        cargar=False: no toca el disco en el constructor (la UI llama a
+        leer_programaciones() en segundo plano para no demorar el arranque).
+        """
         self.configuracion = ST.ConfiguracionSoftware()
         self.ruta_programaciones = self.configuracion.diccionario_valores.get("directorio_programaciones", "./")
         self.archivo = os.path.join(self.ruta_programaciones, archivo)
         self.directorio_historico = os.path.join(self.ruta_programaciones, "historico/")
 
-        if not os.path.exists(self.ruta_programaciones):
-            os.makedirs(self.ruta_programaciones)
-        if not os.path.exists(self.directorio_historico):
-            os.makedirs(self.directorio_historico)
+        # Si cambia directorio_programaciones en Setting.ini, mudarse sin reiniciar
+        ST.servicio().al_cambiar(self._on_config)
 
         self.programaciones = []
-        self.cargar_programaciones()
+        if cargar:
+            self._asegurar_directorios()
+            self.cargar_programaciones()
 
     # -------------------------
     # Helpers
+    def _on_config(self, cambios):
+        if "directorio_programaciones" not in cambios:
+            return
+        nueva = ST.servicio().obtener("directorio_programaciones", "./")
+        if nueva == self.ruta_programaciones:
+            return
+        archivo_anterior = self.archivo
+        self.ruta_programaciones = nueva
+        self.archivo = os.path.join(nueva, os.path.basename(archivo_anterior))
+        self.directorio_historico = os.path.join(nueva, "historico/")
+        try:
+            self._asegurar_directorios()
+            # llevar las programaciones actuales si en la carpeta nueva no hay
+            if os.path.exists(archivo_anterior) and not os.path.exists(self.archivo):
+                shutil.copy2(archivo_anterior, self.archivo)
+            log.info("Programaciones: ahora en %s", self.archivo)
+        except Exception as e:
+            log.error("Programaciones: no se pudo usar %s: %s", nueva, e)
+
+    def _asegurar_directorios(self):
+        if not os.path.exists(self.ruta_programaciones):
+            os.makedirs(self.ruta_programaciones)
+        if not os.path.exists(self.directorio_historico):
+            os.makedirs(self.directorio_historico)
+
     def _generar_id(self):
         import time
         return f"prog_{int(time.time() * 1000)}"
@@ -54,6 +97,8 @@ class Programaciones:
             accion="on",
             fin_accion="off",
             nombre=None,
+            guardar=True,
+            dispositivo=None,
         ):
             """
             tipo: 'Tiempo' o 'Fecha'
@@ -61,6 +106,8 @@ class Programaciones:
             targets: ['l1','l2',...]
             accion: 'on' | 'off' (al inicio)
             fin_accion: 'on' | 'off' (al finalizar)
+            guardar: si False no escribe a disco (la UI lo hace en segundo plano)
+            dispositivo: id de la placa (modo flota); None = placa única
             """
 
             programacion = {
@@ -74,12 +121,14 @@ class Programaciones:
                 "targets": list(targets or []),
                 "accion": accion or "on",
                 "fin_accion": fin_accion or "off",
+                "dispositivo": dispositivo,
                 "fecha_creacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             }
 
             self.programaciones.append(programacion)
-            self.guardar_programaciones()
-            print(f"Programación agregada: {programacion['tipo']} - ID: {programacion['id']}")
+            if guardar:
+                self.guardar_programaciones()
+            log.info("Programación agregada: %s - ID: %s", programacion["tipo"], programacion["id"])
             return programacion
 
     def obtener_programaciones(self):
@@ -91,23 +140,25 @@ class Programaciones:
                 return prog
         return None
 
-    def eliminar_programacion(self, id_programacion):
+    def eliminar_programacion(self, id_programacion, guardar=True):
         for i, prog in enumerate(self.programaciones):
             if prog.get("id") == id_programacion:
                 self.programaciones.pop(i)
-                self.guardar_programaciones()
-                print(f"Programación eliminada: ID {id_programacion}")
+                if guardar:
+                    self.guardar_programaciones()
+                log.info("Programación eliminada: ID %s", id_programacion)
                 return True
         return False
 
-    def eliminar_por_indice(self, indice):
+    def eliminar_por_indice(self, indice, guardar=True):
         try:
             self.programaciones.pop(indice)
-            self.guardar_programaciones()
-            print(f"Programación eliminada en índice {indice}")
+            if guardar:
+                self.guardar_programaciones()
+            log.info("Programación eliminada en índice %s", indice)
             return True
         except IndexError:
-            print(f"Índice {indice} fuera de rango")
+            log.warning("Índice %s fuera de rango", indice)
             return False
 
     def actualizar_estado(self, id_programacion, activo):
@@ -115,7 +166,7 @@ class Programaciones:
             if prog.get("id") == id_programacion:
                 prog["activo"] = activo
                 self.guardar_programaciones()
-                print(f"Estado actualizado para ID {id_programacion}: {activo}")
+                log.info("Estado actualizado para ID %s: %s", id_programacion, activo)
                 return True
         return False
 
@@ -162,36 +213,85 @@ class Programaciones:
             self._guardar_en_historico(eliminadas)
             self.programaciones = validas
             self.guardar_programaciones()
-            print(f"{len(eliminadas)} programaciones movidas al historial")
+            log.info("%s programaciones movidas al historial", len(eliminadas))
 
         return len(eliminadas)
 
-    def guardar_programaciones(self):
+    def instantanea(self):
+        """Copia de las programaciones para poder guardarlas desde otro hilo."""
+        return [dict(p) for p in self.programaciones]
+
+    def guardar_programaciones(self, programaciones=None):
+        """
+        programaciones: lista a escribir (por defecto self.programaciones).
+        Pasar una instantanea() cuando se guarda fuera del hilo de la UI.
+        """
+        if programaciones is None:
+            programaciones = self.programaciones
         try:
             with open(self.archivo, "w", encoding="utf-8") as f:
-                json.dump(self.programaciones, f, indent=4, ensure_ascii=False)
-            print(f"Programaciones guardadas en: {self.archivo}")
+                json.dump(programaciones, f, indent=4, ensure_ascii=False)
+            log.debug("Programaciones guardadas en: %s", self.archivo)
             return True
         except Exception as e:
-            print(f"Error al guardar programaciones: {e}")
+            log.error("Error al guardar programaciones: %s", e)
             return False
 
     def cargar_programaciones(self):
+        programaciones = self.leer_programaciones()
+        self.programaciones = programaciones or []
+        return programaciones is not None
+
+    def leer_programaciones(self):
+        """
+        Lee el archivo sin tocar self.programaciones (apto para otro hilo).
+        Devuelve la lista, o None si no existe / no se pudo leer.
+        """
+        self._asegurar_directorios()
         if not os.path.exists(self.archivo):
-            print("No existe archivo de programaciones. Se creará uno nuevo.")
-            self.programaciones = []
-            return False
+            log.debug("No existe archivo de programaciones. Se creará uno nuevo.")
+            return None
 
         try:
             with open(self.archivo, "r", encoding="utf-8") as f:
-                self.programaciones = json.load(f)
-            print(f"Cargadas {len(self.programaciones)} programaciones desde: {self.archivo}")
+                programaciones = json.load(f)
+            log.debug("Cargadas %s programaciones desde: %s", len(programaciones), self.archivo)
+            return programaciones
+        except Exception as e:
+            log.error("Error al cargar programaciones: %s", e)
+            return None
+
+    # -------------------------
+    # Pausa (compartida entre la UI y el demonio)
+    def guardar_pausa(self, pausada: bool):
+        ruta = os.path.join(self.ruta_programaciones, ARCHIVO_PAUSA)
+        try:
+            if pausada:
+                self._asegurar_directorios()
+                tmp = ruta + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"desde": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, f)
+                os.replace(tmp, ruta)
+            elif os.path.exists(ruta):
+                os.remove(ruta)
             return True
         except Exception as e:
-            print(f"Error al cargar programaciones: {e}")
-            self.programaciones = []
+            log.error("Error al guardar la pausa: %s", e)
             return False
 
+    def en_pausa(self) -> bool:
+        ruta = os.path.join(self.ruta_programaciones, ARCHIVO_PAUSA)
+        try:
+            edad = time.time() - os.path.getmtime(ruta)
+        except OSError:
+            return False
+        if edad <= PAUSA_VIGENCIA_S:
+            return True
+        # la UI que pausó ya no la renueva (se cerró o colgó): la pausa no sigue sola
+        log.warning("Pausa vencida (sin renovar hace %d s): se descarta %s", edad, ruta)
+        self.guardar_pausa(False)
+        return False
+
     def _guardar_en_historico(self, programaciones_vencidas):
         try:
             fecha_actual = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
@@ -200,8 +300,8 @@ class Programaciones:
             with open(archivo_historico, "w", encoding="utf-8") as f:
                 json.dump(programaciones_vencidas, f, indent=4, ensure_ascii=False)
 
-            print(f"Historial guardado en: {archivo_historico}")
+            log.info("Historial guardado en: %s", archivo_historico)
             return True
         except Exception as e:
-            print(f"Error al guardar historial: {e}")
+            log.error("Error al guardar historial: %s", e)
             return False
@@ -5,6 +5,13 @@ from datetime import datetime
 
 import Programaciones as PR
 import ConexionMQTT as mqtt
+import EstadoReles as ER
+import Flota
+import AgendaPlaca as AP
+import Logs
+import Settings as ST
+
+log = Logs.obtener_logger("demonio")
 
 def parse_dt(s: str) -> datetime:
     s = (s or "").strip()
@@ -13,33 +20,91 @@ def parse_dt(s: str) -> datetime:
     return datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
 
 class SchedulerDaemon:
-    def __init__(self):
-        self.gestor = PR.Programaciones()  # usa directorio_programaciones del Settings :contentReference[oaicite:5]{index=5}
-        self.mqtt = mqtt.ServidorMQTT()    # paho + loop_start :contentReference[oaicite:6]{index=6}
-        self.mqtt.conectar()
+    def __init__(self, servidor_mqtt=None, gestor=None):
+        # servidor_mqtt / gestor: inyectables (PruebaCarga.py usa un broker en memoria)
+        self.gestor = gestor or PR.Programaciones()  # usa directorio_programaciones del Settings :contentReference[oaicite:5]{index=5}
+        self.mqtt = servidor_mqtt or mqtt.ServidorMQTT()    # paho + loop_start :contentReference[oaicite:6]{index=6}
+
+        # Estado reportado por la(s) placa(s): evita reenviar comandos ya aplicados
+        self.reles = ER.AlmacenReles(8)
+        self.flota = Flota.Flota() if self.mqtt.modo_flota else None
+        self._id_defecto = self.mqtt.id_dispositivo(self.mqtt.topico_estado) if self.flota else None
+        self.agenda = AP.SincronizadorAgenda(self.mqtt)
+        if self.flota is not None:
+            self.mqtt.suscribir_estado(self.mqtt.topico_estado_flota, self._on_estado)
+            self.agenda.suscribir(self.mqtt.topico_estado_flota)
+        else:
+            self.mqtt.suscribir_estado(self.mqtt.topico_estado, self._on_estado)
+            self.agenda.suscribir(self.mqtt.topico_estado)
+            self.mqtt.al_conectar(
+                lambda: self.mqtt.publicar(self.mqtt.topico_cmd, json.dumps({"get": "status"}))
+            )
+        self.mqtt.al_cambiar_conexion(self._on_conexion)
+        ST.servicio().iniciar_vigilancia()  # broker/carpetas nuevos sin reiniciar
+        self.mqtt.conectar_async()  # reconexión en segundo plano, el tick nunca espera
+        self._t_arranque = time.monotonic()
+        self._espera_estado_fresco_s = 15
 
         self._prev_active_ids = set()
         self._prev_active_by_id = {}
 
-    def _publish_cmd(self, payload: dict):
+    def _publish_cmd(self, payload: dict, dispositivo=None):
+        """Publica o, sin conexión, deja el comando en la cola de salida (se reenvía al reconectar)."""
         if not getattr(self.mqtt, "conectado", False):
-            self.mqtt.reconectar()
-        if getattr(self.mqtt, "conectado", False):
-            self.mqtt.publicar(self.mqtt.topico_cmd, json.dumps(payload), retain=False)
+            self.mqtt.reconectar()  # no bloquea: si ya está reconectando no hace nada
+        topico = self.mqtt.topico_cmd_dispositivo(dispositivo)
+        return self.mqtt.publicar_comando(topico, payload) in ("enviado", "encolado")
+
+    def _on_conexion(self, estado, detalle):
+        log.info("MQTT: %s%s", estado, " ({})".format(detalle) if detalle else "")
+
+    def _dispositivo_de(self, prog: dict):
+        if self.flota is None:
+            return None
+        return prog.get("dispositivo") or self._id_defecto
+
+    def _reles_de(self, dispositivo) -> ER.AlmacenReles:
+        if self.flota is None:
+            return self.reles
+        return self.flota.obtener(dispositivo).reles
+
+    def _on_estado(self, topic, data: dict):
+        # ya decodificado (JSON o binario) por suscribir_estado
+        if self.flota is not None:
+            self.flota.poner(self.mqtt.id_dispositivo(topic), data)
+        else:
+            self.reles.aplicar_estado(data)
 
     def tick(self):
+        if self.flota is not None:
+            for id_disp in self.flota.aplicar_pendientes():
+                if self.flota.obtener(id_disp).actualizaciones == 1:
+                    # placa nueva: pedir estado completo
+                    self._publish_cmd({"get": "status"}, dispositivo=id_disp)
+
+        # reintentar comandos que la placa no confirmó
+        self.mqtt.revisar_acks()
+
         # recargar por si la UI editó el json
         self.gestor.cargar_programaciones()
 
+        # agenda local de las placas que la soportan (el PC sigue mandando igual);
+        # con la UI en pausa va vacía, igual que la que manda la UI
+        self.agenda.sincronizar(
+            [] if self.gestor.en_pausa() else self.gestor.obtener_programaciones(),
+            self._dispositivo_de,
+        )
+
         activas = self.gestor.obtener_programaciones_activas()  # :contentReference[oaicite:7]{index=7}
         activas = sorted(activas, key=lambda p: parse_dt(p.get("inicio", "")))
 
-        # desired state: lo activo “gana”
+        # desired state: lo activo “gana”  ((placa, relé) -> acción)
         desired = {}
         for prog in activas:
             accion = prog.get("accion", "on")
+            disp = self._dispositivo_de(prog)
             for k in prog.get("targets", []):
-                desired[k] = accion
+                desired[(disp, k)] = accion
 
         # detectar terminadas (para aplicar fin_accion)
         active_ids = {p.get("id") for p in activas if p.get("id")}
@@ -50,14 +115,24 @@ class SchedulerDaemon:
             if not prog:
                 continue
             fin_acc = prog.get("fin_accion", "off")
+            disp = self._dispositivo_de(prog)
             for k in prog.get("targets", []):
                 # solo aplicar fin_accion si ya no hay otra activa controlando ese relé
-                if k not in desired:
-                    desired[k] = fin_acc
+                if (disp, k) not in desired:
+                    desired[(disp, k)] = fin_acc
 
-        # publicar comandos (solo para relés involucrados)
-        for k, acc in desired.items():
-            self._publish_cmd({k: acc})
+        # publicar comandos (solo para relés que no están ya en ese estado)
+        en_espera = time.monotonic() - self._t_arranque < self._espera_estado_fresco_s
+        for (disp, k), acc in desired.items():
+            reles = self._reles_de(disp)
+            # sin estado real de la placa todavía: no decidir comandos a ciegas
+            if reles.obsoleto and en_espera:
+                continue
+            encender = (acc == "on")
+            if not reles.requiere_comando(k, encender):
+                continue
+            if self._publish_cmd({k: acc}, dispositivo=disp):
+                reles.comandar(k, encender)
 
         # limpiar vencidas (mueve a histórico) :contentReference[oaicite:8]{index=8}
         self.gestor.limpiar_programaciones_vencidas()
@@ -71,8 +146,9 @@ class SchedulerDaemon:
             try:
                 self.tick()
             except Exception as e:
-                print("Scheduler error:", e)
+                log.exception("Scheduler error: %s", e)
             time.sleep(1)
 
 if __name__ == "__main__":
+    Logs.configurar()
     SchedulerDaemon().run()
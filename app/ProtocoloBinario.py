@@ -0,0 +1,106 @@
+"""
+Protocolo binario compacto con la placa (alternativa al JSON).
+
+Va en los mismos tópicos con el sufijo "/b":
+
+  estado  (topico_estado + "/b"), 2 o 4 bytes:
+    [0] flags: version<<4 | 0x01 online | 0x02 trae ack
+    [1] máscara de relés (bit i-1 = l<i> encendido)
+    [2:4] ack (uint16 big-endian), solo si flags & 0x02
+
+  comando (topico_cmd + "/b"), 3 o 5 bytes:
+    [0] flags: version<<4 | 0x01 pedir estado | 0x02 trae seq
+    [1] máscara a encender
+    [2] máscara a apagar
+    [3:5] seq (uint16 big-endian), solo si flags & 0x02
+
+Negociación: la placa que lo entiende manda "bin": 1 en su estado JSON;
+recién ahí la app le manda comandos binarios, y la placa contesta en el
+formato del último comando de relés que recibió. Las funciones devuelven
+y aceptan los mismos dicts que el JSON ({"online": "on", "l1": "off", ...}),
+así el resto de la app no se entera del formato.
+"""
+
+SUFIJO = "/b"
+VERSION = 1
+
+ONLINE = 0x01
+TRAE_ACK = 0x02
+PEDIR_ESTADO = 0x01
+TRAE_SEQ = 0x02
+
+CANTIDAD_RELES = 8
+
+# "l1".."l8" -> bit, precalculado (se usa en cada mensaje)
+_BIT = {"l{}".format(i): 1 << (i - 1) for i in range(1, CANTIDAD_RELES + 1)}
+_CLAVES = tuple(_BIT.items())
+
+
+def codificar_estado(mascara: int, online=True, ack=None) -> bytes:
+    flags = (VERSION << 4) | (ONLINE if online else 0)
+    if ack is None:
+        return bytes((flags, mascara & 0xFF))
+    ack = int(ack) & 0xFFFF
+    return bytes((flags | TRAE_ACK, mascara & 0xFF, ack >> 8, ack & 0xFF))
+
+
+def decodificar_estado(paquete: bytes):
+    """bytes -> {"online": "on"|"off", "l1": ..., "l8": ..., ["ack": n]} (None si no es válido)."""
+    if len(paquete) < 2 or (paquete[0] >> 4) != VERSION:
+        return None
+    flags, mascara = paquete[0], paquete[1]
+    data = {"online": "on" if flags & ONLINE else "off"}
+    for clave, bit in _CLAVES:
+        data[clave] = "on" if mascara & bit else "off"
+    if flags & TRAE_ACK:
+        if len(paquete) < 4:
+            return None
+        data["ack"] = (paquete[2] << 8) | paquete[3]
+    return data
+
+
+def codificar_comando(comando: dict, seq=None):
+    """
+    {"l2": "on", "l5": "off"} / {"get": "status"} -> bytes.
+    None si el comando trae algo que no entra en el formato (ej. el LED):
+    en ese caso hay que mandarlo en JSON.
+    """
+    flags = VERSION << 4
+    encender = 0
+    apagar = 0
+    for clave, valor in comando.items():
+        bit = _BIT.get(clave)
+        if bit is not None and valor == "on":
+            encender |= bit
+        elif bit is not None and valor == "off":
+            apagar |= bit
+        elif clave == "get" and valor == "status":
+            flags |= PEDIR_ESTADO
+        elif clave == "seq":
+            seq = valor
+        else:
+            return None
+    if seq is None:
+        return bytes((flags, encender, apagar))
+    seq = int(seq) & 0xFFFF
+    return bytes((flags | TRAE_SEQ, encender, apagar, seq >> 8, seq & 0xFF))
+
+
+def decodificar_comando(paquete: bytes):
+    """Inverso de codificar_comando (lo usan la placa simulada y las pruebas)."""
+    if len(paquete) < 3 or (paquete[0] >> 4) != VERSION:
+        return None
+    flags, encender, apagar = paquete[0], paquete[1], paquete[2]
+    comando = {}
+    for clave, bit in _CLAVES:
+        if encender & bit:
+            comando[clave] = "on"
+        elif apagar & bit:
+            comando[clave] = "off"
+    if flags & PEDIR_ESTADO:
+        comando["get"] = "status"
+    if flags & TRAE_SEQ:
+        if len(paquete) < 5:
+            return None
+        comando["seq"] = (paquete[3] << 8) | paquete[4]
+    return comando
@@ -0,0 +1,438 @@
+"""
+Prueba de carga sin hardware: N placas simuladas + broker en memoria.
+
+    python PruebaCarga.py --placas 10,100,300 --duracion 30
+
+- BrokerLocal: reemplazo en memoria del broker (filtros + y #, retained, LWT).
+- ClienteFalso: misma interfaz que paho.Client, así ServidorMQTT corre tal cual
+  (árbol de tópicos, acks, cola de salida, protocolo binario).
+- PlacaSimulada: el protocolo de src/main.py ({"get":"status"}, l1..l8, seq/ack,
+  "/b" binario, estado al cambiar + keepalive cada 30-60 s, LWT offline al morir).
+- Maneja SchedulerDaemon en modo flota con programaciones que prenden y
+  apagan relés todo el tiempo, y reporta mensajes/s, latencia de comandos
+  (publicación -> ack), duración del tick y CPU/memoria para cada N.
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import queue
+import random
+import argparse
+import tempfile
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import Logs
+import ConexionMQTT as mqtt
+import ProtocoloBinario as PB
+import Programaciones as PR
+from Programador_demonio import SchedulerDaemon
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+PREFIJO = "carga"
+TOPICO_ESTADO_FLOTA = PREFIJO + "/+/estado"
+TOPICO_CMD_FLOTA = PREFIJO + "/{id}/cmd"
+
+
+class _Mensaje:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class _Resultado:
+    rc = 0  # MQTT_ERR_SUCCESS
+
+
+# -------------------------
+# Broker en memoria
+class BrokerLocal:
+    def __init__(self):
+        self._arbol = mqtt.ArbolTopicos()
+        self._retenidos = {}
+        self._lock = threading.Lock()
+        self.publicados = 0
+        self.entregados = 0
+        self.bytes = 0
+
+    def suscribir(self, filtro, suscriptor):
+        with self._lock:
+            self._arbol.agregar(filtro, suscriptor)
+            uno = mqtt.ArbolTopicos()
+            uno.agregar(filtro, True)
+            retenidos = [(t, p) for t, p in self._retenidos.items() if uno.coincidencias(t)]
+        for topic, payload in retenidos:
+            suscriptor.entregar(topic, payload)
+
+    def desuscribir(self, filtro, suscriptor):
+        with self._lock:
+            self._arbol.quitar(filtro, suscriptor)
+
+    def publicar(self, topic, payload, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        else:
+            payload = bytes(payload)
+        with self._lock:
+            self.publicados += 1
+            self.bytes += len(payload)
+            if retain:
+                self._retenidos[topic] = payload
+            destinos = self._arbol.coincidencias(topic)
+            self.entregados += len(destinos)
+        for suscriptor in destinos:
+            suscriptor.entregar(topic, payload)
+
+
+class ClienteFalso:
+    """Lo mínimo de paho.Client que usa ServidorMQTT, contra un BrokerLocal."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self._entrante = queue.Queue()
+        self._hilo = None
+        self._filtros = set()
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def connect_async(self, host, port=1883, keepalive=60):
+        pass
+
+    connect = connect_async
+
+    def loop_start(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._loop, daemon=True)
+            self._hilo.start()
+
+    def loop_stop(self):
+        if self._hilo is not None:
+            self._entrante.put(None)
+            self._hilo = None
+
+    def disconnect(self):
+        for filtro in list(self._filtros):
+            self.broker.desuscribir(filtro, self)
+        if self.on_disconnect:
+            self.on_disconnect(self, None, 0)
+
+    def subscribe(self, topic, qos=0):
+        if topic not in self._filtros:
+            self._filtros.add(topic)
+            self.broker.suscribir(topic, self)
+        return (0, 1)
+
+    def unsubscribe(self, topic):
+        self._filtros.discard(topic)
+        self.broker.desuscribir(topic, self)
+        return (0, 1)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publicar(topic, payload, retain)
+        return _Resultado()
+
+    def entregar(self, topic, payload):
+        self._entrante.put(_Mensaje(topic, payload))
+
+    def _loop(self):
+        # como el hilo de paho: on_connect y después los mensajes en orden
+        self.on_connect(self, None, {}, 0)
+        while True:
+            msg = self._entrante.get()
+            if msg is None:
+                return
+            self.on_message(self, None, msg)
+
+
+# -------------------------
+# Placas simuladas
+class SimuladorPlacas:
+    """Un solo hilo atiende todas las placas (agenda por tiempo), escala a cientos."""
+
+    def __init__(self, broker, retardo_ms=(5, 25)):
+        self.broker = broker
+        self.retardo_ms = retardo_ms
+        self._agenda = []
+        self._n = 0
+        self._cond = threading.Condition()
+        self._activo = True
+        self._hilo = threading.Thread(target=self._loop, daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        with self._cond:
+            self._activo = False
+            self._cond.notify()
+
+    def programar(self, demora_s, fn, *args):
+        with self._cond:
+            self._n += 1
+            heapq.heappush(self._agenda, (time.monotonic() + demora_s, self._n, fn, args))
+            self._cond.notify()
+
+    def retardo(self):
+        return random.uniform(*self.retardo_ms) / 1000.0
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._activo and (not self._agenda or self._agenda[0][0] > time.monotonic()):
+                    espera = self._agenda[0][0] - time.monotonic() if self._agenda else None
+                    self._cond.wait(espera)
+                if not self._activo:
+                    return
+                _, _, fn, args = heapq.heappop(self._agenda)
+            try:
+                fn(*args)
+            except Exception as e:
+                print("Placa simulada: error", e, file=sys.stderr)
+
+
+class PlacaSimulada:
+    def __init__(self, simulador, id_placa):
+        self.sim = simulador
+        self.broker = simulador.broker
+        self.id = id_placa
+        self.topico_estado = "{}/{}/estado".format(PREFIJO, id_placa)
+        self.topico_cmd = TOPICO_CMD_FLOTA.format(id=id_placa)
+        self.mascara = 0
+        self.modo_binario = False
+        self.viva = False
+        self.comandos = 0
+        self._ultima_pub = 0.0
+        self._intervalo = 0.0
+
+    # el broker entrega acá; la placa "procesa" después del retardo de red
+    def entregar(self, topic, payload):
+        if self.viva:
+            self.sim.programar(self.sim.retardo(), self._on_mensaje, topic, payload)
+
+    def arrancar(self):
+        self.viva = True
+        self.broker.suscribir(self.topico_cmd, self)
+        self.broker.suscribir(self.topico_cmd + PB.SUFIJO, self)
+        self.broker.publicar(self.topico_estado, json.dumps({"online": "off"}), retain=True)
+        self.publicar_estado(retain=True)
+        self._armar_heartbeat()
+
+    def morir(self):
+        """Corte de luz: el broker publica el LWT."""
+        self.viva = False
+        self.broker.desuscribir(self.topico_cmd, self)
+        self.broker.desuscribir(self.topico_cmd + PB.SUFIJO, self)
+        self.broker.publicar(self.topico_estado, json.dumps({"online": "off"}), retain=True)
+
+    def _armar_heartbeat(self):
+        self._intervalo = random.uniform(30.0, 60.0)
+        self.sim.programar(self._intervalo, self._heartbeat)
+
+    def _heartbeat(self):
+        # como la placa: solo republica si no publicó nada en el intervalo
+        if not self.viva:
+            return
+        restante = self._ultima_pub + self._intervalo - time.monotonic()
+        if restante > 0:
+            self.sim.programar(restante, self._heartbeat)
+            return
+        self.publicar_estado()
+        self._armar_heartbeat()
+
+    def publicar_estado(self, retain=False, ack=None):
+        self._ultima_pub = time.monotonic()
+        if self.modo_binario and not retain:
+            self.broker.publicar(self.topico_estado + PB.SUFIJO, PB.codificar_estado(self.mascara, ack=ack))
+            return
+        payload = {"online": "on", "bin": 1}
+        for i in range(8):
+            payload["l{}".format(i + 1)] = "on" if self.mascara & (1 << i) else "off"
+        if ack is not None:
+            payload["ack"] = ack
+        self.broker.publicar(self.topico_estado, json.dumps(payload), retain=retain)
+
+    def _on_mensaje(self, topic, payload):
+        if not self.viva:
+            return
+        if topic.endswith(PB.SUFIJO):
+            data = PB.decodificar_comando(payload)
+            binario = True
+        else:
+            data = json.loads(payload.decode())
+            binario = False
+        if not data:
+            return
+
+        self.comandos += 1
+        seq = data.get("seq")
+        if data.get("get") == "status" and not any(k in data for k in PB._BIT):
+            self.publicar_estado(ack=seq)
+            return
+
+        cambio = False
+        for clave, bit in PB._CLAVES:
+            if data.get(clave) == "on":
+                self.mascara |= bit
+                cambio = True
+            elif data.get(clave) == "off":
+                self.mascara &= ~bit
+                cambio = True
+        if cambio:
+            self.modo_binario = binario
+        if cambio or seq is not None:
+            self.publicar_estado(ack=seq)
+
+
+# -------------------------
+# Corrida
+def _memoria_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except Exception:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return None
+
+
+def _fmt(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def correr(n_placas, duracion_s=30, periodo_prog_s=6, binario=True, caidas=0.0, semilla=1):
+    random.seed(semilla)
+    directorio = tempfile.mkdtemp(prefix="prueba_carga_")
+
+    broker = BrokerLocal()
+    sim = SimuladorPlacas(broker)
+    placas = [PlacaSimulada(sim, "placa{:03d}".format(i)) for i in range(n_placas)]
+
+    servidor = mqtt.ServidorMQTT(cliente=ClienteFalso(broker))
+    servidor.modo_flota = True
+    servidor.topico_estado_flota = TOPICO_ESTADO_FLOTA
+    servidor.topico_cmd_flota = TOPICO_CMD_FLOTA
+    servidor.usar_binario = binario
+
+    gestor = PR.Programaciones(cargar=False)
+    gestor.ruta_programaciones = directorio
+    gestor.archivo = os.path.join(directorio, "programaciones.json")
+    gestor.directorio_historico = os.path.join(directorio, "historico")
+
+    demonio = SchedulerDaemon(servidor_mqtt=servidor, gestor=gestor)
+    demonio._espera_estado_fresco_s = 3
+    sim.iniciar()
+    for p in placas:
+        p.arrancar()
+
+    proxima_prog = {p.id: time.monotonic() + random.uniform(0, periodo_prog_s) for p in placas}
+    murieron = False
+    ticks_ms = []
+    cpu0, t0 = time.process_time(), time.monotonic()
+    pub0 = broker.publicados
+
+    while time.monotonic() - t0 < duracion_s:
+        t_tick = time.monotonic()
+
+        # cada placa recibe una programación corta (prende y a los 3 s apaga)
+        ahora = datetime.now()
+        nuevas = False
+        for p in placas:
+            if t_tick >= proxima_prog[p.id]:
+                proxima_prog[p.id] = t_tick + periodo_prog_s
+                gestor.agregar_programacion(
+                    "Tiempo", _fmt(ahora), _fmt(ahora + timedelta(seconds=3)),
+                    targets=["l{}".format(random.randint(1, 8))],
+                    guardar=False, dispositivo=p.id,
+                )
+                nuevas = True
+        if nuevas:
+            gestor.guardar_programaciones()
+
+        if caidas and not murieron and t_tick - t0 >= duracion_s / 2:
+            for p in random.sample(placas, int(n_placas * caidas)):
+                sim.programar(0, p.morir)
+            murieron = True
+
+        demonio.tick()
+        ticks_ms.append((time.monotonic() - t_tick) * 1000.0)
+        time.sleep(max(0.0, 1.0 - (time.monotonic() - t_tick)))
+
+    wall = time.monotonic() - t0
+    cpu = time.process_time() - cpu0
+    sim.detener()
+    servidor.desconectar()
+
+    acks = servidor.acks
+    lat = acks.latencias.resumen()
+    online = sum(1 for d in demonio.flota if d.reles.online)
+    return {
+        "placas": n_placas,
+        "duracion_s": round(wall, 1),
+        "msgs_s": round((broker.publicados - pub0) / wall, 1),
+        "kb_s": round(broker.bytes / wall / 1024.0, 1),
+        "comandos": acks.confirmados + acks.sin_ack + len(acks),
+        "confirmados": acks.confirmados,
+        "reintentos": acks.reintentos,
+        "sin_ack": acks.sin_ack,
+        "lat_p50_ms": lat.get("p50_ms"),
+        "lat_p90_ms": lat.get("p90_ms"),
+        "lat_p99_ms": lat.get("p99_ms"),
+        "lat_max_ms": lat.get("max_ms"),
+        "tick_media_ms": round(sum(ticks_ms) / len(ticks_ms), 1) if ticks_ms else 0,
+        "tick_max_ms": round(max(ticks_ms), 1) if ticks_ms else 0,
+        "cpu_pct": round(100.0 * cpu / wall, 1),
+        "mem_mb": round(_memoria_mb() or 0, 1),
+        "placas_vistas": len(demonio.flota),
+        "placas_online": online,
+    }
+
+
+COLUMNAS = (
+    ("placas", "{:>6}"), ("msgs_s", "{:>8}"), ("kb_s", "{:>7}"), ("confirmados", "{:>6}"),
+    ("reintentos", "{:>6}"), ("sin_ack", "{:>5}"), ("lat_p50_ms", "{:>8}"), ("lat_p99_ms", "{:>8}"),
+    ("lat_max_ms", "{:>8}"), ("tick_media_ms", "{:>7}"), ("tick_max_ms", "{:>7}"),
+    ("cpu_pct", "{:>6}"), ("mem_mb", "{:>7}"),
+)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Prueba de carga con placas simuladas")
+    ap.add_argument("--placas", default="10,50,100,300", help="lista de N separada por comas")
+    ap.add_argument("--duracion", type=float, default=30, help="segundos por corrida")
+    ap.add_argument("--periodo", type=float, default=6, help="segundos entre programaciones por placa")
+    ap.add_argument("--json", action="store_true", help="usar solo JSON (sin protocolo binario)")
+    ap.add_argument("--caidas", type=float, default=0.0, help="fracción de placas que mueren a mitad de corrida")
+    ap.add_argument("--salida", help="guardar resultados en este archivo JSON")
+    ap.add_argument("--nivel-log", default="WARNING", help="nivel de log durante la prueba")
+    args = ap.parse_args()
+    Logs.configurar(getattr(logging, args.nivel_log.upper(), logging.WARNING), archivo=False)
+
+    print(" ".join(fmt.format(nombre[:8]) for nombre, fmt in COLUMNAS))
+    resultados = []
+    for n in [int(x) for x in args.placas.split(",") if x.strip()]:
+        r = correr(n, args.duracion, args.periodo, binario=not args.json, caidas=args.caidas)
+        resultados.append(r)
+        print(" ".join(fmt.format(r[nombre] if r[nombre] is not None else "-") for nombre, fmt in COLUMNAS))
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,171 @@
 import os
 import sys
+import time
+import weakref
+import threading
+
+def ruta_setting_ini():
+    """Setting.ini junto al ejecutable/script (o app/Setting.ini en desarrollo)."""
+    p1 = os.path.join(os.path.dirname(sys.argv[0]), "Setting.ini")
+    p2 = os.path.join("app", "Setting.ini")
+    if os.path.exists(p1) or not os.path.exists(p2):
+        return p1
+    return p2
+
+
+class ServicioConfiguracion:
+    """
+    Setting.ini leído una sola vez por proceso (ver servicio()).
+
+    - valores(): dict cacheado; obtener_int/float/bool: valores tipados.
+    - recargar(): vuelve a leer solo si cambió el mtime/tamaño del archivo.
+    - iniciar_vigilancia(): hilo que llama a recargar() cada pocos segundos.
+    - al_cambiar(fn): fn(cambios) con {clave: (anterior, nuevo)} por cada
+      recarga con diferencias. Los métodos se guardan como referencia débil:
+      un objeto suscripto puede morir sin desuscribirse.
+    """
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta or ruta_setting_ini()
+        self._lock = threading.RLock()
+        self._valores = {}
+        self._firma = None
+        self._oyentes = []
+        self._hilo = None
+        self.recargar()
+
+    @staticmethod
+    def parsear(contenido):
+        valores = {}
+        for linea in contenido.splitlines():
+            linea = linea.strip()
+            if not linea or linea.startswith("#") or "=" not in linea:
+                continue
+            clave, valor = linea.split("=", 1)
+            valores[clave.strip()] = valor.strip()
+        return valores
+
+    def _firma_archivo(self):
+        try:
+            st = os.stat(self.ruta)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def recargar(self, forzar=False):
+        """Devuelve {clave: (anterior, nuevo)} con lo que cambió (vacío si nada)."""
+        with self._lock:
+            firma = self._firma_archivo()
+            if firma == self._firma and not forzar:
+                return {}
+            try:
+                with open(self.ruta, "r", encoding="utf-8") as archivo:
+                    nuevos = self.parsear(archivo.read())
+            except Exception as e:
+                print("Error config:", e)
+                nuevos = {}
+            self._firma = firma
+
+            anteriores = self._valores
+            cambios = {
+                clave: (anteriores.get(clave), nuevos.get(clave))
+                for clave in set(anteriores) | set(nuevos)
+                if anteriores.get(clave) != nuevos.get(clave)
+            }
+            self._valores = nuevos
+            # las refs muertas se podan acá, bajo el lock (al_cambiar agrega desde otros hilos)
+            self._oyentes = [ref for ref in self._oyentes if ref() is not None]
+            oyentes = list(self._oyentes) if cambios and anteriores else []
+
+        for ref in oyentes:
+            fn = ref()
+            if fn is None:
+                continue
+            try:
+                fn(cambios)
+            except Exception as e:
+                print("Error en oyente de configuración:", e)
+        return cambios
+
+    # -------------------------
+    # Lectura
+    def valores(self):
+        return self._valores
+
+    def obtener(self, clave, defecto=""):
+        return self._valores.get(clave, defecto)
+
+    def obtener_int(self, clave, defecto=0):
+        try:
+            return int(self._valores.get(clave, defecto))
+        except (TypeError, ValueError):
+            return defecto
+
+    def obtener_float(self, clave, defecto=0.0):
+        try:
+            return float(self._valores.get(clave, defecto))
+        except (TypeError, ValueError):
+            return defecto
+
+    def obtener_bool(self, clave, defecto=False):
+        valor = self._valores.get(clave)
+        if valor is None:
+            return defecto
+        return valor.strip().lower() in ("1", "true", "si", "on")
+
+    # -------------------------
+    # Archivo completo (vista de configuración)
+    def contenido(self):
+        with open(self.ruta, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def guardar_contenido(self, contenido):
+        """Escritura atómica y recarga inmediata (los oyentes se enteran ya)."""
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        tmp = self.ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(contenido)
+        os.replace(tmp, self.ruta)
+        return self.recargar(forzar=True)
+
+    # -------------------------
+    # Cambios en caliente
+    def al_cambiar(self, fn):
+        ref = weakref.WeakMethod(fn) if hasattr(fn, "__self__") else (lambda: fn)
+        with self._lock:
+            self._oyentes.append(ref)
+
+    def iniciar_vigilancia(self, intervalo_s=2.0):
+        if self._hilo is not None:
+            return
+
+        def vigilar():
+            while True:
+                time.sleep(intervalo_s)
+                self.recargar()
+
+        self._hilo = threading.Thread(target=vigilar, name="VigilanciaSetting", daemon=True)
+        self._hilo.start()
+
+
+_servicio = None
+_lock_servicio = threading.Lock()
+
+
+def servicio():
+    """Servicio de configuración compartido por todo el proceso."""
+    global _servicio
+    if _servicio is None:
+        with _lock_servicio:
+            if _servicio is None:
+                _servicio = ServicioConfiguracion()
+    return _servicio
+
 
 class configuracion:
     def __init__(self):
-        self.ruta_config = os.path.join(os.path.dirname(sys.argv[0]), "Setting.ini")
-        diccionario_config = {}
-        try:
-            with open(self.ruta_config, "r") as archivo:
-                lineas_config = archivo.readlines()
-                for linea in lineas_config:
-                    linea = linea.strip()
-                    if not linea or linea.startswith("#"):
-                        continue
-                    if "=" in linea:
-                        clave, valor = linea.split("=", 1)
-                        diccionario_config[clave.strip()] = valor.strip()
-        except Exception as e:
-            print("Error config:", e)
-        self.diccionario_valores = diccionario_config
+        self.ruta_config = servicio().ruta
+        self.diccionario_valores = servicio().valores()
     
     def obtener_claves_wifi(self):
         ssid = self.diccionario_valores.get("WIFI_SSID", "")
@@ -34,25 +182,57 @@ class configuracion:
         topico_estado = self.diccionario_valores.get("TOPICO_ESTADO", "")
         return topico_cmd, topico_estado
 
+    def obtener_config_flota(self):
+        """
+        Modo flota (varias placas en un mismo broker):
+          MODO_FLOTA=1
+          TOPICO_ESTADO_FLOTA=respirometro/+/estado   (el '+' es el id de la placa)
+          TOPICO_CMD_FLOTA=respirometro/{id}/cmd
+        """
+        activo = self.diccionario_valores.get("MODO_FLOTA", "0").strip().lower() in ("1", "true", "si", "on")
+        topico_estado = self.diccionario_valores.get("TOPICO_ESTADO_FLOTA", "respirometro/+/estado")
+        topico_cmd = self.diccionario_valores.get("TOPICO_CMD_FLOTA", "respirometro/{id}/cmd")
+        return activo, topico_estado, topico_cmd
+
+    def obtener_modo_mqtt(self):
+        """
+        MQTT_MODO=hilo     -> loop_start() de paho (hilo propio), por defecto
+        MQTT_MODO=asyncio  -> el socket lo atiende el event loop de la app
+        """
+        modo = self.diccionario_valores.get("MQTT_MODO", "hilo").strip().lower()
+        return modo if modo in ("hilo", "asyncio") else "hilo"
+
+    def obtener_nivel_log(self):
+        """NIVEL_LOG=DEBUG | INFO | WARNING | ERROR (por defecto INFO)."""
+        nivel = self.diccionario_valores.get("NIVEL_LOG", "INFO").strip().upper()
+        return nivel if nivel in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL") else "INFO"
+
+    def obtener_protocolo_binario(self):
+        """PROTOCOLO_BINARIO=1: usar el formato compacto con las placas que lo anuncian."""
+        return self.diccionario_valores.get("PROTOCOLO_BINARIO", "1").strip().lower() in ("1", "true", "si", "on")
+
+    def obtener_edad_maxima_cola(self):
+        """
+        (segundos, segundos_pulsos): antigüedad máxima de un comando en la cola
+        de salida. COLA_MAX_EDAD_MIN (por defecto 10) para los comunes y
+        COLA_MAX_EDAD_PULSOS_S (por defecto 30) para pulsos/patrones.
+        """
+        try:
+            edad = float(self.diccionario_valores.get("COLA_MAX_EDAD_MIN", "10")) * 60
+        except ValueError:
+            edad = 600.0
+        try:
+            edad_pulsos = float(self.diccionario_valores.get("COLA_MAX_EDAD_PULSOS_S", "30"))
+        except ValueError:
+            edad_pulsos = 30.0
+        return edad, edad_pulsos
+
 class ConfiguracionSoftware:
    def __init__(self):
         self.nombre_software = "Andrea_Software_v1.0"
         self.creador_software = "UVI - UTNFRGTDF"
-        self.ruta_config = os.path.join(os.path.dirname(sys.argv[0]), "Setting.ini")
-        diccionario_config = {}
-        try:
-            with open(self.ruta_config, "r") as archivo:
-                lineas_config = archivo.readlines()
-                for linea in lineas_config:
-                    linea = linea.strip()
-                    if not linea or linea.startswith("#"):
-                        continue
-                    if "=" in linea:
-                        clave, valor = linea.split("=", 1)
-                        diccionario_config[clave.strip()] = valor.strip()
-        except Exception as e:
-            print("Error config:", e)
-        self.diccionario_valores = diccionario_config
+        self.ruta_config = servicio().ruta
+        self.diccionario_valores = servicio().valores()
 
    @staticmethod
    def obtener_directorio_programaciones(self):
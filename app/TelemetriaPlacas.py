@@ -0,0 +1,65 @@
+import json
+import time
+import threading
+
+import Logs
+
+log = Logs.obtener_logger("telemetria")
+
+SUFIJO = "/telemetria"
+
+
+class TelemetriaPlacas:
+    """
+    Último reporte de telemetría de cada placa (topico_estado + "/telemetria",
+    cada ~60 s): duración de cada paso del loop (todas las tareas, sin
+    esperas), memoria libre mínima, reconexiones, mensajes y tiempo en el
+    callback, RSSI.
+
+    _on_telemetria corre en el hilo de MQTT; la UI lee con obtener()/texto().
+    """
+
+    def __init__(self, servidor_mqtt):
+        self.mqtt = servidor_mqtt
+        self._reportes = {}  # placa -> (monotonic, dict)
+        self._lock = threading.Lock()
+
+    def suscribir(self, filtro_estado):
+        self.mqtt.suscribir(filtro_estado + SUFIJO, self._on_telemetria)
+
+    def _on_telemetria(self, topic, payload):
+        try:
+            data = json.loads(payload.decode("utf-8", errors="ignore"))
+        except Exception as e:
+            log.warning("Telemetría inválida de %s: %s", topic, e)
+            return
+        if not isinstance(data, dict):
+            return
+        disp = self.mqtt.id_dispositivo(topic[:-len(SUFIJO)]) if self.mqtt.modo_flota else None
+        with self._lock:
+            self._reportes[disp] = (time.monotonic(), data)
+        log.debug("Telemetría %s: %s", disp or "placa", data)
+
+    def obtener(self, dispositivo=None):
+        """(monotonic de llegada, dict) o None si la placa nunca reportó."""
+        with self._lock:
+            return self._reportes.get(dispositivo)
+
+    def texto(self, dispositivo=None) -> str:
+        rep = self.obtener(dispositivo)
+        if rep is None:
+            return ""
+        _, d = rep
+        partes = [
+            "loop {:.1f}/{:.1f}/{:.1f} ms".format(
+                d.get("vuelta_min_us", 0) / 1000.0,
+                d.get("vuelta_med_us", 0) / 1000.0,
+                d.get("vuelta_max_us", 0) / 1000.0,
+            ),
+            "mem mín {} KB".format(d.get("mem_min", 0) // 1024),
+            "{} msg (cb {:.1f} ms)".format(d.get("mensajes", 0), d.get("cb_med_us", 0) / 1000.0),
+            "reconex {}/{}".format(d.get("reconex_mqtt", 0), d.get("reconex_wifi", 0)),
+        ]
+        if d.get("rssi") is not None:
+            partes.append("RSSI {} dBm".format(d["rssi"]))
+        return " · ".join(partes)
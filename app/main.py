@@ -1,59 +1,47 @@
+import time as pytime
+_T_INICIO = pytime.perf_counter()  # perfil de arranque: antes de los imports pesados
+
 import flet as ft
 from datetime import datetime, timedelta
 import math
 import Programaciones as PR
 import ConexionMQTT as mqtt
+import EstadoReles as ER
+import Flota
+import AgendaPlaca as AP
+import TelemetriaPlacas as TP
+import PerfilArranque as PA
+import Logs
+import Settings as ST
 import json
 import asyncio
 import queue
-import time as pytime
 import os
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+
+PERFIL_ARRANQUE = PA.PerfilArranque(_T_INICIO)
+PERFIL_ARRANQUE.marcar("imports")
+
+log = Logs.obtener_logger("ui")  # Logs.configurar() corre en main(), dentro del perfil
 
 class ControlRespirometro(ft.Container):
     
     # -------------------------
     # CONFIGURACIONES (VISTA)
     def _get_setting_ini_path(self) -> str:
-        """Devuelve la ruta real del Setting.ini tanto en modo dev como compilado (.exe)."""
-        import os, sys
-        # 1) en el mismo directorio del ejecutable/script
-        p1 = os.path.join(os.path.dirname(sys.argv[0]), "Setting.ini")
-        # 2) compatibilidad con tu estructura anterior
-        p2 = os.path.join("app", "Setting.ini")
-
-        if os.path.exists(p1):
-            return p1
-        if os.path.exists(p2):
-            return p2
-
-        # si no existe, preferimos crearlo junto al ejecutable
-        return p1
+        """Ruta real del Setting.ini (la resuelve el servicio de configuración)."""
+        return ST.servicio().ruta
 
     def _leer_setting_ini(self) -> str:
         try:
-            ruta = self._get_setting_ini_path()
-            with open(ruta, "r", encoding="utf-8") as f:
-                return f.read()
+            return ST.servicio().contenido()
         except Exception as ex:
             return f"Error al leer Setting.ini: {ex}"
 
     def _escribir_setting_ini(self, contenido: str) -> None:
-        ruta = self._get_setting_ini_path()
-        # crear carpeta si hace falta (por si queda algo como app/Setting.ini)
-        import os
-        os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
-        with open(ruta, "w", encoding="utf-8") as f:
-            f.write(contenido)
-
-    def _parse_ini_kv(self, contenido: str) -> dict:
-        d = {}
-        for linea in contenido.splitlines():
-            s = linea.strip()
-            if not s or s.startswith("#") or "=" not in s:
-                continue
-            k, v = s.split("=", 1)
-            d[k.strip()] = v.strip()
-        return d
+        # escribe y recarga: MQTT y carpetas se actualizan solos (oyentes del servicio)
+        ST.servicio().guardar_contenido(contenido)
 
     # -------------------------
     # Historial de programaciones (persistente en JSON)
@@ -70,18 +58,22 @@ class ControlRespirometro(ft.Container):
                 if isinstance(data, list):
                     return data
         except Exception as e:
-            print(f"Historial: error al leer {ruta}: {e}")
+            log.error("Historial: error al leer %s: %s", ruta, e)
         return []
 
-    def _guardar_historial(self) -> None:
+    def _guardar_historial(self, historial: list | None = None) -> bool:
         ruta = self._get_historial_path()
+        if historial is None:
+            historial = self.historial_programaciones
         try:
             # asegurar directorio (por si sys.argv[0] apunta a otro lugar)
             os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
             with open(ruta, "w", encoding="utf-8") as f:
-                json.dump(self.historial_programaciones, f, ensure_ascii=False, indent=2)
+                json.dump(historial, f, ensure_ascii=False, indent=2)
+            return True
         except Exception as e:
-            print(f"Historial: error al guardar {ruta}: {e}")
+            log.error("Historial: error al guardar %s: %s", ruta, e)
+            return False
 
     def _agregar_historial(self, evento: str, prog: dict | None = None, extra: dict | None = None) -> None:
         try:
@@ -104,13 +96,20 @@ class ControlRespirometro(ft.Container):
             if extra:
                 item["extra"] = extra
 
+            if self.historial_programaciones is None:
+                # todavía no terminó la lectura en segundo plano: leer ya para no pisar el archivo
+                self.historial_programaciones = self._cargar_historial()
             self.historial_programaciones.insert(0, item)  # newest first
             # limitar tamaño
             if len(self.historial_programaciones) > 300:
                 self.historial_programaciones = self.historial_programaciones[:300]
-            self._guardar_historial()
+            self._en_segundo_plano(
+                self._guardar_historial,
+                list(self.historial_programaciones),
+                error_msg="No se pudo guardar el historial",
+            )
         except Exception as e:
-            print(f"Historial: no se pudo agregar item: {e}")
+            log.error("Historial: no se pudo agregar item: %s", e)
 
 
     def _aplicar_updates_a_ini(self, contenido: str, updates: dict) -> str:
@@ -172,10 +171,64 @@ class ControlRespirometro(ft.Container):
         self.page.snack_bar.open = True
         self.page.update()
 
+    # -------------------------
+    # I/O en segundo plano (disco lento / carpeta de red no debe colgar la UI)
+    def _en_segundo_plano(self, fn, *args, ok_msg=None, error_msg="Error al guardar", on_done=None):
+        """
+        Ejecuta fn(*args) en el pool de I/O compartido y vuelve enseguida.
+        El resultado se procesa en el UI loop (_procesar_resultados_io):
+          - excepción o retorno False -> snack con error_msg
+          - éxito -> snack con ok_msg (si hay) y on_done(resultado)
+        """
+        def _terminado(fut):
+            try:
+                res, err = fut.result(), None
+            except Exception as ex:
+                res, err = None, ex
+            self._io_resultados.put((res, err, ok_msg, error_msg, on_done))
+
+        fut = self._io_pool.submit(fn, *args)
+        fut.add_done_callback(_terminado)
+        return fut
+
+    def _procesar_resultados_io(self):
+        while True:
+            try:
+                res, err, ok_msg, error_msg, on_done = self._io_resultados.get_nowait()
+            except queue.Empty:
+                break
+
+            if err is not None or res is False:
+                detalle = f": {err}" if err is not None else ""
+                self._snack(f"{error_msg}{detalle}")
+                continue
+
+            if on_done:
+                try:
+                    on_done(res)
+                except Exception as ex:
+                    log.exception("Error en callback de I/O: %s", ex)
+            if ok_msg:
+                self._snack(ok_msg)
+
+    def _guardar_programaciones_async(self, ok_msg=None):
+        """Guarda una copia de las programaciones actuales sin bloquear la UI."""
+        if not self._programaciones_cargadas:
+            # la copia tendría solo lo agregado mientras carga y pisaría el archivo:
+            # se guarda en _al_cargar_programaciones, ya mezclada con lo del disco
+            self._guardado_pendiente = True
+            return None
+        return self._en_segundo_plano(
+            self.gestor_programaciones.guardar_programaciones,
+            self.gestor_programaciones.instantanea(),
+            ok_msg=ok_msg,
+            error_msg="Error al guardar programaciones",
+        )
+
     def build_config_view(self):
         """Vista de configuración: formulario + editor de texto."""
         contenido = self._leer_setting_ini()
-        kv = self._parse_ini_kv(contenido)
+        kv = ST.ServicioConfiguracion.parsear(contenido)
 
         # Campos (formulario)
         self.cfg_wifi_ssid = ft.TextField(label="WIFI_SSID", value=kv.get("WIFI_SSID", ""), width=420, color="black")
@@ -218,20 +271,29 @@ class ControlRespirometro(ft.Container):
                     "TOPICO_ESTADO": (self.cfg_topic_estado.value or "").strip(),
                 }
 
-                actual = self._leer_setting_ini()
-                nuevo = self._aplicar_updates_a_ini(actual, updates)
-                self._escribir_setting_ini(nuevo)
-                self.cfg_raw_editor.value = nuevo
-                self._snack("Configuración guardada. Reiniciá la app para aplicar cambios.")
+                def leer_y_escribir():
+                    actual = self._leer_setting_ini()
+                    nuevo = self._aplicar_updates_a_ini(actual, updates)
+                    self._escribir_setting_ini(nuevo)
+                    return nuevo
+
+                def al_guardar(nuevo):
+                    self.cfg_raw_editor.value = nuevo
+
+                self._en_segundo_plano(
+                    leer_y_escribir,
+                    ok_msg="Configuración guardada y aplicada.",
+                    on_done=al_guardar,
+                )
             except Exception as ex:
                 self._snack(f"Error al guardar: {ex}")
 
         def guardar_raw(ev):
-            try:
-                self._escribir_setting_ini(self.cfg_raw_editor.value or "")
-                self._snack("Setting.ini guardado. Reiniciá la app para aplicar cambios.")
-            except Exception as ex:
-                self._snack(f"Error al guardar: {ex}")
+            self._en_segundo_plano(
+                self._escribir_setting_ini,
+                self.cfg_raw_editor.value or "",
+                ok_msg="Setting.ini guardado y aplicado (tópicos MQTT: al reiniciar).",
+            )
 
         header = ft.Container(
             padding=10,
@@ -339,60 +401,275 @@ class ControlRespirometro(ft.Container):
                 tabs,
             ],
         )
-    def _actualizar_ui_rele(self, rele_key: str, encendido: bool):
-        # actualizar modelo
-        rele = next((r for r in self.reles if r["key"] == rele_key), None)
-        if rele:
-            rele["estado"] = encendido
+    def _on_rele_cambio(self, rele: ER.EstadoRele):
+        self._instantanea_sucia = True
 
         # actualizar widgets (si ya existen)
-        w = self._rele_widgets.get(rele_key)
+        encendido = rele.reportado
+        w = self._rele_widgets.get(rele.key)
         if w:
             w["indicador"].bgcolor = self.green_color if encendido else self.red_color
-            w["txt_estado"].value = "ON" if encendido else "OFF"
+            w["txt_estado"].value = self._texto_estado_rele(encendido)
             w["btn"].text = "Apagar" if encendido else "Encender"
             w["btn"].icon = ft.Icons.POWER_OFF if encendido else ft.Icons.POWER
 
     async def _ui_loop(self):
+        loop = asyncio.get_running_loop()
+        self._evento_ui = asyncio.Event()
+        proximo_tick = 0.0
         while True:
-            # 1) procesar cola MQTT en UI thread
-            self._procesar_mqtt_queue()
-
-            # 2) actualizar lógica/UI (ya estás en UI thread)
-            if self.vista_actual == "main":
-                self.evaluar_programaciones()      # ahora seguro
-                self.actualizar_estado_mqtt()      # ahora seguro
-
+            self._evento_ui.clear()
+            if loop.time() >= proximo_tick:
+                # 1) procesar estado MQTT y resultados de I/O en UI thread
+                self._procesar_estado_mqtt()
+                self._procesar_resultados_io()
+                self.mqtt.revisar_acks()
+
+                # 2) actualizar lógica/UI (ya estás en UI thread)
+                if self.vista_actual in ("main", "flota"):
+                    self.evaluar_programaciones()      # ahora seguro
+                    self.actualizar_estado_mqtt()      # ahora seguro
+                if self.vista_actual == "flota":
+                    self._actualizar_tarjetas_flota()
+
+                self._guardar_instantanea_si_cambio()
+                proximo_tick = loop.time() + 0.5
+            else:
+                # despertado por un estado MQTT: pintar solo eso, ya
+                self._procesar_estado_mqtt()
+                if self.vista_actual == "main":
+                    self.actualizar_estado_mqtt()
+                elif self.vista_actual == "flota":
+                    self._actualizar_tarjetas_flota()
             self.page.update()
-            await asyncio.sleep(0.5)  # 0.5s o 1s
 
-    def _procesar_mqtt_queue(self):
-        updated = False
-        while True:
             try:
-                data = self._mqtt_queue.get_nowait()
-            except queue.Empty:
-                break
+                await asyncio.wait_for(self._evento_ui.wait(), max(0.0, proximo_tick - loop.time()))
+            except asyncio.TimeoutError:
+                pass
 
-            # marca “último visto”
+    def _despertar_ui(self):
+        """Lo llama el callback de MQTT (desde cualquier hilo) para no esperar al próximo tick."""
+        if self._evento_ui is not None:
+            self.page.loop.call_soon_threadsafe(self._evento_ui.set)
+
+    def _procesar_estado_mqtt(self):
+        if self.flota is not None:
+            return self._procesar_estado_flota()
+
+        # Una sola foto fusionada por tick (último valor de cada relé)
+        data = self._buzon_estado.tomar()
+        if data is None:
+            return False
+
+        # marca “último visto”
+        self._last_seen_estado = datetime.now()
+
+        # online/offline si viene
+        if "online" in data:
+            online = (data["online"] == "on")
+            self.indicador_placa.bgcolor = self.green_color if online else self.red_color
+            self.texto_placa.value = "PLACA: ONLINE" if online else "PLACA: OFFLINE"
+            self.texto_placa.color = self.green_color if online else self.red_color
+
+        # estados l1..l8 (el modelo avisa a _on_rele_cambio)
+        self.estado_reles.aplicar_estado(data)
+
+        return True
+
+    def _procesar_estado_flota(self):
+        # Solo las placas que mandaron algo desde el último tick
+        cambiados = self.flota.aplicar_pendientes()
+        if not cambiados:
+            return False
+
+        for id_disp in cambiados:
+            if self.flota.obtener(id_disp).actualizaciones == 1:
+                # placa recién descubierta: pedirle el estado completo
+                self._pedir_estado_placa(id_disp)
+
+        if self.dispositivo_actual is None:
+            # TOPICO_ESTADO no dio un id: la primera placa que reporta pasa a ser la principal
+            primera = sorted(cambiados)[0]
+            log.info("Placa principal: %s (primera en reportar)", primera)
+            self._id_dispositivo_defecto = primera
+            self._cambiar_dispositivo(primera)
+            if self.vista_actual == "main":
+                self.build_main_view()
+
+        if self.dispositivo_actual in cambiados:
             self._last_seen_estado = datetime.now()
+        return True
+
+    # -------------------------
+    # Modo flota
+    def _dispositivo_de(self, prog: dict):
+        """Placa a la que apunta una programación (None en modo placa única)."""
+        if self.flota is None:
+            return None
+        return prog.get("dispositivo") or self._id_dispositivo_defecto
+
+    def _reles_de(self, id_disp) -> ER.AlmacenReles:
+        if self.flota is None or id_disp is None:
+            # sin placa elegida todavía: no crear un dispositivo fantasma con id None
+            return self.estado_reles
+        return self.flota.obtener(id_disp).reles
+
+    def mostrar_vista_flota(self, e=None):
+        self.vista_actual = "flota"
+        self.build_flota_view()
+        self.page.update()
+
+    def _cambiar_dispositivo(self, id_disp):
+        self.estado_reles.desuscribir(self._on_rele_cambio)
+        self.dispositivo_actual = id_disp
+        disp = self.flota.obtener(id_disp)
+        self.estado_reles = disp.reles
+        self.estado_reles.suscribir(self._on_rele_cambio)
+        if disp.ts_visto is None:
+            self._last_seen_estado = None
+        else:
+            self._last_seen_estado = datetime.now() - timedelta(seconds=pytime.monotonic() - disp.ts_visto)
+
+    def seleccionar_dispositivo(self, id_disp):
+        """La vista principal pasa a mostrar/controlar esta placa."""
+        if id_disp != self.dispositivo_actual:
+            self._cambiar_dispositivo(id_disp)
+        self.vista_actual = "main"
+        self.build_main_view()
+        self.page.update()
+
+    def _crear_tarjeta_dispositivo(self, disp: Flota.Dispositivo):
+        punto = ft.Container(width=12, height=12, border_radius=6, bgcolor=self.red_color)
+        txt_visto = ft.Text("", size=11, color=self.grey_color)
+        txt_tele = ft.Text("", size=10, color=self.grey_color)
+        puntos_reles = [
+            ft.Container(width=14, height=14, border_radius=3, bgcolor=self.grey_color, tooltip=r.nombre)
+            for r in disp.reles
+        ]
+        self._flota_widgets[disp.id] = {"punto": punto, "txt_visto": txt_visto, "reles": puntos_reles, "txt_tele": txt_tele, "firma": None}
+
+        return ft.Container(
+            bgcolor="white",
+            border_radius=12,
+            padding=12,
+            border=ft.border.all(2, self.blue_color if disp.id == self.dispositivo_actual else self.dark_white),
+            on_click=lambda e, i=disp.id: self.seleccionar_dispositivo(i),
+            content=ft.Column(
+                spacing=6,
+                controls=[
+                    ft.Row(spacing=8, controls=[punto, ft.Text(disp.id, size=14, weight="bold", color="black")]),
+                    txt_visto,
+                    ft.Row(spacing=4, wrap=True, controls=puntos_reles),
+                    txt_tele,
+                ],
+            ),
+        )
 
-            # online/offline si viene
-            if "online" in data:
-                online = (data["online"] == "on")
-                self.indicador_placa.bgcolor = self.green_color if online else self.red_color
-                self.texto_placa.value = "PLACA: ONLINE" if online else "PLACA: OFFLINE"
-                self.texto_placa.color = self.green_color if online else self.red_color
+    def _actualizar_tarjetas_flota(self):
+        ids = self.flota.ids()
+        if set(ids) != set(self._flota_widgets.keys()):
+            # aparecieron placas nuevas: rearmar la grilla
+            self._flota_widgets = {}
+            self._flota_grid.controls = [self._crear_tarjeta_dispositivo(self.flota.obtener(i)) for i in ids]
+            self._flota_titulo.value = f"Flota ({len(ids)} placas)"
+
+        ahora = pytime.monotonic()
+        for id_disp in ids:
+            disp = self.flota.obtener(id_disp)
+            w = self._flota_widgets[id_disp]
+            online = disp.online(self._offline_timeout_s, ahora)
+            tele = self.telemetria.obtener(id_disp)
+            firma = (online, disp.ts_visto, disp.reles.obsoleto, tele and tele[0])
+            if firma == w["firma"]:
+                continue  # nada nuevo para esta placa
+            w["firma"] = firma
+            w["txt_tele"].value = self.telemetria.texto(id_disp)
+
+            w["punto"].bgcolor = self.green_color if online else self.red_color
+            if disp.ts_visto is None:
+                w["txt_visto"].value = "sin datos"
+            else:
+                visto = datetime.now() - timedelta(seconds=ahora - disp.ts_visto)
+                w["txt_visto"].value = f"visto {visto.strftime('%H:%M:%S')}"
+            for punto_rele, rele in zip(w["reles"], disp.reles):
+                if disp.reles.obsoleto:
+                    punto_rele.bgcolor = self.grey_color
+                else:
+                    punto_rele.bgcolor = self.green_color if rele.reportado else self.red_color
 
-            # estados l1..l8
-            for i in range(1, 9):
-                k = f"l{i}"
-                if k in data:
-                    self._actualizar_ui_rele(k, data[k] == "on")
+    def build_flota_view(self):
+        """Vista de flota: una tarjeta por placa descubierta."""
+        self._flota_widgets = {}
+        self._flota_titulo = ft.Text(f"Flota ({len(self.flota)} placas)", size=26, weight=ft.FontWeight.BOLD, color="black")
+        self._flota_grid = ft.GridView(
+            expand=True,
+            max_extent=220,
+            child_aspect_ratio=1.3,
+            spacing=10,
+            run_spacing=10,
+            controls=[],
+        )
+        self._actualizar_tarjetas_flota()
+
+        self.content = ft.Container(
+            expand=True,
+            padding=20,
+            bgcolor=self.bg_color,
+            content=ft.Column(
+                expand=True,
+                spacing=10,
+                controls=[
+                    ft.Row(
+                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
+                        vertical_alignment=ft.CrossAxisAlignment.CENTER,
+                        controls=[
+                            ft.IconButton(icon=ft.Icons.ARROW_BACK, on_click=self.volver_a_main),
+                            self._flota_titulo,
+                            ft.Text(f"Tópico: {self.mqtt.topico_estado_flota}", size=11, color=self.grey_color),
+                        ],
+                    ),
+                    ft.Divider(),
+                    self._flota_grid,
+                ],
+            ),
+        )
 
-            updated = True
+    # -------------------------
+    # Comandos pendientes de enviar (sobreviven a un reinicio sin broker)
+    def _get_cola_salida_path(self) -> str:
+        import os, sys
+        return os.path.join(os.path.dirname(sys.argv[0]), "ColaSalidaMQTT.json")
 
-        return updated
+    # Instantánea del último estado conocido (arranque instantáneo)
+    def _get_instantanea_path(self) -> str:
+        import os, sys
+        nombre = "EstadoPlaca.json"
+        if self.flota is not None:
+            nombre = f"EstadoPlaca_{self.dispositivo_actual}.json"
+        return os.path.join(os.path.dirname(sys.argv[0]), nombre)
+
+    def _texto_estado_rele(self, encendido: bool) -> str:
+        texto = "ON" if encendido else "OFF"
+        if self.estado_reles.obsoleto:
+            texto += " (último conocido)"
+        return texto
+
+    def _guardar_instantanea_si_cambio(self):
+        # Solo guardar estado confirmado por la placa, y como mucho cada 5 s
+        if not self._instantanea_sucia or self.estado_reles.obsoleto:
+            return
+        ahora = pytime.monotonic()
+        if ahora - self._instantanea_ts_guardado < 5.0:
+            return
+        self._instantanea_sucia = False
+        self._instantanea_ts_guardado = ahora
+        self._en_segundo_plano(
+            ER.guardar_instantanea,
+            self._get_instantanea_path(),
+            self.estado_reles.instantanea(),
+            error_msg="No se pudo guardar el último estado de la placa",
+        )
 
     def _aplicar_programaciones_a_reles(self, programaciones_activas):
         def parse_inicio(p):
@@ -403,10 +680,12 @@ class ControlRespirometro(ft.Container):
 
         activas_ordenadas = sorted(programaciones_activas, key=parse_inicio)
 
+        # (placa, relé) -> acción; en modo placa única la placa es None
         desired = {}
         for prog in activas_ordenadas:
+            disp = self._dispositivo_de(prog)
             for k in prog.get("targets", []):
-                desired[k] = prog.get("accion", "on")
+                desired[(disp, k)] = prog.get("accion", "on")
 
         ids_actuales = {p.get("id") for p in programaciones_activas if p.get("id")}
         terminadas = self._active_prog_ids_prev - ids_actuales
@@ -425,54 +704,117 @@ class ControlRespirometro(ft.Container):
                 extra={"fin_accion_aplicada": fin_acc}
             )
 
+            disp = self._dispositivo_de(prog)
             for k in prog.get("targets", []):
-                if k not in desired:
-                    desired[k] = fin_acc
-
-        for k, acc in desired.items():
-            encender = (acc == "on")
-            rele = next((r for r in self.reles if r["key"] == k), None)
-            estado_actual = bool(rele["estado"]) if rele else None
-            if estado_actual is None:
+                if (disp, k) not in desired:
+                    desired[(disp, k)] = fin_acc
+
+        en_espera = pytime.monotonic() - self._t_arranque < self._espera_estado_fresco_s
+        for (disp, k), acc in desired.items():
+            reles = self._reles_de(disp)
+            # Con estado viejo (instantánea o nada) no mandar comandos todavía:
+            # esperar el primer estado real, o _espera_estado_fresco_s como máximo
+            if reles.obsoleto and en_espera:
                 continue
-            if estado_actual != encender:
-                self.enviar_mqtt_rele(k, encender)
+            encender = (acc == "on")
+            # no reenviar si ya hay un comando igual esperando confirmación
+            if reles.requiere_comando(k, encender):
+                self.enviar_mqtt_rele(k, encender, dispositivo=disp)
 
         # ✅ actualizar “prev”
         self._active_prog_ids_prev = ids_actuales
         self._active_prog_prev = {p["id"]: p for p in programaciones_activas if p.get("id")}
 
 
-    def _on_mqtt_estado(self, topic, payload: bytes):
-        try:
-            data = json.loads(payload.decode("utf-8", errors="ignore"))
-            # Encolar para procesar en UI thread
-            self._mqtt_queue.put(data)
-        except Exception as e:
-            print("Error decodificando topico_estado:", e)
-            
-    def enviar_mqtt_rele(self, rele_key: str, encender: bool):
-        """Envía: {"l2":"off"} / {"l2":"on"} al tópico cmd."""
-        if getattr(self.mqtt, 'conectado', False):
-            try:
-                payload = json.dumps({rele_key: "on" if encender else "off"})
-                self.mqtt.publicar(self.mqtt.topico_cmd, payload)
-                print(f"Comando {rele_key} -> {'on' if encender else 'off'} enviado: {payload}")
-            except Exception as ex:
-                print(f"Error enviando {rele_key}: {ex}")
+    def _on_mqtt_estado(self, topic, data: dict):
+        # data ya viene decodificado (JSON o binario) y con el ack procesado
+        # Fusionar (último gana) para procesar en UI thread
+        if self.flota is not None:
+            self.flota.poner(self.mqtt.id_dispositivo(topic), data)
         else:
-            print("MQTT no conectado")
+            self._buzon_estado.poner(data)
+        self._despertar_ui()
+            
+    # -------------------------
+    # Latencia de comandos (publicación -> ack de la placa)
+    def _get_latencias_path(self) -> str:
+        import os, sys
+        return os.path.join(os.path.dirname(sys.argv[0]), "LatenciaComandos.csv")
+
+    def _texto_latencias(self) -> str:
+        acks = self.mqtt.acks
+        r = acks.latencias.resumen()
+        lineas = [
+            f"Confirmados: {acks.confirmados}   Reintentos: {acks.reintentos}   "
+            f"Sin confirmar: {acks.sin_ack}   Esperando: {len(acks)}",
+        ]
+        if not r["n"]:
+            lineas.append("Todavía no hay comandos confirmados.")
+            return "\n".join(lineas)
+        lineas.append(
+            f"min {r['min_ms']} ms · media {r['media_ms']} ms · max {r['max_ms']} ms"
+        )
+        lineas.append(
+            f"p50 {r['p50_ms']} ms · p90 {r['p90_ms']} ms · p99 {r['p99_ms']} ms · p99.9 {r['p999_ms']} ms"
+        )
+        lineas.append("")
+        for hasta, cuenta, pct in acks.latencias.filas()[-12:]:
+            lineas.append(f"≤ {hasta:9.1f} ms  {cuenta:6d}  ({pct:5.1f}%)")
+        return "\n".join(lineas)
+
+    def mostrar_latencias(self, e=None):
+        texto = ft.Text(self._texto_latencias(), font_family="monospace", size=12, color="black")
+
+        def reiniciar(ev):
+            self.mqtt.acks.latencias.reiniciar()
+            texto.value = self._texto_latencias()
+            self.page.update()
+
+        def exportar(ev):
+            ruta = self._get_latencias_path()
+            self._en_segundo_plano(
+                self.mqtt.acks.latencias.exportar, ruta,
+                ok_msg=f"Latencias exportadas a {ruta}",
+                error_msg="No se pudieron exportar las latencias",
+            )
+
+        dlg = ft.AlertDialog(
+            title=ft.Text("Latencia de comandos (publicación → ack)"),
+            content=ft.Container(width=520, content=texto),
+            actions=[
+                ft.TextButton("Reiniciar", on_click=reiniciar),
+                ft.TextButton("Exportar", on_click=exportar),
+                ft.TextButton("Cerrar", on_click=lambda ev: self.page.close(dlg)),
+            ],
+        )
+        self.page.open(dlg)
+
+    def enviar_mqtt_rele(self, rele_key: str, encender: bool, dispositivo=None):
+        """
+        Envía: {"l2":"off"} / {"l2":"on"} al tópico cmd.
+        dispositivo: placa destino en modo flota (None = la seleccionada).
+        """
+        if dispositivo is None:
+            dispositivo = self.dispositivo_actual
+        try:
+            payload = {rele_key: "on" if encender else "off"}
+            # Sin conexión queda en la cola de salida y se reenvía al reconectar
+            resultado = self.mqtt.publicar_comando(self.mqtt.topico_cmd_dispositivo(dispositivo), payload)
+            self._reles_de(dispositivo).comandar(rele_key, encender)
+            log.debug("Comando %s -> %s %s", rele_key, payload[rele_key], resultado)
+        except Exception as ex:
+            log.error("Error enviando %s: %s", rele_key, ex)
     
 
     def _toggle_rele_handler(self, rele_key: str):
         def handler(e):
             # Tomar estado actual del modelo (lo actualiza topico_estado)
-            rele = next((r for r in self.reles if r["key"] == rele_key), None)
+            rele = self.estado_reles.get(rele_key)
             if not rele:
                 return
 
             # Queremos el opuesto, pero NO tocamos la UI acá
-            nuevo = not bool(rele["estado"])
+            nuevo = not rele.reportado
 
             # Mandar comando (la UI se actualizará cuando llegue topico_estado)
             self.enviar_mqtt_rele(rele_key, nuevo)
@@ -485,16 +827,16 @@ class ControlRespirometro(ft.Container):
         self._rele_widgets = {}
         items = []
 
-        for rele in self.reles:
-            key = rele["key"]
-            encendido = bool(rele["estado"])
+        for rele in self.estado_reles:
+            key = rele.key
+            encendido = rele.reportado
 
             indicador = ft.Container(
                 width=10, height=10, border_radius=5,
                 bgcolor=self.green_color if encendido else self.red_color
             )
-            txt_nombre = ft.Text(rele["nombre"], size=12, weight="bold", color="black")
-            txt_estado = ft.Text("ON" if encendido else "OFF", size=11, color=self.grey_color)
+            txt_nombre = ft.Text(rele.nombre, size=12, weight="bold", color="black")
+            txt_estado = ft.Text(self._texto_estado_rele(encendido), size=11, color=self.grey_color)
 
             btn = ft.FilledButton(
                 text="Apagar" if encendido else "Encender",
@@ -533,8 +875,13 @@ class ControlRespirometro(ft.Container):
     def __init__(self, page: ft.Page):
         super().__init__(expand=True)
         self.page = page
-        self._mqtt_queue = queue.Queue()
+        self._buzon_estado = ER.BuzonEstado()
+        self._evento_ui = None  # asyncio.Event de _ui_loop (ver _despertar_ui)
         self._last_online_ts = 0.0
+        # Pool de I/O compartido: un solo worker para que las escrituras
+        # al mismo archivo no se reordenen
+        self._io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="io")
+        self._io_resultados = queue.Queue()
         self.page.title = "Control Respirómetro CADIC"
         self.bg_color = "#ffffff"
         self.dark_white = "#e7e6e9"
@@ -554,6 +901,35 @@ class ControlRespirometro(ft.Container):
         self._active_prog_prev = {}
         self._last_seen_estado = None
         self._offline_timeout_s = 320  # si no veo estado en tanto tiempo, marcar offline  
+        self._t_arranque = pytime.monotonic()
+        self._espera_estado_fresco_s = 15  # máx. espera de estado real antes de aplicar programaciones
+        self._instantanea_sucia = False
+        self._instantanea_ts_guardado = 0.0
+        self.perfil = PERFIL_ARRANQUE
+
+        # MQTT + gestor de programaciones (leen Setting.ini; no tocan red ni disco de datos)
+        self.mqtt = mqtt.ServidorMQTT(ruta_cola=self._get_cola_salida_path())
+        self.gestor_programaciones = PR.Programaciones(cargar=False)
+        self._programaciones_cargadas = False
+        self._guardado_pendiente = False
+        self._pausa_renovada = 0.0
+
+        # Modo flota: placas descubiertas por el tópico con comodín (ver Flota.py)
+        self.flota = Flota.Flota() if self.mqtt.modo_flota else None
+        self._id_dispositivo_defecto = self.mqtt.id_dispositivo(self.mqtt.topico_estado) if self.flota else None
+        if self.flota is not None and self._id_dispositivo_defecto is None:
+            # sin id no hay placa real: se adopta la primera que reporte (_procesar_estado_flota)
+            log.warning(
+                "TOPICO_ESTADO (%s) no coincide con TOPICO_ESTADO_FLOTA (%s): se usará la primera placa que aparezca",
+                self.mqtt.topico_estado, self.mqtt.topico_estado_flota,
+            )
+        self.dispositivo_actual = self._id_dispositivo_defecto
+        self._flota_widgets = {}
+        # Agenda local en la placa (ver AgendaPlaca.py): sigue aunque se corte la red
+        self.agenda = AP.SincronizadorAgenda(self.mqtt)
+        # Telemetría de firmware por placa (loop, memoria, reconexiones, RSSI)
+        self.telemetria = TP.TelemetriaPlacas(self.mqtt)
+        self.perfil.marcar("config")
 
         self.card_detalle_prog = ft.Container(
             visible=False,
@@ -572,12 +948,16 @@ class ControlRespirometro(ft.Container):
             ),
         )
         
-        # Relés (modelo simple)
-        # Cambiá nombres/cantidad según tu placa
-        self.reles = [
-            {"key": f"l{i}", "nombre": f"Relé {i}", "estado": False}
-            for i in range(1, 9)
-        ]
+        # Relés: estado reportado/deseado/pendiente (ver EstadoReles.AlmacenReles)
+        # Cambiá la cantidad según tu placa
+        if self.flota is not None and self.dispositivo_actual is not None:
+            self.estado_reles = self.flota.obtener(self.dispositivo_actual).reles
+        else:
+            self.estado_reles = ER.AlmacenReles(8)
+        # Pintar ya con el último estado conocido (queda "obsoleto" hasta que hable la placa)
+        self.estado_reles.cargar_instantanea(ER.leer_instantanea(self._get_instantanea_path()))
+        self.estado_reles.suscribir(self._on_rele_cambio)
+        self.perfil.marcar("almacenamiento")
         # Widgets por relé (para poder actualizar UI rápido)
         self._rele_widgets = {}  
         # Estado de la placa
@@ -586,15 +966,130 @@ class ControlRespirometro(ft.Container):
         self.programacion_activa_actual = None
         self.tiempo_pausado_inicio = None
         
+        # Controles de la vista "add": se crean al navegar por primera vez
+        self._controles_agregar_listos = False
+
+        # --- NUEVO: para detectar programas que terminan/inician ---
+        self._active_prog_ids_prev = set()
+
+        # Historial persistente de programaciones (creadas/finalizadas/canceladas)
+        # Se lee en segundo plano después del primer frame
+        self.historial_programaciones = None
+
+        
+        # Vista actual (main o add)
+        self.vista_actual = "main"
+        
+        # Indicador de estado
+        self.indicador_estado = ft.Container(
+            width=20, height=20, border_radius=10,
+            bgcolor=self.red_color
+        )
+        
+        self.texto_estado = ft.Text("APAGADO", size=16, weight="bold", color=self.red_color)
+        
+        # Estado ONLINE/OFFLINE de la placa (viene por MQTT topico_estado: {"online":"on/off"})
+        self.indicador_placa = ft.Container(
+            width=14, height=14, border_radius=7,
+            bgcolor=self.red_color
+        )
+        self.texto_placa = ft.Text("PLACA: OFFLINE", size=12, weight="bold", color=self.red_color)
+
+        # Textos para programación activa
+        self.texto_prog_activa = ft.Text("Ninguna programación activa", size=14, color=self.grey_color, text_align=ft.TextAlign.CENTER)
+        self.texto_tiempo_restante = ft.Text("", size=12, color=self.blue_color, weight="bold", text_align=ft.TextAlign.CENTER)
+        self.texto_proxima_prog = ft.Text("", size=12, color=self.grey_color, text_align=ft.TextAlign.CENTER)
+        
+        # Indicador de conexión MQTT
+        self.indicador_mqtt = ft.Container(
+            width=16, height=16, border_radius=8,
+            bgcolor=self.red_color, margin=ft.margin.only(right=6)
+        )
+        self.texto_mqtt = ft.Text("MQTT: Desconectado", size=12, color=self.red_color)
+        self.texto_telemetria = ft.Text("", size=11, color=self.grey_color, text_align=ft.TextAlign.CENTER)
+
+        # Crear la interfaz
+        self.build_main_view()
+        self.perfil.marcar("primer_frame")
+
+        # Suscribirse al estado de la placa (paho re-suscribe al conectar)
+        if self.flota is not None:
+            self.mqtt.suscribir_estado(self.mqtt.topico_estado_flota, self._on_mqtt_estado)
+            self.agenda.suscribir(self.mqtt.topico_estado_flota)
+            self.telemetria.suscribir(self.mqtt.topico_estado_flota)
+        else:
+            self.mqtt.suscribir_estado(self.mqtt.topico_estado, self._on_mqtt_estado)
+            self.agenda.suscribir(self.mqtt.topico_estado)
+            self.telemetria.suscribir(self.mqtt.topico_estado)
+        # Pedir estado inicial en cada conexión (si tu ESP32 soporta {"get":"status"})
+        self.mqtt.al_conectar(self._pedir_estado_placa)
+        # Setting.ini editado a mano (o desde la vista): aplicar sin reiniciar
+        ST.servicio().iniciar_vigilancia()
+        # Conexión sin bloquear la ventana (DNS/TCP en el hilo de paho)
+        # con MQTT_MODO=asyncio el cliente corre en el mismo loop que la UI
+        self.mqtt.conectar_async(loop=self.page.loop)
+
+        # Datos en disco: en segundo plano, la UI se actualiza al terminar
+        self._en_segundo_plano(
+            self.gestor_programaciones.leer_programaciones,
+            error_msg="Error al cargar programaciones",
+            on_done=self._al_cargar_programaciones,
+        )
+        self._en_segundo_plano(self._cargar_historial, on_done=self._al_cargar_historial)
+        self._guardar_pausa()  # arranca sin pausa (borra la marca si quedó de una sesión anterior)
+        # al cerrar la app la pausa no debe quedar en disco para el demonio
+        atexit.register(self.gestor_programaciones.guardar_pausa, False)
+
+        # Iniciar timer para actualizar programaciones y estado MQTT cada segundo
+        self.page.run_task(self._ui_loop)
+
+    def _pedir_estado_placa(self, id_disp=None):
+        if id_disp is None:
+            id_disp = self.dispositivo_actual
+        self.mqtt.publicar(self.mqtt.topico_cmd_dispositivo(id_disp), json.dumps({"get": "status"}))
+
+    def _guardar_pausa(self):
+        """Deja la pausa en disco para que el demonio no reenvíe la agenda a la placa."""
+        self._pausa_renovada = pytime.monotonic()
+        self._en_segundo_plano(
+            self.gestor_programaciones.guardar_pausa,
+            self.placa_pausada,
+            error_msg="Error al guardar la pausa",
+        )
+
+    def _al_cargar_programaciones(self, programaciones):
+        # lo que se haya agregado mientras cargaba queda al final
+        self.gestor_programaciones.programaciones = (programaciones or []) + self.gestor_programaciones.programaciones
+        self._programaciones_cargadas = True
+        if self._guardado_pendiente:
+            self._guardado_pendiente = False
+            self._guardar_programaciones_async()
+        if self.vista_actual == "main":
+            self.build_main_view()
+
+        self.perfil.marcar("programaciones")
+        log.info("%s", self.perfil.reporte())
+        self._en_segundo_plano(self.perfil.guardar, error_msg="No se pudo guardar el perfil de arranque")
+
+    def _al_cargar_historial(self, historial):
+        # si _agregar_historial ya lo leyó (o se recargó), no pisar
+        if self.historial_programaciones is None:
+            self.historial_programaciones = historial or []
+
+    def _crear_controles_agregar(self):
+        """Controles del formulario "add" (se crean una sola vez, al navegar)."""
+        if self._controles_agregar_listos:
+            return
+
         # --- NUEVO: selección de relés + acción para programación ---
         self.chk_reles = {
-            r["key"]: ft.Checkbox(
-                label=r["nombre"],
+            r.key: ft.Checkbox(
+                label=r.nombre,
                 value=False,
                 width=95,
                 label_style=ft.TextStyle(size=12, color="black"),
             )
-            for r in self.reles
+            for r in self.estado_reles
         }
 
         self.accion_prog = ft.Dropdown(
@@ -621,19 +1116,6 @@ class ControlRespirometro(ft.Container):
             ],
         )
 
-        # --- NUEVO: para detectar programas que terminan/inician ---
-        self._active_prog_ids_prev = set()
-
-        # Gestor de programaciones
-        self.gestor_programaciones = PR.Programaciones()
-
-        # Historial persistente de programaciones (creadas/finalizadas/canceladas)
-        self.historial_programaciones = self._cargar_historial()
-
-        
-        # Vista actual (main o add)
-        self.vista_actual = "main"
-        
         # Campos de entrada para programación por tiempo
         self.tiempo_horas = ft.TextField(label="Horas", value="0", width=80, text_align=ft.TextAlign.CENTER, color="black")
         self.tiempo_minutos = ft.TextField(label="Minutos", value="0", width=80, text_align=ft.TextAlign.CENTER, color="black")
@@ -644,49 +1126,8 @@ class ControlRespirometro(ft.Container):
         self.hora_inicio = ft.TextField(label="Hora", value=datetime.now().strftime("%H:%M"), width=100, color="black")
         self.fecha_fin = ft.TextField(label="Fecha Fin", value=datetime.now().strftime("%Y-%m-%d"), width=150, read_only=True, color="black")
         self.hora_fin = ft.TextField(label="Hora", value=datetime.now().strftime("%H:%M"), width=100, color="black")
-        
-        # Indicador de estado
-        self.indicador_estado = ft.Container(
-            width=20, height=20, border_radius=10,
-            bgcolor=self.red_color
-        )
-        
-        self.texto_estado = ft.Text("APAGADO", size=16, weight="bold", color=self.red_color)
-        
-        # Estado ONLINE/OFFLINE de la placa (viene por MQTT topico_estado: {"online":"on/off"})
-        self.indicador_placa = ft.Container(
-            width=14, height=14, border_radius=7,
-            bgcolor=self.red_color
-        )
-        self.texto_placa = ft.Text("PLACA: OFFLINE", size=12, weight="bold", color=self.red_color)
 
-        # Textos para programación activa
-        self.texto_prog_activa = ft.Text("Ninguna programación activa", size=14, color=self.grey_color, text_align=ft.TextAlign.CENTER)
-        self.texto_tiempo_restante = ft.Text("", size=12, color=self.blue_color, weight="bold", text_align=ft.TextAlign.CENTER)
-        self.texto_proxima_prog = ft.Text("", size=12, color=self.grey_color, text_align=ft.TextAlign.CENTER)
-        
-        # MQTT
-        self.mqtt = mqtt.ServidorMQTT()
-        self.mqtt.conectar()
-
-        # Indicador de conexión MQTT
-        self.indicador_mqtt = ft.Container(
-            width=16, height=16, border_radius=8,
-            bgcolor=self.red_color, margin=ft.margin.only(right=6)
-        )
-        self.texto_mqtt = ft.Text("MQTT: Desconectado", size=12, color=self.red_color)
-
-        # Suscribirse al estado de la placa
-        self.mqtt.suscribir(self.mqtt.topico_estado, self._on_mqtt_estado)
-
-        # Pedir estado inicial (si tu ESP32 soporta {"get":"status"})
-        self.mqtt.publicar(self.mqtt.topico_cmd, json.dumps({"get": "status"}))
-
-        # Crear la interfaz
-        self.build_main_view()
-
-        # Iniciar timer para actualizar programaciones y estado MQTT cada segundo
-        self.page.run_task(self._ui_loop)
+        self._controles_agregar_listos = True
     
     def iniciar_timer_programaciones(self):
         import threading, time
@@ -724,9 +1165,22 @@ class ControlRespirometro(ft.Container):
         
     def actualizar_estado_mqtt(self):
         conectado = getattr(self.mqtt, "conectado", False)
-        self.indicador_mqtt.bgcolor = self.green_color if conectado else self.red_color
-        self.texto_mqtt.value = "MQTT: Conectado" if conectado else "MQTT: Desconectado"
-        self.texto_mqtt.color = self.green_color if conectado else self.red_color
+        estado = getattr(self.mqtt, "estado_conexion", "desconectado")
+        if conectado:
+            color, texto = self.green_color, "MQTT: Conectado"
+        elif estado == "conectando":
+            color, texto = "#FFA500", "MQTT: Conectando..."
+        elif estado == "error":
+            color, texto = self.red_color, f"MQTT: Error ({self.mqtt.ultimo_error})"
+        else:
+            color, texto = self.red_color, "MQTT: Desconectado"
+        en_cola = self.mqtt.cola_salida.profundidad()
+        if en_cola:
+            texto += f" · {en_cola} cmd en cola ({int(self.mqtt.cola_salida.antiguedad_s())} s)"
+        self.indicador_mqtt.bgcolor = color
+        self.texto_mqtt.value = texto
+        self.texto_mqtt.color = color
+        self.texto_telemetria.value = self.telemetria.texto(self.dispositivo_actual)
 
         # placa online por "último visto"
         if self._last_seen_estado is None:
@@ -735,9 +1189,18 @@ class ControlRespirometro(ft.Container):
             dt = (datetime.now() - self._last_seen_estado).total_seconds()
             placa_online = dt <= self._offline_timeout_s
 
-        if placa_online:
+        if self._last_seen_estado is None and self.estado_reles.online is not None:
+            # todavía sin datos frescos: mostrar lo último conocido, en gris
+            ts = self.estado_reles.ts_instantanea
+            cuando = datetime.fromtimestamp(ts).strftime("%d/%m %H:%M") if ts else "?"
+            self.indicador_placa.bgcolor = self.grey_color
+            self.texto_placa.value = "PLACA: {} (último conocido {})".format(
+                "ONLINE" if self.estado_reles.online else "OFFLINE", cuando
+            )
+            self.texto_placa.color = self.grey_color
+        elif placa_online:
             self.indicador_placa.bgcolor = self.green_color
-            self.texto_placa.value = "PLACA: ONLINE"
+            self.texto_placa.value = "PLACA: ONLINE" + self._texto_agenda()
             self.texto_placa.color = self.green_color
         else:
             self.indicador_placa.bgcolor = self.red_color
@@ -749,11 +1212,34 @@ class ControlRespirometro(ft.Container):
             w["btn"].disabled = not enabled
 
 
+    def _texto_agenda(self) -> str:
+        est = self.agenda.estado(self.dispositivo_actual)
+        if est is None:
+            return ""
+        texto = " · agenda local: {} eventos".format(est.get("entradas", 0))
+        if not est.get("rtc"):
+            texto += " (sin hora NTP)"
+        elif not est["sincronizada"]:
+            texto += " (sincronizando)"
+        return texto
+
     def evaluar_programaciones(self):
         """Evalúa las programaciones activas y actualiza la UI"""
         try:
+            # Todavía leyendo programaciones del disco
+            if not self._programaciones_cargadas:
+                return
+
+            # Agenda de la placa al día (en pausa se vacía: la placa no debe seguir sola)
+            self.agenda.sincronizar(
+                [] if self.placa_pausada else self.gestor_programaciones.obtener_programaciones(),
+                self._dispositivo_de,
+            )
+
             # Si está pausado, no evaluar programaciones pero mantener UI actualizada
             if self.placa_pausada:
+                if pytime.monotonic() - self._pausa_renovada >= PR.PAUSA_RENOVAR_S:
+                    self._guardar_pausa()  # sin renovar, el demonio la da por vencida
                 self.page.update()
                 return
 
@@ -765,6 +1251,12 @@ class ControlRespirometro(ft.Container):
             # 2) Aplicar a relés ANTES de limpiar vencidas (así detecta terminadas y manda fin_accion)
             self._aplicar_programaciones_a_reles(programaciones_activas)
 
+            # En modo flota la vista principal muestra solo la placa seleccionada
+            if self.flota is not None:
+                programaciones_activas = [
+                    p for p in programaciones_activas if self._dispositivo_de(p) == self.dispositivo_actual
+                ]
+
             # 3) Actualizar UI según si hay activa
             if programaciones_activas:
                 prog_actual = programaciones_activas[0]
@@ -830,19 +1322,19 @@ class ControlRespirometro(ft.Container):
             # 5) Recién acá limpiar vencidas (ya se aplicó fin_accion cuando correspondía)
             vencidas = self.gestor_programaciones.limpiar_programaciones_vencidas()
             if vencidas > 0:
-                print(f"Limpiadas {vencidas} programaciones vencidas")
+                log.info("Limpiadas %s programaciones vencidas", vencidas)
                 if self.vista_actual == "main":
                     self.build_main_view()
 
             self.page.update()
 
         except Exception as e:
-            print(f"Error al evaluar programaciones: {e}")
+            log.exception("Error al evaluar programaciones: %s", e)
 
     
     def confirmar_apagar(self, e):
         """Apaga el estado y termina la programación activa directamente, sin pop-up."""
-        print("=== Botón APAGAR presionado === (sin pop-up)")
+        log.debug("Botón APAGAR presionado")
         if self.programacion_activa_actual:
 
             # Registrar cancelación en historial
@@ -850,8 +1342,9 @@ class ControlRespirometro(ft.Container):
                 self._agregar_historial(evento="CANCELADA", prog=self.programacion_activa_actual)
             except Exception:
                 pass
-            print(f"Terminando programación activa: {self.programacion_activa_actual['tipo']}")
-            self.gestor_programaciones.eliminar_programacion(self.programacion_activa_actual.get('id'))
+            log.info("Terminando programación activa: %s", self.programacion_activa_actual["tipo"])
+            self.gestor_programaciones.eliminar_programacion(self.programacion_activa_actual.get('id'), guardar=False)
+            self._guardar_programaciones_async()
             self.build_main_view()
         self.apagar_placa()
         self.page.update()
@@ -861,11 +1354,12 @@ class ControlRespirometro(ft.Container):
         self.placa_encendida = False
         self.placa_pausada = False
         self.tiempo_pausado_inicio = None
+        self._guardar_pausa()
         self.indicador_estado.bgcolor = self.red_color
         self.texto_estado.value = "APAGADO"
         self.texto_estado.color = self.red_color
         self.page.update()
-        print("Sistema apagado")
+        log.info("Sistema apagado")
     
     def pausar_placa(self, e):
         """Pausar/Reanudar la placa"""
@@ -873,6 +1367,7 @@ class ControlRespirometro(ft.Container):
             return
         
         self.placa_pausada = not self.placa_pausada
+        self._guardar_pausa()
         
         if self.placa_pausada:
             # Pausar: registrar el tiempo de pausa
@@ -892,8 +1387,8 @@ class ControlRespirometro(ft.Container):
                         fin_actual = datetime.strptime(prog['fin'], '%Y-%m-%d %H:%M:%S')
                         nuevo_fin = fin_actual + tiempo_pausado
                         prog['fin'] = nuevo_fin.strftime('%Y-%m-%d %H:%M:%S')
-                        self.gestor_programaciones.guardar_programaciones()
-                        print(f"Programación extendida por {tiempo_pausado}")
+                        self._guardar_programaciones_async()
+                        log.info("Programación extendida por %s", tiempo_pausado)
                         break
                 
                 self.tiempo_pausado_inicio = None
@@ -909,6 +1404,7 @@ class ControlRespirometro(ft.Container):
         self.placa_encendida = not self.placa_encendida
         if self.placa_encendida:
             self.placa_pausada = False
+            self._guardar_pausa()
             self.indicador_estado.bgcolor = self.green_color
             self.texto_estado.value = "ENCENDIDO (MANUAL)"
             self.texto_estado.color = self.green_color
@@ -921,6 +1417,7 @@ class ControlRespirometro(ft.Container):
     def mostrar_vista_agregar(self, e):
         """Cambiar a la vista de agregar programación"""
         self.vista_actual = "add"
+        self._crear_controles_agregar()
 
         # Setear fecha/hora por defecto en "Ahora" cada vez que abrís esta pantalla
         ahora = datetime.now()
@@ -948,7 +1445,7 @@ class ControlRespirometro(ft.Container):
 
             targets = [k for k, chk in self.chk_reles.items() if chk.value]
             if not targets:
-                print("No seleccionaste relés.")
+                log.info("No seleccionaste relés.")
                 return
 
             total_segundos = horas * 3600 + minutos * 60 + segundos
@@ -957,6 +1454,7 @@ class ControlRespirometro(ft.Container):
 
             nuevo = self.gestor_programaciones.agregar_programacion(
                 tipo="Tiempo",
+                dispositivo=self.dispositivo_actual,
                 inicio=tiempo_inicio.strftime("%Y-%m-%d %H:%M:%S"),
                 fin=tiempo_fin.strftime("%Y-%m-%d %H:%M:%S"),
                 duracion=f"{horas}h {minutos}m {segundos}s",
@@ -964,7 +1462,9 @@ class ControlRespirometro(ft.Container):
                 targets=targets,
                 accion=self.accion_prog.value or "on",
                 fin_accion=self.fin_accion_prog.value or "off",
+                guardar=False,
             )
+            self._guardar_programaciones_async()
 
             # Guardar en historial (creada)
             prog_hist = nuevo if isinstance(nuevo, dict) else {
@@ -994,7 +1494,7 @@ class ControlRespirometro(ft.Container):
         try:
             targets = [k for k, chk in self.chk_reles.items() if chk.value]
             if not targets:
-                print("No seleccionaste relés.")
+                log.info("No seleccionaste relés.")
                 return
 
             inicio_str = f"{self.fecha_inicio.value} {self.hora_inicio.value}"
@@ -1008,6 +1508,7 @@ class ControlRespirometro(ft.Container):
 
             nuevo = self.gestor_programaciones.agregar_programacion(
                 tipo="Fecha",
+                dispositivo=self.dispositivo_actual,
                 inicio=inicio_str,
                 fin=fin_str,
                 duracion="Por rango",
@@ -1015,7 +1516,9 @@ class ControlRespirometro(ft.Container):
                 targets=targets,
                 accion=self.accion_prog.value or "on",
                 fin_accion=self.fin_accion_prog.value or "off",
+                guardar=False,
             )
+            self._guardar_programaciones_async()
 
             # Guardar en historial (creada)
             prog_hist = nuevo if isinstance(nuevo, dict) else {
@@ -1049,7 +1552,8 @@ class ControlRespirometro(ft.Container):
                 self._agregar_historial(evento="BORRADA", prog=prog or {"tipo":"(desconocido)"}, extra={"index": index})
             except Exception:
                 pass
-            self.gestor_programaciones.eliminar_por_indice(index)
+            if self.gestor_programaciones.eliminar_por_indice(index, guardar=False):
+                self._guardar_programaciones_async()
             self.build_main_view()
             self.page.update()
         return eliminar
@@ -1209,12 +1713,27 @@ class ControlRespirometro(ft.Container):
                                 controls=[
                                     ft.Icon(name=ft.Icons.DEVICES, color=self.green_color, size=50),
                                     ft.Text("Respirómetro", weight="bold", color="black", size=18),
-                                    ft.Text("CADIC", color=self.grey_color, size=14),
+                                    ft.Text(
+                                        f"CADIC - placa {self.dispositivo_actual}" if self.flota is not None else "CADIC",
+                                        color=self.grey_color, size=14,
+                                    ),
                                     ft.Row([
                                         self.indicador_mqtt,
                                         self.texto_mqtt
                                     ], alignment=ft.MainAxisAlignment.CENTER),
-                                    
+                                    self.texto_telemetria,
+                                    ft.TextButton(
+                                        text="Latencia",
+                                        icon=ft.Icons.TIMER_OUTLINED,
+                                        on_click=self.mostrar_latencias,
+                                    ),
+                                    ft.FilledButton(
+                                        text="Flota",
+                                        icon=ft.Icons.GRID_VIEW,
+                                        visible=self.flota is not None,
+                                        style=ft.ButtonStyle(bgcolor=self.blue_color, color="white"),
+                                        on_click=self.mostrar_vista_flota,
+                                    ),
                                 ]
                             )
                         ),
@@ -1352,6 +1871,9 @@ class ControlRespirometro(ft.Container):
             self.page.update()
     
     def crear_lista_programaciones(self):
+        if not self._programaciones_cargadas:
+            return [ft.Container(padding=20, content=ft.Text("Cargando programaciones...", color=self.grey_color))]
+
         programaciones = self.gestor_programaciones.obtener_programaciones()
 
         if not programaciones:
@@ -1373,7 +1895,11 @@ class ControlRespirometro(ft.Container):
                                 spacing=2,
                                 controls=[
                                     ft.Text(prog.get("tipo",""), weight="bold", color="black", size=12),
-                                    ft.Text(f"{prog.get('inicio','')[:16]}", size=10, color=self.grey_color),
+                                    ft.Text(
+                                        f"{prog.get('inicio','')[:16]}"
+                                        + (f"  •  {self._dispositivo_de(prog)}" if self.flota is not None else ""),
+                                        size=10, color=self.grey_color,
+                                    ),
                                 ],
                             ),
                             ft.IconButton(
@@ -1658,4 +2184,11 @@ class ControlRespirometro(ft.Container):
         
         self.page.update()
 
-ft.app(target=ControlRespirometro)
\ No newline at end of file
+def main(page: ft.Page):
+    # logs recién al arrancar (no al importar): la carpeta y el listener cuentan en el perfil
+    Logs.configurar()
+    PERFIL_ARRANQUE.marcar("logs")
+    ControlRespirometro(page)
+
+
+ft.app(target=main)
\ No newline at end of file
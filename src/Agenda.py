@@ -0,0 +1,135 @@
+# Agenda.py (MicroPython)
+# Tabla de eventos de relés que la placa ejecuta sola con su RTC (ver app/AgendaPlaca.py).
+#   archivo: [version uint32] + entradas ">IBB" (epoch UTC, encender, apagar)
+#   trozo MQTT: [version uint32][indice uint16][total uint16] + entradas
+import os
+import struct
+import time
+
+RUTA = "/app/agenda.bin"
+RUTA_TMP = "/app/agenda.tmp"
+TAM_ENTRADA = 6
+TAM_CABECERA = 8
+
+# los ports viejos cuentan time.time() desde 2000; la app manda epoch Unix
+_EPOCH_UNIX = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+
+def ahora_unix():
+    return time.time() + _EPOCH_UNIX
+
+
+def ms_hasta(epoch):
+    """ms que faltan para un epoch Unix (con time_ns la precisión es de ms, no de 1 s)."""
+    if hasattr(time, "time_ns"):
+        return (epoch - _EPOCH_UNIX) * 1000 - time.time_ns() // 1000000
+    return (epoch - ahora_unix()) * 1000
+
+
+def rtc_valido():
+    # sin NTP (o batería) el RTC arranca en 2000
+    return time.gmtime()[0] >= 2024
+
+
+class Agenda:
+    def __init__(self):
+        self.version = 0
+        self._tabla = b""  # entradas crudas, sin objetos por entrada
+        self.n = 0
+        self._pos = 0      # próxima entrada a ejecutar
+        self._rx = None    # archivo temporal del envío en curso
+        self._rx_version = None
+        self._rx_esperado = 0
+        self.cargar()
+
+    def cargar(self):
+        try:
+            with open(RUTA, "rb") as f:
+                datos = f.read()
+        except OSError:
+            datos = b""
+        if len(datos) >= 4:
+            self.version = struct.unpack_from(">I", datos, 0)[0]
+            self._tabla = datos
+        else:
+            self.version = 0
+            self._tabla = b""
+        self.n = max(0, (len(self._tabla) - 4) // TAM_ENTRADA)
+        self._pos = 0
+
+    def restantes(self):
+        return self.n - self._pos
+
+    def _entrada(self, i):
+        return struct.unpack_from(">IBB", self._tabla, 4 + i * TAM_ENTRADA)
+
+    # -------------------------
+    # Recepción por trozos
+    def _abortar(self):
+        if self._rx is not None:
+            try:
+                self._rx.close()
+            except Exception:
+                pass
+            self._rx = None
+        self._rx_version = None
+
+    def recibir(self, paquete):
+        """Un trozo del envío. True cuando quedó instalada una tabla nueva."""
+        if len(paquete) < TAM_CABECERA:
+            return False
+        version, indice, total = struct.unpack_from(">IHH", paquete, 0)
+        if indice == 0:
+            self._abortar()
+            self._rx = open(RUTA_TMP, "wb")
+            self._rx.write(struct.pack(">I", version))
+            self._rx_version = version
+            self._rx_esperado = 0
+        elif self._rx is None or version != self._rx_version or indice != self._rx_esperado:
+            # se perdió un trozo: la app reenvía todo al no ver la versión nueva
+            self._abortar()
+            return False
+
+        n = (len(paquete) - TAM_CABECERA) // TAM_ENTRADA * TAM_ENTRADA
+        self._rx.write(memoryview(paquete)[TAM_CABECERA:TAM_CABECERA + n])
+        self._rx_esperado += 1
+        if self._rx_esperado < total:
+            return False
+
+        self._rx.close()
+        self._rx = None
+        try:
+            os.rename(RUTA_TMP, RUTA)
+        except OSError:
+            # FAT no reemplaza al renombrar
+            try:
+                os.remove(RUTA)
+            except OSError:
+                pass
+            os.rename(RUTA_TMP, RUTA)
+        self.cargar()
+        return True
+
+    # -------------------------
+    # Ejecución
+    def proxima(self):
+        """Epoch Unix de la próxima entrada, o None."""
+        if self._pos >= self.n:
+            return None
+        return self._entrada(self._pos)[0]
+
+    def vencidas(self, ahora):
+        """
+        (encender, apagar) acumulado de las entradas con epoch <= ahora (la
+        última gana). Al cargar una tabla o arrancar, la primera llamada pone
+        los relés en el estado vigente de la agenda.
+        """
+        encender = apagar = 0
+        while self._pos < self.n:
+            epoch, e, a = self._entrada(self._pos)
+            if epoch > ahora:
+                break
+            encender = (encender & ~a) | e
+            apagar = (apagar & ~e) | a
+            self._pos += 1
+        return encender, apagar
@@ -0,0 +1,122 @@
+# Pulsos.py (MicroPython)
+# Pulsos ({"l3":"on","for_ms":500}) y patrones on/off por relé con UN solo
+# machine.Timer: siempre queda armado (ONE_SHOT) para el vencimiento más
+# próximo de los 8 relés. El estado vive en arrays preasignados, así el
+# callback del timer no aloca; para publicar solo avisa al loop (al_cambiar).
+from machine import Timer
+import array
+import time
+
+LIBRE = 0
+PULSO = 1
+PATRON = 2
+
+MAX_MS = 24 * 3600 * 1000  # muy por debajo del medio período de ticks_ms
+
+
+class Pulsos:
+    def __init__(self, reles, id_timer=0, al_cambiar=None):
+        self._reles = reles  # Pins activo-bajo (0=ON)
+        n = len(reles)
+        self._modo = bytearray(n)
+        self._vence = array.array("i", [0] * n)   # ticks_ms del próximo cambio
+        self._on_ms = array.array("i", [0] * n)
+        self._off_ms = array.array("i", [0] * n)
+        self._ciclos = array.array("i", [0] * n)  # restantes; -1 = sin fin
+        self._final = bytearray(n)                # pulso: 1 = termina encendido
+        self._timer = Timer(id_timer)
+        self._cb = self._vencer  # método ligado una sola vez: re-armar no aloca
+        self._al_cambiar = al_cambiar
+
+    # -------------------------
+    def _poner(self, i, encender):
+        self._reles[i].value(0 if encender else 1)
+
+    def activos(self):
+        m = 0
+        for i in range(len(self._modo)):
+            if self._modo[i] != LIBRE:
+                m |= 1 << i
+        return m
+
+    # pulso()/patron(): un _vencer ya agendado (callback soft) puede correr entre
+    # dos escrituras. Orden: plazo nuevo, datos, _modo y recién ahí el relé; así
+    # nunca ve un modo nuevo con el plazo viejo (ya vencido).
+    def pulso(self, i, encender, ms):
+        """Relé i (0..7) a `encender` ya; vuelve al contrario a los ms."""
+        self._timer.deinit()
+        self._vence[i] = time.ticks_add(time.ticks_ms(), max(1, min(int(ms), MAX_MS)))
+        self._final[i] = 0 if encender else 1
+        self._modo[i] = PULSO
+        self._poner(i, encender)
+        self._rearmar()
+
+    def patron(self, i, on_ms, off_ms, ciclos=0):
+        """Relé i alterna on_ms encendido / off_ms apagado; ciclos=0 sin fin. Termina apagado."""
+        self._timer.deinit()
+        on_ms = max(1, min(int(on_ms), MAX_MS))
+        self._vence[i] = time.ticks_add(time.ticks_ms(), on_ms)
+        self._on_ms[i] = on_ms
+        self._off_ms[i] = max(1, min(int(off_ms), MAX_MS))
+        self._ciclos[i] = int(ciclos) if ciclos and int(ciclos) > 0 else -1
+        self._modo[i] = PATRON
+        self._poner(i, True)
+        self._rearmar()
+
+    def cancelar(self, i):
+        """El relé i deja de estar temporizado (queda como está)."""
+        if self._modo[i] == LIBRE:
+            return
+        self._timer.deinit()
+        self._modo[i] = LIBRE
+        self._rearmar()
+
+    def cancelar_mascara(self, mascara):
+        for i in range(len(self._modo)):
+            if mascara & (1 << i):
+                self.cancelar(i)
+
+    def detener(self):
+        self._timer.deinit()
+        for i in range(len(self._modo)):
+            self._modo[i] = LIBRE
+
+    # -------------------------
+    # Scheduler de plazos
+    def _rearmar(self):
+        ahora = time.ticks_ms()
+        proximo = -1
+        for i in range(len(self._modo)):
+            if self._modo[i] != LIBRE:
+                d = time.ticks_diff(self._vence[i], ahora)
+                if proximo < 0 or d < proximo:
+                    proximo = max(d, 0)
+        if proximo >= 0:
+            self._timer.init(mode=Timer.ONE_SHOT, period=max(1, proximo), callback=self._cb)
+
+    def _vencer(self, _t):
+        ahora = time.ticks_ms()
+        cambio = False
+        for i in range(len(self._modo)):
+            modo = self._modo[i]
+            if modo == LIBRE or time.ticks_diff(self._vence[i], ahora) > 0:
+                continue
+            cambio = True
+            if modo == PULSO:
+                self._poner(i, self._final[i])
+                self._modo[i] = LIBRE
+            elif self._reles[i].value() == 0:
+                # estaba encendido: fase apagada (desde el plazo, sin acumular deriva)
+                self._poner(i, False)
+                if self._ciclos[i] > 0:
+                    self._ciclos[i] -= 1
+                if self._ciclos[i] == 0:
+                    self._modo[i] = LIBRE
+                else:
+                    self._vence[i] = time.ticks_add(self._vence[i], self._off_ms[i])
+            else:
+                self._poner(i, True)
+                self._vence[i] = time.ticks_add(self._vence[i], self._on_ms[i])
+        self._rearmar()
+        if cambio and self._al_cambiar is not None:
+            self._al_cambiar()
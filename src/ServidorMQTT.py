@@ -2,6 +2,7 @@
 from umqtt.simple import MQTTClient
 import time
 import machine
+import uselect
 import ubinascii
 import ujson
 import Setting as ST
@@ -18,7 +19,14 @@ class ServidorMQTT:
 
         # Keepalive: ayuda a que el broker detecte caídas y dispare el LWT
         self.keepalive = 30  # segundos (ajustable)
+        # Tope del connect() (TCP + CONNACK): corre dentro del loop de uasyncio
+        self.timeout_conexion_s = 5
         self._ultimo_intento = 0
+        self._ultimo_envio_ms = time.ticks_ms()
+
+        # Drenado del socket: hasta N mensajes por llamada a verificar_mensajes()
+        self.max_mensajes_por_vuelta = 16
+        self._poll = None
 
         # Client ID único por placa
         uid = ubinascii.hexlify(machine.unique_id()).decode()
@@ -47,8 +55,14 @@ class ServidorMQTT:
                     qos=0,
                 )
 
-            self.cliente.connect()
+            try:
+                self.cliente.connect(timeout=self.timeout_conexion_s)
+            except TypeError:
+                # umqtt.simple viejo: connect() sin timeout
+                self.cliente.connect()
             self.conectado = True
+            self._poll = uselect.poll()
+            self._poll.register(self.cliente.sock, uselect.POLLIN)
             print("Conectado al servidor MQTT en {}:{} (id={})".format(self.host, self.port, self.client_id))
 
             # Apenas conecta: marcar ONLINE (retained)
@@ -72,6 +86,7 @@ class ServidorMQTT:
 
                 self.cliente.disconnect()
             self.conectado = False
+            self._poll = None
             print("Desconectado del servidor MQTT")
         except Exception as e:
             self.conectado = False
@@ -84,6 +99,7 @@ class ServidorMQTT:
 
             # umqtt acepta str/bytes; dejamos str
             self.cliente.publish(topic, mensaje, retain=retain)
+            self._ultimo_envio_ms = time.ticks_ms()
             # print("Mensaje publicado en {}: {}".format(topic, mensaje))
             return True
         except Exception as e:
@@ -107,13 +123,49 @@ class ServidorMQTT:
             print("Error al suscribir al tópico {}: {}".format(topic, e))
             return False
 
-    def verificar_mensajes(self):
+    def mantener_vivo(self):
+        """
+        PINGREQ si no se mandó nada en keepalive/2: con el estado publicado
+        solo ante cambios, si no el broker cortaría la sesión por keepalive.
         """
-        check_msg() no bloquea. Si hay mensaje llama al callback.
+        if not self.cliente or not self.conectado:
+            return False
+        if time.ticks_diff(time.ticks_ms(), self._ultimo_envio_ms) < self.keepalive * 500:
+            return True
+        try:
+            self.cliente.ping()
+            self._ultimo_envio_ms = time.ticks_ms()
+            return True
+        except Exception as e:
+            self.conectado = False
+            print("Error en ping MQTT:", e)
+            return False
+
+    def _hay_datos(self):
+        # ipoll(0) no aloca; POLLHUP/POLLERR también cuentan: check_msg() levanta el error
+        if hasattr(self._poll, "ipoll"):
+            for _ in self._poll.ipoll(0):
+                return True
+            return False
+        return bool(self._poll.poll(0))
+
+    def verificar_mensajes(self, presupuesto=None):
+        """
+        Procesa todo lo que haya en el socket (hasta `presupuesto` mensajes,
+        por defecto max_mensajes_por_vuelta) sin bloquear: una ráfaga de
+        comandos de la app se aplica en una sola vuelta del loop.
+        check_msg() lee un paquete por llamada y llama al callback si es mensaje.
         Si explota por desconexión, marcamos conectado=False para que tu loop reconecte.
         """
         try:
-            if self.cliente:
+            if not self.cliente:
+                return True
+            if self._poll is None:
+                self.cliente.check_msg()
+                return True
+            for _ in range(presupuesto or self.max_mensajes_por_vuelta):
+                if not self._hay_datos():
+                    break
                 self.cliente.check_msg()
             return True
         except Exception as e:
@@ -121,6 +173,12 @@ class ServidorMQTT:
             print("Error al verificar mensajes entrantes:", e)
             return False
 
+    def socket(self):
+        """Socket del cliente (para esperar datos con uasyncio/poll) o None."""
+        if self.cliente is None:
+            return None
+        return getattr(self.cliente, "sock", None)
+
     def esperar_mensaje(self):
         """
         wait_msg() bloquea hasta recibir un msg.
@@ -137,6 +195,8 @@ class ServidorMQTT:
     def reconectar(self, min_interval_s=2):
         """
         Reconexión con un mínimo de espera entre intentos para no spamear.
+        No duerme: el backoff lo hace tarea_mqtt con await asyncio.sleep y el
+        connect queda acotado por timeout_conexion_s.
         """
         ahora = time.time()
         if (ahora - self._ultimo_intento) < min_interval_s:
@@ -145,12 +205,12 @@ class ServidorMQTT:
         self._ultimo_intento = ahora
 
         try:
-            try:
-                self.desconectar()
-            except:
-                pass
+            if self.cliente:
+                try:
+                    self.desconectar()
+                except:
+                    pass
 
-            time.sleep(1)
             ok = self.conectar()
             return ok
         except Exception as e:
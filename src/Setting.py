@@ -1,55 +1,214 @@
+import os
+
+import ujson
+
+RUTA_CONFIG = "/app/config.ini"
+
+# GPIO del ESP32 que sirven de salida para un relé: sin los de la flash
+# (6-11), los de solo entrada (34-39) ni los del UART de consola (1, 3)
+PINES_SALIDA = (2, 4, 5, 12, 13, 14, 15, 16, 17, 18, 19, 21, 22, 23, 25, 26, 27, 32, 33)
+# Pines de fábrica del módulo de 8 relés (si uno configurado no sirve)
+PINES_DEFECTO = (23, 22, 21, 19, 18, 5, 17, 16)
+
+# Config de red "a prueba": al cambiarla por MQTT se guardan los valores
+# anteriores en RUTA_PRUEBA. El primer connect MQTT la confirma; si no conecta
+# en PRUEBA_TIMEOUT_MS, o tras PRUEBA_MAX_ARRANQUES arranques sin confirmar,
+# se vuelve a los anteriores (la placa no queda fuera de la red para siempre).
+RUTA_PRUEBA = "/app/config.prueba"
+CLAVES_RED = ("WIFI_SSID", "WIFI_PASSWORD", "MQTT_HOST", "MQTT_PORT")
+PRUEBA_TIMEOUT_MS = 3 * 60 * 1000
+PRUEBA_MAX_ARRANQUES = 3
+
+# Claves que se pueden cambiar por MQTT (topico_cmd/config) y si necesitan reinicio
+CLAVES_REMOTAS = {
+    "WIFI_SSID": True,
+    "WIFI_PASSWORD": True,
+    "MQTT_HOST": False,
+    "MQTT_PORT": False,
+    "TOPICO_CMD": True,
+    "TOPICO_ESTADO": True,
+}
+for _i in range(1, 9):
+    CLAVES_REMOTAS["PIN_RELE_{}".format(_i)] = True
+
+# Se parsea una sola vez por arranque; WiFi, ServidorMQTT y main comparten esto
+_valores = None
+
+
+def _parsear(linea):
+    linea = linea.strip()
+    if not linea or linea.startswith("#") or "=" not in linea:
+        return None, None
+    clave, valor = linea.split("=", 1)
+    return clave.strip(), valor.strip()
+
+
+def _leer(ruta):
+    valores = {}
+    try:
+        with open(ruta, "r") as archivo:
+            for linea in archivo:  # de a una línea, sin readlines()
+                clave, valor = _parsear(linea)
+                if clave:
+                    valores[clave] = valor
+    except Exception as e:
+        print("Error config:", e)
+    return valores
+
+
 class configuracion:
     def __init__(self):
-        self.ruta_config = "/app/config.ini"
-        diccionario_config = {}
-        try:
-            with open(self.ruta_config, "r") as archivo:
-                lineas_config = archivo.readlines()
-                for linea in lineas_config:
-                    linea = linea.strip()
-                    if not linea or linea.startswith("#"):
-                        continue
-                    if "=" in linea:
-                        clave, valor = linea.split("=", 1)
-                        diccionario_config[clave.strip()] = valor.strip()
-        except Exception as e:
-            print("Error config:", e)
-        self.diccionario_valores = diccionario_config
-    
+        global _valores
+        self.ruta_config = RUTA_CONFIG
+        if _valores is None:
+            _valores = _leer(self.ruta_config)
+        self.diccionario_valores = _valores
+
     def obtener_claves_wifi(self):
         ssid = self.diccionario_valores.get("WIFI_SSID", "")
         password = self.diccionario_valores.get("WIFI_PASSWORD", "")
         return ssid, password
-        
+
     def obtener_parametros_servidor_mqtt(self):
         host = self.diccionario_valores.get("MQTT_HOST", "")
         port = int(self.diccionario_valores.get("MQTT_PORT", "1883"))
         return host, port
-    
+
     def obtener_topicos_mqtt(self):
         topico_cmd = self.diccionario_valores.get("TOPICO_CMD", "")
         topico_estado = self.diccionario_valores.get("TOPICO_ESTADO", "")
         return topico_cmd, topico_estado
-    
+
     def obtener_pines_reles(self):
+        """Siempre 8 pines: uno faltante o que no sirve de salida usa el de fábrica."""
         pines = []
         for i in range(1, 9):
             clave = f"PIN_RELE_{i}"
             valor = self.diccionario_valores.get(clave)
+            pin = PINES_DEFECTO[i - 1]
             if valor is not None:
                 try:
-                    pines.append(int(valor))
+                    pin = int(valor)
                 except ValueError:
                     print(f"Valor inválido para {clave}: {valor}")
+                if pin not in PINES_SALIDA:
+                    print(f"{clave}={valor} no es un GPIO de salida: uso {PINES_DEFECTO[i - 1]}")
+                    pin = PINES_DEFECTO[i - 1]
+            pines.append(pin)
         return pines
-    
-    def guardar_cambios(self,cambios: dict):
-        data = dict(self.diccionario_valores)
 
-        for k,v in cambios.items():
-            data[k] = v
-    
+    def guardar_cambios(self, cambios: dict):
+        """
+        Escribe los cambios en config.ini conservando comentarios y orden
+        (las claves nuevas van al final). Se escribe a un .tmp y se renombra:
+        un corte de luz a mitad deja el archivo viejo entero.
+        Devuelve la lista de claves que cambiaron.
+        """
+        cambios = {str(k): str(v).strip() for k, v in cambios.items()}
+        cambiadas = [k for k, v in cambios.items() if self.diccionario_valores.get(k) != v]
+        if not cambiadas:
+            return []
+
+        tmp = self.ruta_config + ".tmp"
+        pendientes = dict(cambios)
+        with open(tmp, "w") as salida:
+            try:
+                with open(self.ruta_config, "r") as entrada:
+                    for linea in entrada:
+                        clave, _ = _parsear(linea)
+                        if clave in pendientes:
+                            linea = "{} = {}\n".format(clave, pendientes.pop(clave))
+                        elif not linea.endswith("\n"):
+                            linea += "\n"
+                        salida.write(linea)
+            except OSError:
+                pass  # no existía: se crea
+            for clave, valor in pendientes.items():
+                salida.write("{} = {}\n".format(clave, valor))
+
+        try:
+            os.rename(tmp, self.ruta_config)
+        except OSError:
+            # FAT no reemplaza al renombrar
+            os.remove(self.ruta_config)
+            os.rename(tmp, self.ruta_config)
+
+        self.diccionario_valores.update(cambios)
+        return cambiadas
+
+
+# -------------------------
+# Config de red a prueba
+def prueba_pendiente():
+    """{"anteriores": {...}, "arranques": n} o None si no hay cambios sin confirmar."""
+    try:
+        with open(RUTA_PRUEBA, "r") as f:
+            return ujson.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _escribir_prueba(prueba):
+    with open(RUTA_PRUEBA, "w") as f:
+        ujson.dump(prueba, f)
+
+
+def guardar_prueba(cambios: dict):
+    """
+    Antes de aplicar cambios de red: anota los valores actuales para volver.
+    Si ya había una prueba pendiente se conservan los de esa (los últimos que
+    conectaron). Devuelve True si hay claves de red en juego.
+    """
+    valores = configuracion().diccionario_valores
+    prueba = prueba_pendiente() or {"anteriores": {}, "arranques": 0}
+    nuevas = False
+    for clave in CLAVES_RED:
+        if clave in cambios and valores.get(clave) != str(cambios[clave]).strip():
+            if clave not in prueba["anteriores"]:
+                prueba["anteriores"][clave] = valores.get(clave, "")
+            nuevas = True
+    if nuevas:
+        prueba["arranques"] = 0
+        _escribir_prueba(prueba)
+    return nuevas
+
+
+def registrar_arranque():
+    """
+    En boot.py, antes de crear WiFi/MQTT. Cuenta un arranque con la config a
+    prueba; pasados PRUEBA_MAX_ARRANQUES revierte. True si sigue a prueba.
+    """
+    prueba = prueba_pendiente()
+    if prueba is None:
+        return False
+    prueba["arranques"] = prueba.get("arranques", 0) + 1
+    if prueba["arranques"] > PRUEBA_MAX_ARRANQUES:
+        print("Config de red sin confirmar tras {} arranques".format(PRUEBA_MAX_ARRANQUES))
+        revertir_prueba()
+        return False
+    _escribir_prueba(prueba)
+    return True
+
+
+def _borrar_prueba():
+    try:
+        os.remove(RUTA_PRUEBA)
+        return True
+    except OSError:
+        return False
+
+
+def confirmar_prueba():
+    if _borrar_prueba():
+        print("Config de red confirmada")
 
 
-        
-    
+def revertir_prueba():
+    """Vuelve a los valores de red anteriores (hay que reiniciar para usarlos)."""
+    prueba = prueba_pendiente()
+    if prueba is None:
+        return False
+    configuracion().guardar_cambios(prueba.get("anteriores", {}))
+    _borrar_prueba()
+    print("Config de red revertida:", list(prueba.get("anteriores", {})))
+    return True
@@ -0,0 +1,94 @@
+# Telemetria.py (MicroPython)
+# Contadores livianos de rendimiento. Todo vive en un array preasignado:
+# registrar no aloca; solo reporte() arma el JSON (una vez por período).
+import array
+import gc
+import time
+
+import ujson
+
+# índices en _c
+_VUELTAS = 0
+_VUELTA_MIN = 1
+_VUELTA_MAX = 2
+_VUELTA_SUMA = 3
+_MENSAJES = 4
+_CB_SUMA = 5
+_CB_MAX = 6
+_MEM_MIN = 7
+_RECONEX_MQTT = 8
+_N = 9
+
+_SIN_MINIMO = 0x7FFFFFFF
+
+
+class Telemetria:
+    def __init__(self, periodo_s=60):
+        self.periodo_s = periodo_s
+        self._c = array.array("i", [0] * _N)
+        self._c[_MEM_MIN] = _SIN_MINIMO
+        self._t_ventana = time.ticks_ms()
+        self.reiniciar_ventana()
+
+    def reiniciar_ventana(self):
+        # min/med/max y mensajes son por período; mem_min y reconexiones desde el arranque
+        c = self._c
+        c[_VUELTAS] = 0
+        c[_VUELTA_MIN] = _SIN_MINIMO
+        c[_VUELTA_MAX] = 0
+        c[_VUELTA_SUMA] = 0
+        c[_MENSAJES] = 0
+        c[_CB_SUMA] = 0
+        c[_CB_MAX] = 0
+        self._t_ventana = time.ticks_ms()
+
+    # -------------------------
+    # Registro (camino caliente)
+    def vuelta(self, us):
+        # un paso de trabajo de cualquier tarea (lo que bloquea el loop)
+        c = self._c
+        c[_VUELTAS] += 1
+        c[_VUELTA_SUMA] += us
+        if us < c[_VUELTA_MIN]:
+            c[_VUELTA_MIN] = us
+        if us > c[_VUELTA_MAX]:
+            c[_VUELTA_MAX] = us
+
+    def mensaje(self, us):
+        c = self._c
+        c[_MENSAJES] += 1
+        c[_CB_SUMA] += us
+        if us > c[_CB_MAX]:
+            c[_CB_MAX] = us
+
+    def memoria(self):
+        libre = gc.mem_free()
+        if libre < self._c[_MEM_MIN]:
+            self._c[_MEM_MIN] = libre
+
+    def reconexion_mqtt(self):
+        self._c[_RECONEX_MQTT] += 1
+
+    # -------------------------
+    def reporte(self, rssi=None, reconex_wifi=0):
+        """JSON del período y reinicia la ventana."""
+        c = self._c
+        vueltas = c[_VUELTAS]
+        mensajes = c[_MENSAJES]
+        data = {
+            "periodo_s": time.ticks_diff(time.ticks_ms(), self._t_ventana) // 1000,
+            "vueltas": vueltas,
+            "vuelta_min_us": c[_VUELTA_MIN] if vueltas else 0,
+            "vuelta_med_us": c[_VUELTA_SUMA] // vueltas if vueltas else 0,
+            "vuelta_max_us": c[_VUELTA_MAX],
+            "mensajes": mensajes,
+            "cb_med_us": c[_CB_SUMA] // mensajes if mensajes else 0,
+            "cb_max_us": c[_CB_MAX],
+            "mem_libre": gc.mem_free(),
+            "mem_min": c[_MEM_MIN] if c[_MEM_MIN] != _SIN_MINIMO else gc.mem_free(),
+            "reconex_mqtt": c[_RECONEX_MQTT],
+            "reconex_wifi": reconex_wifi,
+            "rssi": rssi,
+        }
+        self.reiniciar_ventana()
+        return ujson.dumps(data)
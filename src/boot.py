@@ -1,33 +1,63 @@
 # boot.py - Se ejecuta al iniciar el ESP32
+# Orden: 1) relés a OFF (ms después del reset)  2) objetos de red sin bloquear.
+# La conexión WiFi/MQTT sigue de fondo en las tareas de main.py.
+# Corre una sola vez: `import boot` desde main.py reusa esta ejecución (ver 4).
 import time
-from wifi import WiFi
-from ServidorMQTT import ServidorMQTT
+from machine import Pin
 
+_T0 = time.ticks_ms()  # ms desde el reset hasta que corre boot.py
+tiempos = {"boot": _T0}
 
 
-print("=== Iniciando sistema ===")
+def marcar(fase):
+    """Marca una fase del arranque (ms desde el reset); se publica al conectar MQTT."""
+    if fase not in tiempos:
+        tiempos[fase] = time.ticks_ms()
 
-# 1. Conectar a WiFi
-print("\n--- Configurando WiFi ---")
-wifi = WiFi()
-if wifi.conectar():
-    print("WiFi configurado correctamente")
-    info = wifi.obtener_info()
-    if info:
-        print("Dirección IP asignada:", info['ip'])
-else:
-    print("ERROR: No se pudo conectar al WiFi")
-    print("El sistema continuará sin conexión de red")
-
-if wifi.conectado:
-    print("\n--- Conectando al servidor MQTT ---")
-    mqtt = ServidorMQTT()
-    
+
+# 1. ARRANQUE SEGURO: relés activo-bajo -> value=1 (OFF) antes de habilitar la salida
+import Setting as ST
+
+
+def _crear_rele(i, pin):
+    # un pin que el port no acepta no puede dejar la placa sin arrancar
     try:
-        mqtt.conectar()
-        print("Servidor MQTT configurado correctamente")
+        return Pin(pin, Pin.OUT, value=1)
     except Exception as e:
-        print("ERROR al conectar MQTT:", e)
-        print("Se intentará reconectar más tarde")
+        print("PIN_RELE_{}={} no se pudo usar ({}): uso {}".format(i + 1, pin, e, ST.PINES_DEFECTO[i]))
+        return Pin(ST.PINES_DEFECTO[i], Pin.OUT, value=1)
+
+
+RELES = [_crear_rele(i, p) for i, p in enumerate(ST.configuracion().obtener_pines_reles())]
+marcar("reles_seguros")
+
+# Config de red cambiada por MQTT y todavía sin confirmar (ver Setting.py):
+# cuenta el arranque y, si ya fallaron demasiados, vuelve a la anterior
+RED_A_PRUEBA = ST.registrar_arranque()
 
-print("\n=== Sistema iniciado ===")
+print("=== Iniciando sistema ===")
+
+# 2. WiFi: solo se arranca el intento (WiFi.avanzar lo sigue desde main.py)
+from wifi import WiFi
+from ServidorMQTT import ServidorMQTT
+
+wifi = WiFi()
+wifi.avanzar()
+marcar("wifi_iniciado")
+
+# 3. MQTT: el objeto queda listo; tarea_mqtt conecta cuando haya WiFi
+mqtt = ServidorMQTT()
+
+print("=== Sistema iniciado (red de fondo) ===")
+
+# 4. El firmware corre boot.py en __main__ y main.py hace `import boot`, que lo
+#    volvería a ejecutar (relés, WiFi y MQTT de nuevo, y `tiempos` medidos desde
+#    esa segunda corrida). Registrar esta misma ejecución como "boot" hace que
+#    el import la reuse: las fases quedan medidas desde el reset.
+if __name__ == "__main__":
+    import sys
+    try:
+        import __main__
+        sys.modules["boot"] = __main__
+    except ImportError:
+        pass
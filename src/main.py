@@ -1,21 +1,28 @@
-from machine import Pin, Timer
+import machine
+from machine import Pin
 import time
 import ujson
 import urandom
+import uasyncio as asyncio
 
 import boot
 import Setting as ST
+import Agenda as AG
+import Telemetria as TL
+import Pulsos as PU
+
+try:
+    import ntptime
+except ImportError:
+    ntptime = None
 
 
 # -------------------------
-# Configuración pines relés (desde config.ini)
-pines = ST.configuracion().obtener_pines_reles()
-if len(pines) < 8:
+# Pines del módulo de relés (8 canales): boot.py ya los dejó en OFF
+RELES = boot.RELES
+if len(RELES) < 8:
     raise ValueError("Faltan pines de relés en config.ini (necesito PIN_RELE_1..PIN_RELE_8)")
 
-# Pines del módulo de relés (8 canales)
-RELES = [Pin(p, Pin.OUT) for p in pines[:8]]
-
 # LED de placa
 LED_PIN = 2
 led = Pin(LED_PIN, Pin.OUT)
@@ -31,18 +38,89 @@ def rele_set(i: int, encender: bool):
 def rele_get(i: int) -> str:
     return "on" if RELES[i - 1].value() == 0 else "off"
 
+def mascara_reles() -> int:
+    # bit i-1 = relé i encendido
+    m = 0
+    for i in range(8):
+        if RELES[i].value() == 0:
+            m |= 1 << i
+    return m
+
+def aplicar_mascaras(encender: int, apagar: int) -> bool:
+    """Prende/apaga por máscara (bit i-1 = relé i). True si algo cambió."""
+    pulsos.cancelar_mascara(encender | apagar)  # un comando fijo le gana al pulso
+    antes = mascara_reles()
+    for i in range(8):
+        bit = 1 << i
+        if encender & bit:
+            RELES[i].value(0)
+        elif apagar & bit:
+            RELES[i].value(1)
+    return mascara_reles() != antes
+
+
+# -------------------------
+# Protocolo binario (ver app/ProtocoloBinario.py): tópico + "/b"
+#   estado:  [flags, máscara, (ack hi, ack lo)]   flags = 0x10 | 0x01 online | 0x02 ack
+#   comando: [flags, encender, apagar, (seq hi, seq lo)]   flags = 0x10 | 0x01 get | 0x02 seq
+SUFIJO_BIN = "/b"
+VERSION_BIN = 0x10
+_modo_binario = False  # se responde en el formato del último comando de relés
+_buf_estado = bytearray(4)
+_mv_estado = memoryview(_buf_estado)
+
+
+def _mqtt_listo():
+    return hasattr(boot, "mqtt") and boot.mqtt.conectado
+
 
-def publicar_estado_reles(retain=False):
+# Payload JSON cacheado: se rearma solo cuando cambia la máscara de relés
+_cache_mascara = -1
+_cache_json = None
+_ultima_pub_ms = 0
+
+
+def _payload_json(mascara):
+    global _cache_mascara, _cache_json
+    if mascara != _cache_mascara:
+        partes = ['{"online":"on","bin":1']
+        for i in range(8):
+            partes.append(',"l{}":"{}"'.format(i + 1, "on" if (mascara >> i) & 1 else "off"))
+        partes.append("}")
+        _cache_json = "".join(partes)
+        _cache_mascara = mascara
+    return _cache_json
+
+
+def publicar_estado_reles(retain=False, ack=None):
     """
     Publica estado completo en el tópico estado:
-    {"online":"on","l1":"off",...,"l8":"off"}
+    {"online":"on","l1":"off",...,"l8":"off","bin":1}
+    (o 2-4 bytes en topico_estado/b si la app ya habla binario)
+    ack: "seq" del comando que se acaba de aplicar (la app mide la latencia)
+    Se llama apenas cambia un relé; tarea_heartbeat solo republica si pasó
+    el keepalive sin publicar nada.
     """
-    if not hasattr(boot, "mqtt"):
+    global _ultima_pub_ms
+    if not _mqtt_listo():
         return
-    payload = {"online": "on"}
-    for i in range(1, 9):
-        payload["l{}".format(i)] = rele_get(i)
-    boot.mqtt.publicar(boot.mqtt.topico_estado, ujson.dumps(payload), retain=retain)
+    _ultima_pub_ms = time.ticks_ms()
+    mascara = mascara_reles()
+    if _modo_binario and not retain:
+        _buf_estado[0] = VERSION_BIN | 0x01
+        _buf_estado[1] = mascara
+        n = 2
+        if ack is not None:
+            _buf_estado[0] |= 0x02
+            _buf_estado[2] = (ack >> 8) & 0xFF
+            _buf_estado[3] = ack & 0xFF
+            n = 4
+        boot.mqtt.publicar(boot.mqtt.topico_estado + SUFIJO_BIN, _mv_estado[:n])
+        return
+    payload = _payload_json(mascara)
+    if ack is not None:
+        payload = '{},"ack":{}}}'.format(payload[:-1], int(ack))
+    boot.mqtt.publicar(boot.mqtt.topico_estado, payload, retain=retain)
 
 
 def publicar_offline_retenido():
@@ -59,72 +137,272 @@ def publicar_offline_retenido():
 
 
 # -------------------------
-# ARRANQUE SEGURO: todo OFF
-for i in range(1, 9):
-    rele_set(i, False)
+# Agenda local (programaciones compiladas por la app, se ejecutan con el RTC)
+SUFIJO_AGENDA = "/agenda"
+agenda = AG.Agenda()
+_ntp_ok_ms = None       # último sync exitoso
+_ntp_proximo_ms = None  # próximo intento (None = ya)
+NTP_CADA_MS = 6 * 3600 * 1000
+# settime() bloquea (DNS + espera UDP): si falla, reintentar con backoff 30 s .. 10 min
+NTP_REINTENTO_MIN_MS = 30 * 1000
+NTP_REINTENTO_MAX_MS = 10 * 60 * 1000
+_ntp_espera_ms = NTP_REINTENTO_MIN_MS
+
+
+def publicar_agenda():
+    """Versión de la agenda que está corriendo (retenido en topico_estado/agenda)."""
+    if not _mqtt_listo():
+        return
+    boot.mqtt.publicar(
+        boot.mqtt.topico_estado + SUFIJO_AGENDA,
+        ujson.dumps({"version": agenda.version, "entradas": agenda.restantes(), "rtc": 1 if AG.rtc_valido() else 0}),
+        retain=True,
+    )
+
+
+def ejecutar_agenda():
+    """Aplica las entradas vencidas; publica estado si cambió algún relé."""
+    if not AG.rtc_valido():
+        return
+    encender, apagar = agenda.vencidas(AG.ahora_unix())
+    if (encender or apagar) and aplicar_mascaras(encender, apagar):
+        publicar_estado_reles()
+
+
+def toca_ntp():
+    return _ntp_proximo_ms is None or time.ticks_diff(time.ticks_ms(), _ntp_proximo_ms) >= 0
+
+
+def sincronizar_hora():
+    global _ntp_ok_ms, _ntp_proximo_ms, _ntp_espera_ms
+    if ntptime is None:
+        return False
+    try:
+        ntptime.settime()  # RTC en UTC
+    except Exception as e:
+        print("Error NTP (reintento en {} s):".format(_ntp_espera_ms // 1000), e)
+        _ntp_proximo_ms = time.ticks_add(time.ticks_ms(), _ntp_espera_ms)
+        _ntp_espera_ms = min(_ntp_espera_ms * 2, NTP_REINTENTO_MAX_MS)
+        return False
+    primera = _ntp_ok_ms is None
+    _ntp_ok_ms = time.ticks_ms()
+    _ntp_proximo_ms = time.ticks_add(_ntp_ok_ms, NTP_CADA_MS)
+    _ntp_espera_ms = NTP_REINTENTO_MIN_MS
+    if primera:
+        publicar_agenda()
+    return True
+
+
+# -------------------------
+# Pulsos y patrones temporizados (machine.Timer, ver Pulsos.py)
+#   {"l3": "on", "for_ms": 500}                  -> l3 encendido 500 ms y vuelve a off
+#   {"patron": {"l2": [on_ms, off_ms, ciclos]}}  -> ciclos=0 sin fin; termina apagado
+# El callback del timer no publica: levanta _flag_pulsos y tarea_pulsos publica.
+try:
+    _flag_pulsos = asyncio.ThreadSafeFlag()
+except AttributeError:
+    _flag_pulsos = None  # uasyncio viejo: tarea_pulsos sondea _pulsos_cambio
+_pulsos_cambio = False
+
+
+def _aviso_pulsos():
+    global _pulsos_cambio
+    _pulsos_cambio = True
+    if _flag_pulsos is not None:
+        _flag_pulsos.set()
+
+
+pulsos = PU.Pulsos(RELES, id_timer=0, al_cambiar=_aviso_pulsos)
 
 
 # -------------------------
-# Timer LED (NO toca MQTT)
-timer = None
-t_on = 1000
-t_off = 1000
-estado_led = False
-
-def callback_timer(t):
-    global estado_led, t_on, t_off, timer
-    if estado_led:
-        led.value(0)
-        estado_led = False
-        timer.init(period=t_off, mode=Timer.ONE_SHOT, callback=callback_timer)
-    else:
+# Parpadeo LED: tarea uasyncio (NO toca MQTT)
+_tarea_led = None
+
+async def _parpadeo_led(on_ms, off_ms):
+    while True:
         led.value(1)
-        estado_led = True
-        timer.init(period=t_on, mode=Timer.ONE_SHOT, callback=callback_timer)
+        await asyncio.sleep_ms(on_ms)
+        led.value(0)
+        await asyncio.sleep_ms(off_ms)
 
 def iniciar_timer(on_ms, off_ms):
-    global timer, t_on, t_off, estado_led
-    t_on = int(on_ms)
-    t_off = int(off_ms)
-    if timer:
-        timer.deinit()
-    timer = Timer(0)
-    led.value(1)
-    estado_led = True
-    timer.init(period=t_on, mode=Timer.ONE_SHOT, callback=callback_timer)
+    global _tarea_led
+    detener_timer()
+    _tarea_led = asyncio.create_task(_parpadeo_led(max(1, int(on_ms)), max(1, int(off_ms))))
 
 def detener_timer():
-    global timer
-    if timer:
-        timer.deinit()
-        timer = None
+    global _tarea_led
+    if _tarea_led is not None:
+        _tarea_led.cancel()
+        _tarea_led = None
     led.value(0)
 
 
 # -------------------------
-# Publicación periódica segura (NO publicar MQTT dentro de Timer callback)
-_next_pub_ms = 0
-_pub_interval_ms = 3000  # inicial
+# Keepalive de estado: si no hubo cambios, republicar cada 30..60 s
+# (aleatorio para que varias placas no publiquen todas juntas)
+KEEPALIVE_MIN_MS = 30000
+KEEPALIVE_MAX_MS = 60000
 
-def _armar_siguiente_pub():
-    global _next_pub_ms, _pub_interval_ms
-    # intervalo aleatorio 2..5 segundos (2000..5000ms)
-    _pub_interval_ms = 2000 + (urandom.getrandbits(16) % 3001)
-    _next_pub_ms = time.ticks_add(time.ticks_ms(), _pub_interval_ms)
+def _intervalo_pub_ms():
+    return KEEPALIVE_MIN_MS + (urandom.getrandbits(16) % (KEEPALIVE_MAX_MS - KEEPALIVE_MIN_MS + 1))
+
+
+# -------------------------
+# Configuración remota (topico_cmd/config)
+#   {"MQTT_HOST": "10.0.0.5", "seq": 7}  -> guarda en config.ini y responde
+#   {"get": "config"}                    -> solo responde
+# Respuesta en topico_estado/config: {"config": {...}, "cambiadas": [...],
+#   "rechazadas": [...], "reinicio": 0|1, "ack": seq}
+SUFIJO_CONFIG = "/config"
+_CLAVES_ENTERAS = ("MQTT_PORT", "PIN_RELE_")
+
+
+def publicar_config(cambiadas=(), rechazadas=(), reinicio=False, ack=None):
+    if not _mqtt_listo():
+        return
+    config = {k: v for k, v in ST.configuracion().diccionario_valores.items() if k != "WIFI_PASSWORD"}
+    respuesta = {"config": config, "cambiadas": list(cambiadas), "rechazadas": list(rechazadas),
+                 "reinicio": 1 if reinicio else 0}
+    if ack is not None:
+        respuesta["ack"] = ack
+    boot.mqtt.publicar(boot.mqtt.topico_estado + SUFIJO_CONFIG, ujson.dumps(respuesta))
+
+
+# Config de red a prueba (ver Setting.py): plazo para que MQTT conecte
+_prueba_red_ms = None
+
+
+def _iniciar_prueba_red():
+    global _prueba_red_ms
+    _prueba_red_ms = time.ticks_ms()
+
+
+def _confirmar_prueba_red():
+    global _prueba_red_ms
+    if _prueba_red_ms is not None:
+        _prueba_red_ms = None
+        ST.confirmar_prueba()
+
+
+def _revisar_prueba_red():
+    """Sin conectar a MQTT en PRUEBA_TIMEOUT_MS: volver a la red anterior y reiniciar."""
+    if _prueba_red_ms is None or time.ticks_diff(time.ticks_ms(), _prueba_red_ms) < ST.PRUEBA_TIMEOUT_MS:
+        return
+    print("La config de red nueva no conectó a MQTT a tiempo")
+    ST.revertir_prueba()
+    machine.reset()
+
+
+if boot.RED_A_PRUEBA:
+    _iniciar_prueba_red()
+
+
+async def _reiniciar(ms):
+    await asyncio.sleep_ms(ms)  # que salga la respuesta antes
+    machine.reset()
+
+
+def callback_config(msg):
+    data = ujson.loads(msg.decode())
+    seq = data.pop("seq", None)
+    if data.get("get") == "config":
+        publicar_config(ack=seq)
+        return
+
+    cambios, rechazadas = {}, []
+    for clave, valor in data.items():
+        if clave not in ST.CLAVES_REMOTAS:
+            rechazadas.append(clave)
+            continue
+        if clave.startswith(_CLAVES_ENTERAS):
+            try:
+                numero = int(valor)
+            except (TypeError, ValueError):
+                rechazadas.append(clave)
+                continue
+            if clave.startswith("PIN_RELE_") and numero not in ST.PINES_SALIDA:
+                rechazadas.append(clave)  # flash, solo entrada o inexistente: no arrancaría
+                continue
+            if clave == "MQTT_PORT" and not 0 < numero < 65536:
+                rechazadas.append(clave)
+                continue
+        cambios[clave] = valor
+
+    config = ST.configuracion()
+    # red nueva a prueba: si no conecta, tarea_wifi / boot.py vuelven a la anterior
+    if cambios and ST.guardar_prueba(cambios):
+        _iniciar_prueba_red()
+    cambiadas = config.guardar_cambios(cambios) if cambios else []
+    reinicio = any(ST.CLAVES_REMOTAS[k] for k in cambiadas)
+    publicar_config(cambiadas, rechazadas, reinicio, ack=seq)
+
+    if reinicio:
+        asyncio.create_task(_reiniciar(2000))
+    elif "MQTT_HOST" in cambiadas or "MQTT_PORT" in cambiadas:
+        # broker nuevo sin reiniciar: tarea_mqtt reconecta con estos valores
+        boot.mqtt.host, boot.mqtt.port = config.obtener_parametros_servidor_mqtt()
+        boot.mqtt.conectado = False
 
 
 # -------------------------
 # MQTT callback
+def callback_binario(msg):
+    global _modo_binario
+    if len(msg) < 3 or (msg[0] & 0xF0) != VERSION_BIN:
+        return
+    flags, encender, apagar = msg[0], msg[1], msg[2]
+    seq = None
+    if flags & 0x02 and len(msg) >= 5:
+        seq = (msg[3] << 8) | msg[4]
+
+    if encender or apagar:
+        _modo_binario = True
+        aplicar_mascaras(encender, apagar)
+        publicar_estado_reles(ack=seq)
+    elif flags & 0x01 or seq is not None:
+        publicar_estado_reles(ack=seq)
+
+
 def callback_mqtt(topic, msg):
+    t0 = time.ticks_us()
+    try:
+        procesar_mensaje(topic, msg)
+    finally:
+        telemetria.mensaje(time.ticks_diff(time.ticks_us(), t0))
+
+
+_INDICE_RELE = {"l{}".format(i): i - 1 for i in range(1, 9)}
+
+
+def procesar_mensaje(topic, msg):
+    global _modo_binario
     try:
+        if topic.endswith(b"/config"):
+            callback_config(msg)
+            return
+
+        if topic.endswith(b"/agenda"):
+            if agenda.recibir(msg):
+                ejecutar_agenda()
+                publicar_agenda()
+            return
+
+        if topic.endswith(b"/b"):
+            callback_binario(msg)
+            return
+
         if isinstance(msg, (bytes, bytearray)):
             data = ujson.loads(msg.decode())
         else:
             data = ujson.loads(msg)
 
+        seq = data.get("seq")
+
         # 1) pedido de estado (cuando la app abre)
         if data.get("get") == "status":
-            publicar_estado_reles(retain=False)
+            publicar_estado_reles(retain=False, ack=seq)
             return
 
         # 2) compatibilidad cmd/estado
@@ -144,23 +422,38 @@ def callback_mqtt(topic, msg):
             off_time = data.get("off", 1000)
             iniciar_timer(on_time, off_time)
 
-        # 3) Control relés l1..l8
+        # 3) Control relés l1..l8 (con "for_ms" es un pulso)
+        for_ms = data.get("for_ms")
         cambio = False
         for i in range(1, 9):
             key = "l{}".format(i)
             if key in data:
                 v = data[key]
-                if v == "on":
-                    rele_set(i, True)
-                    cambio = True
-                elif v == "off":
-                    rele_set(i, False)
+                if v not in ("on", "off"):
+                    continue
+                if for_ms:
+                    pulsos.pulso(i - 1, v == "on", for_ms)
+                else:
+                    pulsos.cancelar(i - 1)
+                    rele_set(i, v == "on")
+                cambio = True
+
+        # 4) Patrones on/off por relé
+        patron = data.get("patron")
+        if isinstance(patron, dict):
+            for key, p in patron.items():
+                if key in _INDICE_RELE and isinstance(p, (list, tuple)) and len(p) >= 2:
+                    pulsos.patron(_INDICE_RELE[key], p[0], p[1], p[2] if len(p) > 2 else 0)
                     cambio = True
 
+        if cambio:
+            _modo_binario = False  # quien manda relés en JSON recibe JSON
+
         # si hubo cambios, publicar estado completo (retain=False para no ensuciar retained)
         # si vos querés que el último estado quede retenido, poné retain=True
-        if cambio:
-            publicar_estado_reles(retain=False)
+        # con "seq" se publica siempre: es la confirmación del comando
+        if cambio or seq is not None:
+            publicar_estado_reles(retain=False, ack=seq)
 
     except Exception as e:
         print("Error callback MQTT:", e)
@@ -181,55 +474,244 @@ def suscribir_y_publicar_inicio():
         pass
 
     boot.mqtt.suscribir(boot.mqtt.topico_cmd, callback_mqtt)
+    boot.mqtt.suscribir(boot.mqtt.topico_cmd + SUFIJO_BIN, callback_mqtt)
+    boot.mqtt.suscribir(boot.mqtt.topico_cmd + SUFIJO_AGENDA, callback_mqtt)
+    boot.mqtt.suscribir(boot.mqtt.topico_cmd + SUFIJO_CONFIG, callback_mqtt)
 
     # Estado inicial
     publicar_estado_reles(retain=True)  # dejamos el “último” retenido como ONLINE y estados actuales
-    _armar_siguiente_pub()
+    publicar_agenda()
 
 
-# IMPORTANTE: llamar al inicio
-suscribir_y_publicar_inicio()
+# -------------------------
+# Telemetría (topico_estado/telemetria, cada TELEMETRIA_CADA_S)
+# vuelta_*: cada tarea mide su paso de trabajo entre dos await (sin las
+# esperas), o sea cuánto tiene tomado el loop de uasyncio cada vez.
+TELEMETRIA_CADA_S = 60
+telemetria = TL.Telemetria(TELEMETRIA_CADA_S)
+
+
+def publicar_telemetria():
+    if not _mqtt_listo():
+        return
+    rssi, reconex_wifi = None, 0
+    if hasattr(boot, "wifi"):
+        rssi = boot.wifi.obtener_intensidad_senal()
+        reconex_wifi = boot.wifi.reconexiones
+    boot.mqtt.publicar(boot.mqtt.topico_estado + "/telemetria", telemetria.reporte(rssi, reconex_wifi))
 
 
 # -------------------------
-# Loop principal
-contador = 0
+# Reporte de tiempos de arranque (una vez, al conectar MQTT por primera vez)
+_arranque_publicado = False
 
+
+def publicar_arranque():
+    global _arranque_publicado
+    if _arranque_publicado or not _mqtt_listo():
+        return
+    boot.marcar("mqtt_conectado")
+    reporte = {"fases_ms": boot.tiempos, "causa_reset": machine.reset_cause()}
+    if boot.mqtt.publicar(boot.mqtt.topico_estado + "/arranque", ujson.dumps(reporte)):
+        _arranque_publicado = True
+
+
+# -------------------------
+# Tareas uasyncio
+# El scheduler duerme en poll() hasta que el socket MQTT tiene datos o vence
+# algún sleep, así un comando se aplica en ms y en reposo la CPU no gira.
 try:
+    _io = asyncio.core._io_queue
+except AttributeError:
+    _io = None  # uasyncio viejo: se cae a sondeo corto
+
+ESPERA_MQTT_MS = 1000   # tope de espera sin datos (para notar desconexiones)
+PERIODO_WIFI_MS = 500   # paso de la máquina de estados del WiFi
+SONDEO_MQTT_MS = 20     # solo sin _io_queue
+
+
+def _esperar_lectura(sock):
+    # mismo mecanismo que usa uasyncio.Stream.read
+    yield _io.queue_read(sock)
+
+
+async def _esperar_datos(sock):
+    if _io is None:
+        await asyncio.sleep_ms(SONDEO_MQTT_MS)
+        return
+    try:
+        await asyncio.wait_for_ms(_esperar_lectura(sock), ESPERA_MQTT_MS)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def tarea_mqtt():
+    """Recepción de comandos + reconexión con backoff (2..30 s) sin bloquear el resto."""
+    espera_s = 2
     while True:
-        # Cada ~30s verificar WiFi
-        if contador % 30 == 0 and hasattr(boot, "wifi"):
+        if not hasattr(boot, "mqtt"):
+            await asyncio.sleep(5)
+            continue
+
+        if hasattr(boot, "wifi") and not boot.wifi.conectado:
+            # sin WiFi no tiene sentido intentar el broker; el socket viejo ya no sirve
+            boot.mqtt.conectado = False
+            await asyncio.sleep(1)
+            continue
+
+        mqtt = boot.mqtt
+        sock = mqtt.socket() if mqtt.conectado else None
+        if sock is None:
+            t0 = time.ticks_us()
             try:
-                boot.wifi.verificar_conexion(auto_reconectar=True)
+                if mqtt.reconectar(min_interval_s=0):
+                    _confirmar_prueba_red()
+                    if _arranque_publicado:
+                        telemetria.reconexion_mqtt()
+                    suscribir_y_publicar_inicio()
+                    publicar_arranque()
+                    espera_s = 2
+                    telemetria.vuelta(time.ticks_diff(time.ticks_us(), t0))
+                    continue
             except Exception as e:
-                print("Error wifi.verificar_conexion:", e)
+                print("Error MQTT reconectar:", e)
+            telemetria.vuelta(time.ticks_diff(time.ticks_us(), t0))
+            await asyncio.sleep(espera_s)
+            espera_s = min(espera_s * 2, 30)
+            continue
+
+        await _esperar_datos(sock)
+        t0 = time.ticks_us()
+        ok = mqtt.verificar_mensajes()
+        telemetria.vuelta(time.ticks_diff(time.ticks_us(), t0))
+        telemetria.memoria()
+        if not ok:
+            print("MQTT caído, reconectando...")
+
+
+async def tarea_heartbeat():
+    """
+    Keepalive (online + estados, retain=False) si no se publicó nada en 30-60s.
+    Los cambios de relés ya se publican al momento desde el callback.
+    Entre medio manda PINGREQ para que el broker no corte por keepalive MQTT.
+    """
+    intervalo = _intervalo_pub_ms()
+    while True:
+        restante = time.ticks_diff(time.ticks_add(_ultima_pub_ms, intervalo), time.ticks_ms())
+        if restante > 0:
+            await asyncio.sleep_ms(min(restante, 10000))
+        if not (hasattr(boot, "mqtt") and boot.mqtt.conectado):
+            await asyncio.sleep(1)
+            continue
+        t0 = time.ticks_us()
+        try:
+            if time.ticks_diff(time.ticks_ms(), time.ticks_add(_ultima_pub_ms, intervalo)) >= 0:
+                publicar_estado_reles(retain=False)
+                intervalo = _intervalo_pub_ms()
+            else:
+                boot.mqtt.mantener_vivo()
+        except Exception as e:
+            print("Error publicando estado periódico:", e)
+        telemetria.vuelta(time.ticks_diff(time.ticks_us(), t0))
 
-        # MQTT: mensajes + reconexión
-        if hasattr(boot, "mqtt"):
-            try:
-                boot.mqtt.verificar_mensajes()
-            except Exception as e:
-                print("Error MQTT verificar_mensajes:", e)
-                try:
-                    boot.mqtt.reconectar()
-                    suscribir_y_publicar_inicio()
-                except Exception as e2:
-                    print("Error MQTT reconectar:", e2)
 
-            # ✅ Heartbeat periódico (online + estados) cada 2-5s (retain=False)
+async def tarea_wifi():
+    """
+    Avanza la conexión WiFi sin bloquear (ver WiFi.avanzar) y sincroniza la
+    hora por NTP al conectar y cada 6 h (si falla, reintenta con backoff).
+    """
+    while True:
+        if hasattr(boot, "wifi"):
+            t0 = time.ticks_us()
             try:
-                if time.ticks_diff(time.ticks_ms(), _next_pub_ms) >= 0:
-                    publicar_estado_reles(retain=False)
-                    _armar_siguiente_pub()
+                if boot.wifi.avanzar():
+                    boot.marcar("wifi_conectado")
+                    if toca_ntp():
+                        sincronizar_hora()
             except Exception as e:
-                print("Error publicando estado periódico:", e)
-                _armar_siguiente_pub()
+                print("Error WiFi:", e)
+            telemetria.vuelta(time.ticks_diff(time.ticks_us(), t0))
+        _revisar_prueba_red()
+        await asyncio.sleep_ms(PERIODO_WIFI_MS)
+
+
+PULSOS_PUB_MIN_MS = 250  # un patrón de 50/50 ms no publica 20 veces por segundo
+
+
+async def tarea_pulsos():
+    """
+    Publica el estado cuando un pulso/patrón cambió un relé desde el timer.
+    A lo sumo una vez cada PULSOS_PUB_MIN_MS: lo que cambia mientras tanto
+    sale junto en la siguiente, así el estado final siempre se publica.
+    """
+    global _pulsos_cambio
+    ultima_ms = time.ticks_add(time.ticks_ms(), -PULSOS_PUB_MIN_MS)
+    while True:
+        if _flag_pulsos is not None:
+            await _flag_pulsos.wait()
+        else:
+            await asyncio.sleep_ms(50)
+        if not _pulsos_cambio:
+            continue
+        espera_ms = PULSOS_PUB_MIN_MS - time.ticks_diff(time.ticks_ms(), ultima_ms)
+        if espera_ms > 0:
+            await asyncio.sleep_ms(espera_ms)
+        _pulsos_cambio = False
+        ultima_ms = time.ticks_ms()
+        t0 = time.ticks_us()
+        try:
+            publicar_estado_reles()
+        except Exception as e:
+            print("Error publicando estado (pulsos):", e)
+        telemetria.vuelta(time.ticks_diff(time.ticks_us(), t0))
 
-        time.sleep(1)
-        contador += 1
+
+async def tarea_telemetria():
+    while True:
+        await asyncio.sleep(TELEMETRIA_CADA_S)
+        try:
+            publicar_telemetria()  # reporte() reinicia la ventana: este paso no se mide
+        except Exception as e:
+            print("Error telemetría:", e)
+
+
+async def tarea_agenda():
+    """Duerme hasta la próxima entrada de la agenda (a lo sumo 1 s, por si llega otra tabla)."""
+    while True:
+        proxima = agenda.proxima() if AG.rtc_valido() else None
+        if proxima is None:
+            await asyncio.sleep(1)
+            continue
+        espera_ms = AG.ms_hasta(proxima)
+        if espera_ms > 0:
+            await asyncio.sleep_ms(min(espera_ms, 1000))
+            continue
+        t0 = time.ticks_us()
+        try:
+            ejecutar_agenda()
+        except Exception as e:
+            print("Error agenda:", e)
+        telemetria.vuelta(time.ticks_diff(time.ticks_us(), t0))
+
+
+async def principal():
+    asyncio.create_task(tarea_wifi())
+    asyncio.create_task(tarea_heartbeat())
+    asyncio.create_task(tarea_agenda())
+    asyncio.create_task(tarea_telemetria())
+    asyncio.create_task(tarea_pulsos())
+    await tarea_mqtt()
+
+
+# -------------------------
+# Loop principal
+boot.marcar("main_listo")
+try:
+    asyncio.run(principal())
 
 except KeyboardInterrupt:
     detener_timer()
+    pulsos.detener()
     # marcar offline retenido al salir “bien”
     try:
         publicar_offline_retenido()
@@ -240,3 +722,6 @@ except KeyboardInterrupt:
             boot.mqtt.desconectar()
         except Exception as e:
             print("Error MQTT desconectar:", e)
+
+finally:
+    asyncio.new_event_loop()
@@ -1,8 +1,22 @@
 import network
 import time
+import urandom
 import Setting as ST
 
 
+# Estados de la máquina de conexión (ver avanzar())
+INACTIVO = "inactivo"
+CONECTANDO = "conectando"
+CONECTADO = "conectado"
+ESPERA = "espera"
+
+# wlan.status() que indican que el intento ya falló (no todos los ports los tienen)
+_FALLOS = tuple(
+    getattr(network, n) for n in ("STAT_WRONG_PASSWORD", "STAT_NO_AP_FOUND", "STAT_CONNECT_FAIL")
+    if hasattr(network, n)
+)
+
+
 class WiFi:
     def __init__(self):
         self.configuracion = ST.configuracion()
@@ -11,6 +25,14 @@ class WiFi:
         self.conectado = False
         self.intentos_maximos = 10
         self.timeout_conexion = 10
+
+        # Máquina de estados no bloqueante
+        self.estado = INACTIVO
+        self.espera_min_ms = 1000
+        self.espera_max_ms = 60000
+        self._espera_ms = self.espera_min_ms
+        self._t_estado = time.ticks_ms()
+        self.reconexiones = 0
     
     def conectar(self, mostrar_progreso=True):
         """
@@ -25,6 +47,7 @@ class WiFi:
         if self.wlan.isconnected():
             print("Ya conectado a WiFi")
             self.conectado = True
+            self.estado = CONECTADO
             return True
         
         # Activar interfaz WiFi
@@ -52,6 +75,7 @@ class WiFi:
             print()
         
         self.conectado = True
+        self.estado = CONECTADO
         config = self.wlan.ifconfig()
         print("Conectado a WiFi exitosamente!")
         print("IP:", config[0])
@@ -71,7 +95,9 @@ class WiFi:
     
     def reconectar(self, intentos=None):
         """
-        Intenta reconectar al WiFi en caso de pérdida de conexión
+        Intenta reconectar al WiFi en caso de pérdida de conexión.
+        Bloquea (hasta ~2 min con los valores por defecto): desde el loop
+        principal usar avanzar().
         
         Args:
             intentos: Número máximo de intentos (None usa intentos_maximos)
@@ -106,27 +132,82 @@ class WiFi:
         self.conectado = False
         return False
     
-    def verificar_conexion(self, auto_reconectar=True):
+    def _intentar(self, ahora):
+        try:
+            self.wlan.active(True)
+            # boot.py corre dos veces (firmware + import boot): no cortar un intento en curso
+            if self.wlan.status() != getattr(network, "STAT_CONNECTING", None):
+                self.wlan.connect(self.ssid, self.password)
+        except Exception as e:
+            print("Error WiFi connect:", e)
+            self._esperar(ahora)
+            return
+        self.estado = CONECTANDO
+        self._t_estado = ahora
+
+    def _esperar(self, ahora):
+        try:
+            self.wlan.disconnect()
+        except Exception:
+            pass
+        # backoff exponencial con un poco de azar (varias placas, mismo AP)
+        espera = self._espera_ms + urandom.getrandbits(10)
+        print("WiFi: reintento en {} ms".format(espera))
+        self._espera_ms = min(self._espera_ms * 2, self.espera_max_ms)
+        self.estado = ESPERA
+        self._t_estado = time.ticks_add(ahora, espera)
+
+    def avanzar(self):
         """
-        Verifica si el WiFi está conectado
-        
-        Args:
-            auto_reconectar: Si True, intenta reconectar automáticamente si se perdió la conexión
-            
+        Un paso de la máquina de estados (inactivo/conectando/conectado/espera).
+        No bloquea nunca: se llama en cada vuelta del loop y la conexión avanza
+        de fondo, así relés, agenda y LED siguen andando durante un corte.
+
         Returns:
-            bool: True si está conectado (o se reconectó), False en caso contrario
+            bool: True si hay conexión
         """
+        ahora = time.ticks_ms()
         if self.wlan.isconnected():
+            if self.estado != CONECTADO:
+                if self.estado != INACTIVO:
+                    self.reconexiones += 1
+                print("WiFi conectado, IP:", self.wlan.ifconfig()[0])
+                self.estado = CONECTADO
+                self._espera_ms = self.espera_min_ms
             self.conectado = True
             return True
-        
-        print("Conexión WiFi perdida")
+
         self.conectado = False
+        if self.estado == CONECTADO:
+            print("Conexión WiFi perdida")
+            self._intentar(ahora)
+        elif self.estado == INACTIVO:
+            self._intentar(ahora)
+        elif self.estado == CONECTANDO:
+            vencido = time.ticks_diff(ahora, self._t_estado) > self.timeout_conexion * 1000
+            if vencido or self.wlan.status() in _FALLOS:
+                print("Timeout/fallo WiFi (status {})".format(self.wlan.status()))
+                self._esperar(ahora)
+        elif self.estado == ESPERA:
+            if time.ticks_diff(ahora, self._t_estado) >= 0:
+                self._intentar(ahora)
+        return False
+
+    def verificar_conexion(self, auto_reconectar=True):
+        """
+        Verifica si el WiFi está conectado
         
+        Args:
+            auto_reconectar: Si True, avanza la reconexión (sin bloquear, ver avanzar())
+            
+        Returns:
+            bool: True si está conectado, False en caso contrario
+        """
         if auto_reconectar:
-            return self.reconectar()
-        
-        return False
+            return self.avanzar()
+
+        self.conectado = self.wlan.isconnected()
+        return self.conectado
     
     def obtener_info(self):
         """